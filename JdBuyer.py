@@ -6,16 +6,24 @@ import os
 from config import global_config
 from log import logger
 from exception import JDException
-from JdSession import Session
+from JdSession import Session, _option
 from timer import Timer
+from scheduler import PollScheduler
+from watchlist import Watchlist, DEFAULT_WATCH_CONCURRENCY
+from retry import classify
+from exporter import MetricsServer, DEFAULT_METRICS_HOST
 from utils import (
     save_image,
     open_image,
     close_image,
     send_wechat,
-    is_process_running
+    is_process_running,
+    parse_sku_id
 )
 
+# 每查询多少次库存输出一次统计
+POLL_REPORT_EVERY = 100
+
 
 class Buyer(object):
     """
@@ -258,7 +266,7 @@ class Buyer(object):
         return True
 
     ############## 外部方法 #############
-    def buyItemInStock(self, skuId, areaId, skuNum=1, stockInterval=3, submitRetry=3, submitInterval=5, buyTime='2022-08-06 00:00:00'):
+    def buyItemInStock(self, skuId, areaId, skuNum=1, stockInterval=3, submitRetry=3, submitInterval=5, buyTime='2022-08-06 00:00:00', warmup=0):
         """根据库存自动下单商品
         :skuId 商品sku
         :areaId 下单区域id
@@ -267,26 +275,144 @@ class Buyer(object):
         :submitRetry 下单尝试次数
         :submitInterval 下单尝试间隔（单位秒）
         :buyTime 定时执行
+        :warmup 定时前多少秒开始预热（单位秒），0 为不预热
         """
         self.session.fetchItemDetail(skuId)
-        timer = Timer(buyTime)
+        self.session.startHeartbeat()
+        timer = Timer(buyTime, serverClock=self.session.serverClock)
+        if warmup > 0 and timer.remaining() <= 0:
+            # 已过定时时间，不能跳过库存查询直接下单
+            logger.info('已过定时时间，跳过预热，直接开始查询库存')
+        elif warmup > 0:
+            timer.start(lead=warmup)
+            if self.session.prewarm(skuId, skuNum, areaId):
+                timer.start()
+                # 到点后直接提交订单，失败再进入库存查询
+                if self.session.trySubmitOrder(skuId, skuNum, areaId, submitRetry, submitInterval):
+                    logger.info('下单成功')
+                    if self.enableWx:
+                        send_wechat(
+                            message='JdBuyerApp', desp='您的商品已下单成功，请及时支付订单', sckey=self.scKey)
+                    return
         timer.start()
 
+        scheduler = PollScheduler.fromConfig(stockInterval)
+        pollCount = 0
         while True:
+            # 按固定节拍查询，请求耗时不计入间隔
+            scheduler.wait()
+            pollCount += 1
+            if pollCount % POLL_REPORT_EVERY == 0:
+                self.reportPollStats(pollCount, scheduler)
             try:
-                if not self.session.getItemStock(skuId, skuNum, areaId):
-                    logger.info('不满足下单条件，{0}s后进行下一次查询'.format(stockInterval))
-                else:
+                # 每次查询开始一次追踪，有货并进入下单时才输出，从发现库存到提交订单在同一条追踪中
+                with self.session.tracer.trace('buyItemInStock', sku=skuId) as trace:
+                    start = time.perf_counter()
+                    inStock = self.session.getItemStock(skuId, skuNum, areaId)
+                    scheduler.record(inStock)
+                    if not inStock:
+                        if trace is not None:
+                            trace.keep = False
+                        logger.info('不满足下单条件，{0:g}s后进行下一次查询'.format(scheduler.currentInterval()),
+                                    extra={'topic': 'poll_{0}'.format(skuId), 'latency': time.perf_counter() - start})
+                        continue
                     logger.info('{0} 满足下单条件，开始执行'.format(skuId))
-                    if self.session.trySubmitOrder(skuId, skuNum, areaId, submitRetry, submitInterval):
-                        logger.info('下单成功')
-                        if self.enableWx:
-                            send_wechat(
-                                message='JdBuyerApp', desp='您的商品已下单成功，请及时支付订单', sckey=self.scKey)
-                        return
+                    ordered = self.session.trySubmitOrder(skuId, skuNum, areaId, submitRetry, submitInterval)
+                if ordered:
+                    logger.info('下单成功')
+                    self.reportPollStats(pollCount, scheduler)
+                    if self.enableWx:
+                        send_wechat(
+                            message='JdBuyerApp', desp='您的商品已下单成功，请及时支付订单', sckey=self.scKey)
+                    return
             except Exception as e:
-                logger.error(e)
-            time.sleep(stockInterval)
+                # 可重试的网络错误已由 Session.request 退避重试，这里只记录并等待下一个节拍
+                logger.error('查询库存或下单出错({0}): {1}'.format(classify(exc=e), e))
+
+    def buyItemsInStock(self, skuIds, areaId, stockInterval=3, submitRetry=3, submitInterval=5,
+                        buyTime='2022-08-06 00:00:00', stockIntervals=None,
+                        concurrency=DEFAULT_WATCH_CONCURRENCY, warmup=0):
+        """同时监听多个商品库存，任一商品有货即自动下单
+        :skuIds 商品id字符串，如 '123:2,456'，冒号后为购买数量
+        :areaId 下单区域id
+        :stockInterval 默认库存查询间隔（单位秒）
+        :submitRetry 下单尝试次数
+        :submitInterval 下单尝试间隔（单位秒）
+        :buyTime 定时执行
+        :stockIntervals 单个商品的库存查询间隔，如 '123:1,456:5'
+        :concurrency 同时进行的库存查询数上限
+        :warmup 定时前多少秒开始预热连接（单位秒），0 为不预热
+        """
+        watchlist = Watchlist(self.session, skuIds, areaId, stockInterval, stockIntervals, concurrency,
+                              asyncIO=self.session.asyncIO)
+        for skuId in watchlist.skus:
+            self.session.fetchItemDetail(skuId)
+        self.session.startHeartbeat()
+        timer = Timer(buyTime, serverClock=self.session.serverClock)
+        if warmup > 0:
+            # 不确定哪个商品先有货，只预先建立连接
+            timer.start(lead=warmup)
+            logger.info('预热连接耗时 {0:.0f} ms'.format(self.session.warmConnections() * 1000))
+        timer.start()
+
+        while True:
+            found = watchlist.run()
+            if found is None:
+                return
+            skuId, skuNum = found
+            logger.info('{0} 满足下单条件，开始执行'.format(skuId))
+            try:
+                if self.session.trySubmitOrder(skuId, skuNum, areaId, submitRetry, submitInterval):
+                    logger.info('下单成功')
+                    self.reportPollStats(sum(watchlist.pollCounts.values()))
+                    watchlist.report()
+                    if self.enableWx:
+                        send_wechat(
+                            message='JdBuyerApp', desp='您的商品已下单成功，请及时支付订单', sckey=self.scKey)
+                    return
+            except Exception as e:
+                # 可重试的网络错误已由 Session.request 退避重试，这里只记录并等待下一个节拍
+                logger.error('查询库存或下单出错({0}): {1}'.format(classify(exc=e), e))
+
+    def reportPollStats(self, pollCount, scheduler=None):
+        """输出库存查询中因页面未变化而省去解析的次数、查询节拍、连接复用、各接口耗时、调试页面、各阶段耗时和请求各阶段耗时统计
+        :param pollCount: 已查询次数
+        :param scheduler: 查询调度器
+        """
+        revalidator = self.session.pageRevalidator
+        logger.info('已查询库存{0}次，其中{1}次页面未变化跳过解析(304: {2}次，指纹未变: {3}次)'.format(
+            pollCount, revalidator.saved(), revalidator.notModifiedCount, revalidator.unchangedCount))
+        if scheduler:
+            logger.info('库存查询节拍: {0}'.format(scheduler.report()))
+        logger.info('连接复用: {0}'.format(self.session.hostPools.report()))
+        for line in self.session.timeouts.report():
+            logger.info('接口耗时 {0}'.format(line))
+        if self.session.hedger is not None:
+            logger.info('对冲请求: {0}'.format(self.session.hedger.report()))
+        logger.info('调试页面: {0}'.format(self.session.debugWriter.report()))
+        for line in self.session.tracer.report():
+            logger.info('阶段耗时 {0}'.format(line))
+        for line in self.session.httpTimings.report():
+            logger.info('请求阶段耗时 {0}'.format(line))
+
+
+def start_buy(buyer, skuId, areaId, skuNum, stockInterval, submitRetry, submitInterval, buyTime):
+    """根据配置的商品数量选择单商品或多商品监听，配置了 metrics_port 时同时开启指标接口"""
+    metricsPort = _option('metrics_port', 0, int)
+    if metricsPort:
+        try:
+            MetricsServer(buyer.session, _option('metrics_host', DEFAULT_METRICS_HOST), metricsPort).start()
+        except OSError as e:
+            logger.error('指标接口开启失败: {0}'.format(e))
+    warmup = _option('warmup', 0, float, section='item')
+    if len(parse_sku_id(skuId)) > 1 or ':' in skuId:
+        stockIntervals = _option('stock_intervals', None, section='item')
+        concurrency = _option('watch_concurrency', DEFAULT_WATCH_CONCURRENCY, int, section='item')
+        buyer.buyItemsInStock(skuId, areaId, stockInterval, submitRetry, submitInterval, buyTime,
+                              stockIntervals, concurrency, warmup)
+    else:
+        buyer.buyItemInStock(skuId, areaId, skuNum, stockInterval,
+                             submitRetry, submitInterval, buyTime, warmup)
 
 
 def show_usage():
@@ -343,8 +469,8 @@ if __name__ == '__main__':
                 sys.exit(1)
             logger.info("登录成功，开始购买商品")
             
-            buyer.buyItemInStock(skuId, areaId, skuNum, stockInterval,
-                             submitRetry, submitInterval, buyTime)
+            start_buy(buyer, skuId, areaId, skuNum, stockInterval,
+                      submitRetry, submitInterval, buyTime)
         else:
             show_usage()
             sys.exit(1)
@@ -355,5 +481,5 @@ if __name__ == '__main__':
             sys.exit(1)
         logger.info("登录成功，开始购买商品")
         
-        buyer.buyItemInStock(skuId, areaId, skuNum, stockInterval,
-                         submitRetry, submitInterval, buyTime)
+        start_buy(buyer, skuId, areaId, skuNum, stockInterval,
+                  submitRetry, submitInterval, buyTime)
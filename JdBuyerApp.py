@@ -19,6 +19,8 @@ from PySide6.QtWidgets import (
 
 from timer import Timer
 from JdSession import Session
+from watchlist import Watchlist
+from utils import parse_sku_id
 
 NUM_LABEL_FORMAT = '商品购买数量[{0}]个'
 STOCK_LABEL_FORMAT = '库存查询间隔[{0}]秒'
@@ -270,12 +272,19 @@ class BuyerThread(QThread):
         self.session = session
         self.taskParam = taskParam
         self._isPause = False
+        self._watchlist = None
 
     def pause(self):
         self._isPause = True
+        if self._watchlist:
+            self._watchlist.stop()
 
     def run(self):
         sku_id = self.taskParam.get('skuId')
+        if len(parse_sku_id(sku_id)) > 1 or ':' in sku_id:
+            self.runWatchlist()
+            return
+
         area_id = self.taskParam.get('areaId')
         count = self.taskParam.get('count')
         stock_interval = self.taskParam.get('stockInterval')
@@ -285,7 +294,7 @@ class BuyerThread(QThread):
         submitRetry = 3
         submitInterval = 5
 
-        timer = Timer(buyTime)
+        timer = Timer(buyTime, serverClock=self.session.serverClock)
         self.infoSignal.emit('定时中，将于 {0} 开始执行'.format(buyTime))
         timer.start()
 
@@ -311,6 +320,40 @@ class BuyerThread(QThread):
                 self.infoSignal.emit(e)
             time.sleep(stock_interval)
 
+    def runWatchlist(self):
+        """同时监听多个商品，SKU 格式如 123:2,456"""
+        area_id = self.taskParam.get('areaId')
+        stock_interval = self.taskParam.get('stockInterval')
+        buyTime = self.taskParam.get('buyTime')
+        submitRetry = 3
+        submitInterval = 5
+
+        self._watchlist = Watchlist(self.session, self.taskParam.get('skuId'), area_id, stock_interval,
+                                    asyncIO=self.session.asyncIO)
+        for sku_id in self._watchlist.skus:
+            self.session.fetchItemDetail(sku_id)
+
+        timer = Timer(buyTime, serverClock=self.session.serverClock)
+        self.infoSignal.emit('定时中，将于 {0} 开始执行'.format(buyTime))
+        timer.start()
+
+        while not self._isPause:
+            self.infoSignal.emit('{0} 正在监听{1}个商品库存'.format(
+                time.strftime(DATA_FORMAT, time.localtime()), len(self._watchlist.skus)))
+            found = self._watchlist.run()
+            if found is None:
+                break
+            sku_id, count = found
+            self.infoSignal.emit('{0} 满足下单条件，开始执行'.format(sku_id))
+            try:
+                if self.session.trySubmitOrder(sku_id, count, area_id, submitRetry, submitInterval):
+                    self.infoSignal.emit('下单成功')
+                    return
+            except Exception as e:
+                self.infoSignal.emit(str(e))
+        self.infoSignal.emit('{0} 已取消下单'.format(
+            time.strftime(DATA_FORMAT, time.localtime())))
+
 
 def main():
 
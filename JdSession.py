@@ -1,4 +1,5 @@
 # -*- coding:utf-8 -*-
+import configparser
 import json
 import os
 import sys
@@ -6,15 +7,105 @@ import pickle
 import random
 import time
 import re
+import threading
+import logging
 import requests
+from contextlib import contextmanager
 
 from lxml import etree
-from log import logger
+from config import global_config
+from log import logger, flush_logs, LazyJson
+from clock import ClockOffsetEstimator
+from pools import HostPools, Heartbeat, DEFAULT_POOL_MAXSIZE, DEFAULT_HEARTBEAT_INTERVAL
+from transport import make_transport, abort_response, TRANSPORT_REQUESTS, DEFAULT_HTTP2_HOSTS
+from metrics import AdaptiveTimeouts, RequestStats, PollStats, POLL_FAILED, POLL_ERROR, endpoint_of
+from events import EventLog, recorded, succeeded, event_fields, annotate, annotate_response
+from tracing import Tracer, traced, TRACE_DIR, CAT_HTTP
+from httptiming import HttpTimings, instrument
+from hedge import Hedger, DEFAULT_HEDGE_PERCENTILE, DEFAULT_HEDGE_MAX_INFLIGHT
+from capture import (
+    DebugWriter, DEFAULT_CAPTURE_MODE, DEFAULT_CAPTURE_KEEP, DEFAULT_CAPTURE_MAX_BYTES, DEFAULT_CAPTURE_QUEUE_SIZE,
+    DEFAULT_CAPTURE_STORE
+)
+from retry import OK, FAILED, Backoff, Deadline, RetryPolicy, CONNECTION
+from itempage import (
+    IN_STOCK,
+    ITEM_PAGE_MARKERS,
+    ITEM_PAGE_TTL,
+    OUT_OF_STOCK,
+    STOCK_CHUNK_SIZE,
+    ItemPageCache,
+    PageRevalidator,
+    StockProbe,
+    parse_item_page
+)
 
 DEFAULT_TIMEOUT = 10
+
+# 预热阶段预先建立连接的下单相关域名
+WARMUP_URLS = (
+    'https://cart.jd.com/',
+    'https://api.m.jd.com/',
+    'https://trade.jd.com/',
+)
+# 预热准备好的购物车和结算参数的有效期(秒)
+PREPARED_ORDER_TTL = 60
+# 结算页参数(eid、fp、riskControl、TrackID)的最长有效期(秒)
+CHECKOUT_PARAMS_TTL = 300
+# 提交订单返回这些结果码时，说明结算页参数已失效
+STALE_CHECKOUT_CODES = (0, 60077)
+STALE_CHECKOUT_MESSAGES = ('刷新', '过期', '失效')
+# 单次库存查询(含重试)的默认时间预算(秒)
+DEFAULT_POLL_DEADLINE = 5
+# 单个请求默认最多尝试次数
+DEFAULT_REQUEST_ATTEMPTS = 3
+# 一次下单流程的默认时间预算(秒)
+DEFAULT_ORDER_DEADLINE = 30
+# 下单重试间隔的随机抖动比例
+ORDER_RETRY_JITTER = 0.2
+# 提交订单请求只在连接失败（请求没有发出）时重试；超时、5xx 或网关 403 时订单可能已经创建，
+# 自动重发会重复下单，是否再次提交由下单流程按 submit_retry 决定
+SUBMIT_BACKOFF = {
+    CONNECTION: Backoff(0.1, 2.0, 1.0),
+}
+# 改变服务端状态的请求（发送/校验验证码、购物车操作、保存发票）只在连接失败（请求没有发出）时重试，
+# 超时或 5xx 时服务端可能已经处理，重发会重复发送验证码或重复加购
+MUTATION_BACKOFF = {
+    CONNECTION: Backoff(0.1, 2.0, 1.0),
+}
 # DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/66.0.3359.181 Safari/537.36'
 DEFAULT_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36'
 
+
+
+def _boolean(value):
+    """按 configparser 的规则把 true/false、yes/no、on/off、1/0 转换为 bool"""
+    try:
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError(value)
+
+
+def _option(name, default, conv=str, section='config'):
+    """读取 config.ini 中的配置项
+    :param name: 配置项名称
+    :param default: 未配置或值为空时使用的默认值
+    :param conv: 转换函数，转换失败时记录警告并使用默认值
+    :param section: 配置项所在的节
+    :return: 转换后的值
+    """
+    if not global_config.has_option(section, name):
+        return default
+    value = global_config.get(section, name)
+    if not value:
+        return default
+    try:
+        return conv(value)
+    except (TypeError, ValueError):
+        logger.warning('配置项 [%s] %s 的值 %r 无效，使用默认值 %r', section, name, value, default)
+        return default
+
+
 if getattr(sys, 'frozen', False):
     absPath = os.path.dirname(os.path.abspath(sys.executable))
 elif __file__:
@@ -35,7 +126,30 @@ class Session(object):
         self.username = 'jd'
         self.isLogin = False
         self.password = None
-        self.sess = requests.session()
+        # 从响应的 Date 头估计服务器时钟偏差
+        self.serverClock = ClockOffsetEstimator()
+        # 下单相关域名各自的连接池
+        self.hostPools = HostPools(poolMaxsize=_option('pool_maxsize', DEFAULT_POOL_MAXSIZE, int))
+        # 按接口自适应的请求超时，adaptive_timeout 为 false 时始终使用默认超时
+        self.timeouts = AdaptiveTimeouts(self.timeout, enabled=_option('adaptive_timeout', True, _boolean))
+        # 按接口统计 DNS/连接/TLS/首字节/下载各阶段耗时，http_timing 为 false 时不统计
+        self.httpTimings = HttpTimings(_option('http_timing', True, _boolean))
+        # 从启动起累计的各接口耗时、状态码和库存查询结论，供指标接口输出
+        self.requestStats = RequestStats()
+        self.pollStats = PollStats()
+        # 当前线程的截止时间，见 within()
+        self._local = threading.local()
+        self.sess = self._newHttpSession()
+        # 连接保活心跳，heartbeat_interval 为 0 时不开启
+        heartbeatInterval = _option('heartbeat_interval', DEFAULT_HEARTBEAT_INTERVAL, float)
+        self.heartbeat = Heartbeat(self, heartbeatInterval) if heartbeatInterval > 0 else None
+        # 传输层：requests(默认) 或 http2，http2 只用于 http2_hosts 中的域名
+        http2Hosts = _option('http2_hosts', DEFAULT_HTTP2_HOSTS,
+                             lambda value: [host.strip() for host in value.split(',') if host.strip()])
+        self.transport = make_transport(self, _option('transport', TRANSPORT_REQUESTS),
+                                        http2Hosts or DEFAULT_HTTP2_HOSTS)
+        # 多商品监听是否使用 asyncsession.AsyncSession 在事件循环中直接查询库存
+        self.asyncIO = _option('async_io', False, _boolean)
         # 短信登录相关参数
         self.s_token = None
         self.guid = None
@@ -47,6 +161,14 @@ class Session(object):
         self.fp = ''
         self.risk_control = ''
         self.track_id = ''
+        # 预热阶段准备好的下单信息
+        self.preparedOrder = None
+        # 已构建好的提交订单请求 (结算参数, PreparedRequest, 发送参数)
+        self._submitRequest = None
+        # 结算页参数缓存：最近一次结算信息、获取时间，以及省去的结算页请求次数
+        self.checkoutDetail = None
+        self.checkoutFetchedAt = None
+        self.checkoutSavedCount = 0
         
         # 反爬参数
         self.h5st_params = {}
@@ -54,11 +176,45 @@ class Session(object):
         
         # 尝试加载反爬参数
         self._load_anticrawl_params()
+
+        # 流式库存探测：读到库存结论后立即断开，不再下载和解析整页
+        self.streamStock = _option('stream_stock', True, _boolean)
+
+        # 商品页面条件请求与未变化页面跳过解析
+        self.pageRevalidator = PageRevalidator()
+
+        # 商品页面快照，商品信息、库存、预售结算共用一次请求
+        self.itemPages = ItemPageCache(_option('item_page_ttl', ITEM_PAGE_TTL, float))
+
+        # 统一的重试策略和下单流程的时间预算
+        attempts = _option('request_attempts', DEFAULT_REQUEST_ATTEMPTS, int)
+        self.retryPolicy = RetryPolicy(attempts)
+        self.submitPolicy = RetryPolicy(attempts, SUBMIT_BACKOFF)
+        self.mutationPolicy = RetryPolicy(attempts, MUTATION_BACKOFF)
+        self.orderDeadline = _option('order_deadline', DEFAULT_ORDER_DEADLINE, float)
+        self.pollDeadline = _option('poll_deadline', DEFAULT_POLL_DEADLINE, float)
+        # 库存查询的对冲请求，默认关闭
+        self.hedger = None
+        if _option('hedge_stock', False, _boolean):
+            self.hedger = Hedger(_option('hedge_percentile', DEFAULT_HEDGE_PERCENTILE, float),
+                                 _option('hedge_max_inflight', DEFAULT_HEDGE_MAX_INFLIGHT, int))
         
-        # 创建调试目录
+        # 结构化事件日志，默认关闭
+        self.events = EventLog(_option('event_log', False, _boolean))
+        # 下单各阶段耗时追踪，默认开启；trace_export 开启时每次下单尝试导出一个 trace 文件
+        traceDir = os.path.join(absPath, TRACE_DIR) if _option('trace_export', False, _boolean) else None
+        self.tracer = Tracer(_option('trace', True, _boolean), traceDir)
+
+        # 调试页面在后台写入，目录在第一次写入时创建
         self.debug_dir = os.path.join(absPath, 'debug_html')
-        if not os.path.exists(self.debug_dir):
-            os.makedirs(self.debug_dir)
+        self.debugWriter = DebugWriter(
+            self.debug_dir,
+            _option('debug_capture', DEFAULT_CAPTURE_MODE),
+            _option('debug_keep', DEFAULT_CAPTURE_KEEP, int),
+            _option('debug_max_mb', DEFAULT_CAPTURE_MAX_BYTES / 1024 / 1024, float) * 1024 * 1024,
+            _option('debug_compress', False, _boolean),
+            _option('debug_queue_size', DEFAULT_CAPTURE_QUEUE_SIZE, int),
+            _option('debug_store', DEFAULT_CAPTURE_STORE))
             
         # 尝试加载cookies
         logger.info("初始化时尝试加载cookies...")
@@ -105,19 +261,16 @@ class Session(object):
             logger.info("未能成功加载有效cookies，需要重新登录")
 
     # 保存HTML内容到文件
-    def saveHtml(self, html_content, filename_prefix):
-        """保存HTML内容到文件，用于调试
+    def saveHtml(self, html_content, filename_prefix, state=None, anomaly=False, skuId=None):
+        """保存HTML内容到文件，用于调试；按采样规则交给后台线程写入，不阻塞调用方
         :param html_content: HTML内容
         :param filename_prefix: 文件名前缀
+        :param state: 页面对应的状态，记入索引；changes 方式下状态不变时不重复保存
+        :param anomaly: 是否异常页面，异常页面总是保存
+        :param skuId: 页面对应的商品id，记入索引
+        :return: 将要写入的文件路径，未保存时返回 None
         """
-        filename = f"{filename_prefix}.html"
-        filepath = os.path.join(self.debug_dir, filename)
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        logger.info(f"已保存HTML到文件: {filepath}")
-        return filepath
+        return self.debugWriter.save(html_content, filename_prefix, state, anomaly, skuId)
 
     ############## 登录相关 #############
     # 保存 cookie
@@ -223,7 +376,7 @@ class Session(object):
             }
             
             # 使用完整的headers
-            resp = self.sess.get(url=url, params=payload, headers=headers, allow_redirects=False)
+            resp = self.request('GET', url, params=payload, headers=headers, allow_redirects=False)
             
             if resp.status_code == 200:
                 logger.info(f"Cookie有效，成功访问订单页面: {resp.url}")
@@ -236,7 +389,7 @@ class Session(object):
                     # 添加额外的尝试，访问京东首页检查登录状态
                     try:
                         logger.info("尝试访问京东首页检查登录状态...")
-                        home_resp = self.sess.get('https://www.jd.com/', headers=headers)
+                        home_resp = self.request('GET', 'https://www.jd.com/', headers=headers)
                         if 'nickname' in home_resp.text:
                             logger.info("首页访问成功且包含用户信息，Cookie部分有效")
                             return True
@@ -250,13 +403,101 @@ class Session(object):
             return False
 
         # 连接失败时，创建新会话
-        self.sess = requests.session()
+        self.sess = self._newHttpSession()
+        self.invalidateCheckout('会话已重建')
         return False
 
+    def _newHttpSession(self):
+        """创建 requests 会话，挂载各域名连接池、请求阶段计时和响应采样"""
+        sess = requests.session()
+        self.hostPools.mount(sess)
+        if self.httpTimings.enabled:
+            instrument(sess)
+        sess.hooks['response'].append(self.serverClock.onResponse)
+        sess.hooks['response'].append(self.timeouts.onResponse)
+        sess.hooks['response'].append(self.requestStats.onResponse)
+        self._submitRequest = None
+        return sess
+
+    def startHeartbeat(self):
+        """开启连接保活心跳(未配置时不做任何事)，可重复调用"""
+        if self.heartbeat is not None:
+            self.heartbeat.start()
+
+    def request(self, method, url, policy=None, deadline=None, cancel=None, **kwargs):
+        """所有请求的统一入口：经 self.transport 发送，按重试策略对超时、连接失败、5xx、
+        无效 403 退避重试，下单流程中不会重试到时间预算之外
+        :param method: 请求方法
+        :param url: 请求地址
+        :param policy: RetryPolicy，默认为 self.retryPolicy
+        :param deadline: Deadline，默认为当前线程的 self.deadline
+        :param cancel: threading.Event，被置位后不再重试
+        :return: 响应
+        """
+        deadline = deadline or self.deadline
+        endpoint = endpoint_of(url)
+        fixedTimeout = kwargs.pop('timeout', None)
+
+        def send():
+            kwargs['timeout'], clipped = self._requestTimeout(endpoint, fixedTimeout, deadline)
+            try:
+                with self._measured(method, endpoint, kwargs.get('stream', False)):
+                    resp = self.transport.request(method, url, **kwargs)
+            except requests.exceptions.Timeout:
+                if not clipped:
+                    self.timeouts.recordTimeout(endpoint, kwargs['timeout'])
+                raise
+            annotate_response(endpoint, resp)
+            return resp
+
+        return (policy or self.retryPolicy).run(send, deadline=deadline, name=f"请求 {url}", cancel=cancel)
+
+    @contextmanager
+    def _measured(self, method, endpoint, stream=False):
+        """包住一次请求：记录追踪阶段和各阶段耗时，同步和异步版本共用
+        :param stream: 是否流式读取响应
+        :return: httptiming.Timing，未统计时为 None
+        """
+        with self.tracer.span(f"{method} {endpoint}", CAT_HTTP), self.httpTimings.measure(endpoint, stream) as timing:
+            yield timing
+
+    def _requestTimeout(self, endpoint, fixedTimeout=None, deadline=None):
+        """计算本次请求的超时：接口的自适应超时（或调用方指定的超时），不超过截止时间
+        :return: (超时秒数, 是否被截止时间截短)
+        """
+        timeout = fixedTimeout or self.timeouts.timeoutFor(endpoint)
+        remaining = deadline.remaining() if deadline is not None else None
+        if remaining is None or remaining >= timeout:
+            return timeout, False
+        if remaining <= 0:
+            raise requests.exceptions.Timeout(f"{endpoint} 已超出截止时间")
+        return remaining, True
+
+    @property
+    def deadline(self):
+        """当前线程的截止时间 Deadline，没有时为 None"""
+        return getattr(self._local, 'deadline', None)
+
+    @contextmanager
+    def within(self, seconds):
+        """在 seconds 秒的时间预算内执行，期间的请求超时和重试都不会超过截止时间；
+        外层已有更早的截止时间时沿用外层的
+        :param seconds: 时间预算(秒)，为 0 或 None 时不限制
+        """
+        outer = self.deadline
+        deadline = Deadline(seconds) if seconds else None
+        if deadline is None or (outer is not None and outer.expiresAt <= deadline.expiresAt):
+            deadline = outer
+        self._local.deadline = deadline
+        try:
+            yield deadline
+        finally:
+            self._local.deadline = outer
+
     # 获取登录页
     def getLoginPage(self):
         url = "https://passport.jd.com/new/login.aspx"
-        page = self.sess.get(url, headers=self.headers)
+        page = self.request('GET', url, headers=self.headers)
         return page
 
     # 获取登录二维码
@@ -271,7 +512,7 @@ class Session(object):
             'User-Agent': self.userAgent,
             'Referer': 'https://passport.jd.com/new/login.aspx',
         }
-        resp = self.sess.get(url=url, headers=headers, params=payload)
+        resp = self.request('GET', url, headers=headers, params=payload)
 
         if not self.respStatus(resp):
             logger.error("获取二维码失败")
@@ -296,7 +537,7 @@ class Session(object):
             'User-Agent': self.userAgent,
             'Referer': 'https://passport.jd.com/new/login.aspx',
         }
-        resp = self.sess.get(url=url, headers=headers, params=payload)
+        resp = self.request('GET', url, headers=headers, params=payload)
 
         if not self.respStatus(resp):
             return None, -1, "请求失败"
@@ -335,7 +576,7 @@ class Session(object):
             'User-Agent': self.userAgent,
             'Referer': 'https://passport.jd.com/new/login.aspx',
         }
-        resp = self.sess.get(url=url, headers=headers, params=payload)
+        resp = self.request('GET', url, headers=headers, params=payload)
 
         if not self.respStatus(resp):
             return None, -1, "请求失败"
@@ -362,7 +603,7 @@ class Session(object):
             'User-Agent': self.userAgent,
             'Referer': 'https://passport.jd.com/uc/login?ltype=logout',
         }
-        resp = self.sess.get(url=url, headers=headers, params={'t': ticket})
+        resp = self.request('GET', url, headers=headers, params={'t': ticket})
 
         if not self.respStatus(resp):
             logger.error("验证二维码票据失败")
@@ -391,7 +632,7 @@ class Session(object):
         
         try:
             logger.info("正在获取登录页...")
-            resp = self.sess.get(url=url, headers=headers)
+            resp = self.request('GET', url, headers=headers)
             if not self.respStatus(resp):
                 logger.error("获取登录页失败")
                 return False
@@ -453,7 +694,7 @@ class Session(object):
         
         try:
             logger.info(f"正在向手机 {phone} 发送验证码...")
-            resp = self.sess.post(url=url, headers=headers, data=data)
+            resp = self.request('POST', url, headers=headers, data=data, policy=self.mutationPolicy)
             # 保存响应内容用于调试
             self.saveHtml(resp.text, f"sms_code_response_{phone}")
             
@@ -517,7 +758,7 @@ class Session(object):
         
         try:
             logger.info(f"正在验证短信验证码...")
-            resp = self.sess.post(url=url, headers=headers, data=data)
+            resp = self.request('POST', url, headers=headers, data=data, policy=self.mutationPolicy)
             
             # 保存响应内容用于调试
             self.saveHtml(resp.text, "verify_sms_result")
@@ -555,127 +796,226 @@ class Session(object):
             return False
 
     ############## 商品方法 #############
-    def fetchItemDetail(self, skuId):
-        """获取商品信息
-        :param skuId: 商品id
+    def _itemPageRequest(self, skuId, key):
+        """商品页面请求的地址和请求头（带条件请求字段）
+        :param key: 重新验证记录 key
+        :return: (url, headers)
         """
-        # 直接访问商品页面获取信息
         url = 'https://item.jd.com/{}.html'.format(skuId)
-        logger.info(f"正在获取商品信息: {url}")
-        
-        # 使用完整的headers
         headers = {
             'User-Agent': self.userAgent,
             'Referer': 'https://www.jd.com/',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Connection': 'keep-alive',
         }
+        return url, self.pageRevalidator.conditionalHeaders(key, headers)
 
-        try:
-            logger.info(f"开始请求商品页面: {url}")
-            resp = self.sess.get(url=url, headers=headers, timeout=self.timeout)
+    def getItemPage(self, skuId, fresh=False):
+        """获取商品页面快照，有效期内的快照直接复用
+        :param skuId: 商品id
+        :param fresh: 为 True 时总是重新请求（库存查询），新页面仍会放入缓存供之后的调用复用
+        :return: ItemPage，获取失败返回 None
+        """
+        page = None if fresh else self.itemPages.get(skuId)
+        if page is not None:
+            logger.debug("复用商品 %s 的页面快照", skuId)
+            return page
+
+        key = f"page_{skuId}"
+        url, headers = self._itemPageRequest(skuId, key)
+        logger.debug("开始请求商品页面: %s", url)
+        resp = self.request('GET', url, headers=headers)
+        return self._itemPageFromResponse(skuId, url, key, resp)
+
+    def _itemPageFromResponse(self, skuId, url, key, resp):
+        """处理商品页面响应，同步和异步版本共用
+        :return: ItemPage，获取失败返回 None
+        """
+        logger.debug("商品页面响应状态码: %s", resp.status_code)
 
-            # 记录响应状态
-            logger.info(f"商品页面响应状态码: {resp.status_code}")
+        if resp.status_code == 304:
+            page = self.pageRevalidator.notModified(key)
+            if page is not None:
+                self.itemPages.put(skuId, page)
+                return page
 
-            # 检查是否发生了重定向
-            if url != resp.url:
-                logger.warning(f"请求被重定向: {url} -> {resp.url}")
-            
-            if not self.respStatus(resp):
-                logger.error(f"获取商品页面失败: HTTP状态码 {resp.status_code}")
-                detail = dict(venderId='0')
-                self.itemDetails[skuId] = detail
-                return
+        # 检查是否发生了重定向
+        if url != resp.url:
+            logger.warning(f"请求被重定向: {url} -> {resp.url}")
 
-            # 保存HTML内容用于调试
-            debug_file = self.saveHtml(resp.text, f"item_detail_{skuId}")
+        if not self.respStatus(resp):
+            logger.error(f"获取商品页面失败: HTTP状态码 {resp.status_code}")
+            return None
 
-            # 检查响应内容
-            if len(resp.text) < 1000:
-                logger.warning(f"商品页面内容过短，可能被重定向或限制: {len(resp.text)} 字符")
-                if "location.href" in resp.text:
-                    logger.warning("检测到页面包含重定向脚本")
+        # 检查响应内容
+        tooShort = len(resp.text) < 1000
+        if tooShort:
+            logger.warning(f"商品页面内容过短，可能被重定向或限制: {len(resp.text)} 字符")
+            if "location.href" in resp.text:
+                logger.warning("检测到页面包含重定向脚本")
 
-            html = etree.HTML(resp.text)
+        # 关键区域没有变化时沿用上次的解析结果
+        page = self.pageRevalidator.resolve(
+            key, resp.headers, resp.text, lambda text: parse_item_page(text, skuId, url), ITEM_PAGE_MARKERS)
+        self.itemPages.put(skuId, page)
 
-            # 提取店铺ID
-            shop_id = '0'
-            shop_info = html.xpath('//div[contains(@class, "shopName")]/div[@class="name"]/a/@data-shopid')
-            if shop_info:
-                shop_id = shop_info[0]
-                logger.info(f"成功提取到店铺ID: {shop_id}")
-            else:
-                logger.warning("未能提取到店铺ID，使用默认值'0'")
-                
-            detail = dict(venderId=shop_id)
-            
-            # 检查是否是预售商品
-            yushou_info = html.xpath('//div[contains(@class, "summary-price-wrap")]//span[contains(text(), "预售")]/text()')
-            if yushou_info:
-                detail['yushouUrl'] = url
-                logger.info("检测到预售商品")
-                
-            # 检查是否是秒杀商品
-            miaosha_info = html.xpath('//div[contains(@class, "summary-price-wrap")]//span[contains(text(), "秒杀")]/text()')
-            if miaosha_info:
-                # 获取秒杀时间，实际时间需要从页面上解析，这里只是占位
-                detail['startTime'] = int(time.time()) * 1000
-                detail['endTime'] = int(time.time() + 3600) * 1000  # 默认一小时
-                logger.info("检测到秒杀商品")
-                
-            logger.info(f"商品信息获取完成: {detail}")
-            self.itemDetails[skuId] = detail
-            
+        # 保存HTML内容用于调试，库存状态变化或页面异常时才保存
+        self.saveHtml(resp.text, f"item_page_{skuId}", state=page.stock, anomaly=tooShort, skuId=skuId)
+        return page
+
+    def fetchItemDetail(self, skuId):
+        """获取商品信息
+        :param skuId: 商品id
+        """
+        logger.info(f"正在获取商品信息: {skuId}")
+        try:
+            self._storeItemDetail(skuId, self.getItemPage(skuId))
         except Exception as e:
+            self._storeItemDetail(skuId, None, e)
+
+    def _storeItemDetail(self, skuId, page, error=None):
+        """根据商品页面快照记录商品信息，同步和异步版本共用
+        :param page: ItemPage，获取失败时为 None
+        :param error: 获取过程中的异常
+        """
+        if error is not None or page is None:
             # 出错时设置默认值
-            detail = dict(venderId='0')
-            self.itemDetails[skuId] = detail
-            logger.error(f"获取商品信息出错: {e}")
+            self.itemDetails[skuId] = dict(venderId='0')
+            if error is not None:
+                logger.error(f"获取商品信息出错: {error}")
+            return
+
+        detail = page.detail()
+        if detail['venderId'] != '0':
+            logger.info(f"成功提取到店铺ID: {detail['venderId']}")
+        else:
+            logger.warning("未能提取到店铺ID，使用默认值'0'")
+        if 'yushouUrl' in detail:
+            logger.info("检测到预售商品")
+        if 'startTime' in detail:
+            logger.info("检测到秒杀商品")
+            
+        logger.info(f"商品信息获取完成: {detail}")
+        self.itemDetails[skuId] = detail
 
     ############## 库存方法 #############
+    def useStockProbe(self, skuId):
+        """是否使用流式库存探测
+        预售商品下单时还要用到页面中的配送信息，需要完整的页面快照
+        """
+        return self.streamStock and 'yushouUrl' not in self.itemDetails.get(skuId, {})
+
+    @traced()
+    @recorded('poll', outcome=lambda inStock: {'in_stock': inStock})
     def getItemStock(self, skuId, skuNum, areaId):
-        """获取单个商品库存状态
+        """获取单个商品库存状态，整个查询(含重试)不超过 self.pollDeadline 秒
         :param skuId: 商品id
         :param skuNum: 商品数量
         :param areaId: 地区id
         :return: 商品是否有货 True/False
         """
-        # 直接访问商品页面判断库存
-        url = 'https://item.jd.com/{}.html'.format(skuId)
-        headers = {
-            'User-Agent': self.userAgent,
-            'Referer': 'https://www.jd.com/',
-            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-            'Connection': 'keep-alive',
-        }
         try:
-            resp = self.sess.get(url=url, headers=headers)
-            if not self.respStatus(resp):
-                logger.error(f"获取商品库存状态失败: HTTP状态码 {resp.status_code}")
-                return False
-            
-            # 保存HTML内容用于调试
-            self.saveHtml(resp.text, f"item_stock_{skuId}")
-            
-            html = etree.HTML(resp.text)
-            # 检查是否有"无货"字样
-            stock_status = html.xpath('//div[@class="store-prompt"]/text()')
-            if stock_status and '无货' in stock_status[0]:
-                logger.info(f"商品 {skuId} 当前无货")
-                return False
-            # 检查是否有"现货"字样或加入购物车按钮
-            has_stock = html.xpath('//div[@class="activity-message"]/span[contains(text(),"现货")]/text()') or \
-                       html.xpath('//a[@id="InitCartUrl"]')
-            stock_result = len(has_stock) > 0
-            logger.info(f"商品 {skuId} 库存状态: {'有货' if stock_result else '无货'}")
-            return stock_result
+            with self.within(self.pollDeadline):
+                return self._getItemStock(skuId)
         except Exception as e:
             logger.error(f"获取商品库存状态出错: {e}")
+            annotate(error=type(e).__name__)
+            self.pollStats.record(POLL_ERROR)
+            return False
+
+    def _getItemStock(self, skuId):
+        if self.useStockProbe(skuId) and self.hedger is not None:
+            # 对冲请求在其他线程中执行，截止时间需要显式传递
+            deadline = self.deadline
+            url, _ = self._itemPageRequest(skuId, f"stock_{skuId}")
+            verdict = self.hedger.run(endpoint_of(url), lambda cancel: self._probeItemStock(skuId, deadline, cancel))
+        elif self.useStockProbe(skuId):
+            verdict = self._probeItemStock(skuId)
+        else:
+            page = self.getItemPage(skuId, fresh=True)
+            verdict = page.stock if page is not None else None
+        return self._stockResult(skuId, verdict)
+
+    def _stockResult(self, skuId, verdict):
+        """把库存结论转换为是否有货，同步和异步版本共用"""
+        self.pollStats.record(POLL_FAILED if verdict is None else verdict)
+        if verdict is None:
             return False
+        annotate(verdict=verdict)
+        # 同一商品的库存日志共用一个主题，重复的无货日志会被合并，状态变化时立即输出
+        topic = {'topic': f"stock_{skuId}"}
+        if verdict == OUT_OF_STOCK:
+            logger.info(f"商品 {skuId} 当前无货", extra=topic)
+            return False
+        stock_result = verdict == IN_STOCK
+        logger.info(f"商品 {skuId} 库存状态: {'有货' if stock_result else '无货'}", extra=topic)
+        return stock_result
+
+    def _probeItemStock(self, skuId, deadline=None, cancel=None):
+        """流式读取商品页面，得出库存结论后立即关闭连接
+        :param deadline: Deadline，默认为当前线程的截止时间
+        :param cancel: hedge.CancelEvent，对冲请求中另一个请求已先返回时被置位，此时不再重试并中断读取
+        :return: 库存结论，请求失败或被放弃返回 None
+        """
+        key = f"stock_{skuId}"
+        url, headers = self._itemPageRequest(skuId, key)
+        resp = self.request('GET', url, headers=headers, stream=True, deadline=deadline, cancel=cancel)
+        try:
+            if cancel is not None:
+                # 被放弃时立即中断读取，不等下一个数据块或读取超时
+                cancel.onSet(lambda: abort_response(resp))
+                if cancel.is_set():
+                    return None
+            verdict, more = self._startStockProbe(key, resp)
+            if not more:
+                return verdict
+
+            # 已知编码时按文本喂入，与 resp.text 的解码方式保持一致
+            decode = resp.encoding is not None
+            probe = StockProbe()
+            chunks = []
+            for chunk in resp.iter_content(chunk_size=STOCK_CHUNK_SIZE, decode_unicode=decode):
+                if cancel is not None and cancel.is_set():
+                    return None
+                chunks.append(chunk)
+                if probe.feed(chunk) is not None:
+                    break
+            return self._finishStockProbe(skuId, key, resp, probe, chunks, decode)
+        finally:
+            resp.close()
+
+    def _startStockProbe(self, key, resp):
+        """检查流式库存探测的响应头，同步和异步版本共用
+        :return: (库存结论, 是否需要继续读取内容)
+        """
+        if resp.status_code == 304:
+            return self.pageRevalidator.notModified(key), False
+        if not self.respStatus(resp):
+            logger.error(f"获取商品库存状态失败: HTTP状态码 {resp.status_code}")
+            return None, False
+        return None, True
+
+    def _finishStockProbe(self, skuId, key, resp, probe, chunks, decode):
+        """读取结束后得出库存结论并记录，同步和异步版本共用
+        :return: 库存结论
+        """
+        verdict = probe.close()
+        annotate(bytes=probe.bytesRead)
+        logger.debug("流式库存探测: 读取 %s 字符后得出结论 %s", probe.bytesRead, verdict)
+
+        # 保存已读取的部分用于调试
+        if decode:
+            content = ''.join(chunks)
+        else:
+            content = b''.join(chunks).decode('utf-8', errors='replace')
+        self.saveHtml(content, f"item_stock_{skuId}", state=verdict, skuId=skuId)
+        self.pageRevalidator.remember(key, resp.headers, verdict)
+        return verdict
 
     ############## 购物车相关 #############
 
+    @traced()
+    @recorded('cart', outcome=succeeded)
     def uncheckCartAll(self, areaId):
         """ 取消所有选中商品
         
@@ -683,6 +1023,7 @@ class Session(object):
         
         return 购物车信息
         """
+        self.invalidateCheckout('购物车已变更')
         url = 'https://api.m.jd.com/api'
 
         # 根据curl指令设置正确的headers
@@ -734,13 +1075,13 @@ class Session(object):
         
         # 记录请求信息用于调试
         logger.debug("发起POST请求详情:")
-        logger.debug(f"  URL: {url}")
-        logger.debug(f"  Headers: {json.dumps(headers, indent=2)}")
-        logger.debug(f"  Params: {json.dumps(request_params, indent=2, ensure_ascii=False)}")
+        logger.debug("  URL: %s", url)
+        logger.debug("  Headers: %s", LazyJson(headers, indent=2))
+        logger.debug("  Params: %s", LazyJson(request_params, indent=2, ensure_ascii=False))
         
         try:
             # 根据curl，这是一个POST请求，但所有参数都在URL中，没有请求体
-            resp = self.sess.post(url=url, headers=headers, params=request_params, timeout=15)
+            resp = self.request('POST', url, headers=headers, params=request_params, policy=self.mutationPolicy)
             
             # 保存响应内容用于调试
             self.saveHtml(resp.text, "uncheck_cart_all")
@@ -799,12 +1140,15 @@ class Session(object):
                 }
             }
 
+    @traced()
+    @recorded('cart', outcome=succeeded)
     def addCartSku(self, skuId, skuNum, areaId):
         """ 加入购入车
         skuId 商品sku
         skuNum 购买数量
         retrun 是否成功
         """
+        self.invalidateCheckout('购物车已变更')
         url = 'https://api.m.jd.com/api'
         function_id = 'pcCart_jc_gate'
 
@@ -859,18 +1203,18 @@ class Session(object):
         
         # 记录完整的请求信息用于调试
         logger.debug("发起POST请求详情:")
-        logger.debug(f"  URL: {url}")
-        logger.debug(f"  Headers: {json.dumps(headers, indent=2)}")
-        logger.debug(f"  Params (in URL query string): {json.dumps(request_params, indent=2, ensure_ascii=False)}")
+        logger.debug("  URL: %s", url)
+        logger.debug("  Headers: %s", LazyJson(headers, indent=2))
+        logger.debug("  Params (in URL query string): %s", LazyJson(request_params, indent=2, ensure_ascii=False))
 
         try:
             # 使用 params 参数将字典作为查询字符串附加到URL
-            resp = self.sess.post(url=url, headers=headers, params=request_params)
+            resp = self.request('POST', url, headers=headers, params=request_params, policy=self.mutationPolicy)
             
             logger.info(f"添加商品到购物车响应状态码: {resp.status_code}")
             
             # 保存响应内容用于调试
-            self.saveHtml(resp.text, f"add_cart_{skuId}")
+            self.saveHtml(resp.text, f"add_cart_{skuId}", skuId=skuId)
             
             if not self.respStatus(resp):
                 logger.error(f"添加商品到购物车请求失败: HTTP状态码 {resp.status_code}, URL: {resp.request.url}")
@@ -899,6 +1243,8 @@ class Session(object):
             logger.error(f"添加商品到购物车过程中出错: {e}")
             return False
 
+    @traced()
+    @recorded('cart', outcome=succeeded)
     def changeCartSkuCount(self, skuId, skuUid, skuNum, areaId):
         """ 修改购物车商品数量
         skuId 商品sku
@@ -906,6 +1252,7 @@ class Session(object):
         skuNum 购买数量
         retrun 是否成功
         """
+        self.invalidateCheckout('购物车已变更')
         logger.info(f"开始修改购物车商品数量: skuId={skuId}, skuUuid={skuUid}, 数量={skuNum}")
         
         url = 'https://api.m.jd.com/api'
@@ -956,19 +1303,19 @@ class Session(object):
         
         try:
             # 记录请求详情
-            logger.debug(f"修改购物车请求URL: {url}")
-            logger.debug(f"修改购物车请求头: {json.dumps(headers, ensure_ascii=False)}")
-            logger.debug(f"修改购物车请求参数: {json.dumps(params, ensure_ascii=False)}")
+            logger.debug("修改购物车请求URL: %s", url)
+            logger.debug("修改购物车请求头: %s", LazyJson(headers, ensure_ascii=False))
+            logger.debug("修改购物车请求参数: %s", LazyJson(params, ensure_ascii=False))
             
             # 发送请求 - 注意使用params而不是data
             logger.info("正在发送修改购物车商品数量请求...")
-            resp = self.sess.post(url=url, headers=headers, params=params)
+            resp = self.request('POST', url, headers=headers, params=params, policy=self.mutationPolicy)
             
             # 记录响应状态
             logger.info(f"修改购物车响应状态码: {resp.status_code}")
             
             # 保存响应内容到调试文件
-            self.saveHtml(resp.text, f"change_cart_{skuId}")
+            self.saveHtml(resp.text, f"change_cart_{skuId}", skuId=skuId)
             
             # 验证响应状态
             if not self.respStatus(resp):
@@ -987,7 +1334,7 @@ class Session(object):
                     logger.error(f"修改购物车商品数量API返回失败: {message}")
                     
                 # 返回详细结果
-                logger.debug(f"修改购物车响应内容: {json.dumps(resp_json, ensure_ascii=False)}")
+                logger.debug("修改购物车响应内容: %s", LazyJson(resp_json, ensure_ascii=False))
                 return success
                 
             except json.JSONDecodeError:
@@ -1001,6 +1348,7 @@ class Session(object):
             logger.error(f"修改购物车商品数量时出错: {e}")
             return False
 
+    @traced()
     def prepareCart(self, skuId, skuNum, areaId):
         """ 下单前准备购物车
         1 取消全部勾选（返回购物车信息）
@@ -1081,51 +1429,147 @@ class Session(object):
     ############## 订单相关 #############
 
     def trySubmitOrder(self, skuId, skuNum, areaId, retry=3, interval=5):
-        """提交订单
+        """提交订单，整个流程不超过 self.orderDeadline 秒
         :return: 订单提交结果 True/False
         """
         logger.info(f"开始尝试提交订单: 商品={skuId}, 数量={skuNum}, 地区={areaId}")
-        itemDetail = self.itemDetails[skuId]
-        isYushou = False
-        if 'yushouUrl' in itemDetail:
-            logger.info("检测到预售商品，获取预售结算页")
-            self.getPreSallCheckoutPage(skuId, skuNum)
-            isYushou = True
-        else:
-            logger.info("普通商品，准备购物车并获取结算页")
-            cart_result = self.prepareCart(skuId, skuNum, areaId)
-            logger.info(f"准备购物车结果: {cart_result}")
-            checkout_result = self.getCheckoutPage()
-            logger.info(f"获取结算页结果: {checkout_result is not None}")
-
-        for i in range(1, retry + 1):
-            logger.info(f"第{i}次尝试提交订单...")
+        with self.within(self.orderDeadline), event_fields(sku=skuId, area=areaId, num=skuNum), \
+                self.tracer.trace('trySubmitOrder', sku=skuId):
+            itemDetail = self.itemDetails[skuId]
+            isYushou = False
+            prepared = self._takePreparedOrder(skuId, skuNum, areaId)
+            if prepared:
+                logger.info("使用预热阶段准备好的购物车和结算参数，直接提交订单")
+                isYushou = prepared['isYushou']
+            elif 'yushouUrl' in itemDetail:
+                logger.info("检测到预售商品，获取预售结算页")
+                self.getPreSallCheckoutPage(skuId, skuNum)
+                isYushou = True
+            else:
+                logger.info("普通商品，准备购物车并获取结算页")
+                cart_result = self.prepareCart(skuId, skuNum, areaId)
+                logger.info(f"准备购物车结果: {cart_result}")
+                checkout_result = self.getCheckoutPage()
+                logger.info(f"获取结算页结果: {checkout_result is not None}")
+
+            return self._submitWithRetry(isYushou, retry, interval)
+
+    def _submitWithRetry(self, isYushou, retry, interval, refreshFirst=False):
+        """按 retry/interval 重复提交订单，间隔带随机抖动，不会重试到下单流程的时间预算之外
+        :param refreshFirst: 第一次提交前是否也检查结算页参数
+        :return: 订单提交结果 True/False
+        """
+        policy = RetryPolicy(retry, {FAILED: Backoff(interval, 1.0, jitter=ORDER_RETRY_JITTER)})
+        attempts = [0]
+
+        def attempt():
+            attempts[0] += 1
+            logger.info(f"第{attempts[0]}次尝试提交订单...")
+            if not isYushou and (refreshFirst or attempts[0] > 1):
+                # 上次提交返回参数失效时才会重新获取结算页
+                self.ensureCheckoutPage()
             ret, msg = self.submitOrder(isYushou)
             if ret:
                 logger.info(f"订单提交成功，订单号: {msg}")
-                return True
             else:
-                logger.warning(f"订单提交失败，原因: {msg}，{interval}秒后重试")
-                time.sleep(interval)
-        logger.error(f"订单提交失败，已达到最大重试次数{retry}")
+                logger.warning(f"订单提交失败，原因: {msg}")
+            return ret
+
+        if policy.run(attempt, deadline=self.deadline, classifier=lambda ret, e: OK if ret else FAILED,
+                      name="提交订单"):
+            # 下单结果立即写出，不等日志线程空闲
+            flush_logs()
+            return True
+        logger.error(f"订单提交失败，共尝试{attempts[0]}次")
         return False
 
+    def warmConnections(self):
+        """预先建立到下单相关域名的连接，之后的请求可以复用
+        :return: 耗时(秒)
+        """
+        headers = {'User-Agent': self.userAgent}
+        start = time.perf_counter()
+        for url in WARMUP_URLS:
+            try:
+                self.request('HEAD', url, headers=headers, allow_redirects=False)
+            except Exception as e:
+                logger.warning(f"预热连接 {url} 失败: {e}")
+        return time.perf_counter() - start
+
+    def prewarm(self, skuId, skuNum, areaId):
+        """定时开始前的预热：建立连接、准备购物车、获取结算页并缓存下单参数，
+        到点后 trySubmitOrder 只需提交订单
+        :return: 是否预热成功 True/False
+        """
+        logger.info(f"开始预热: 商品={skuId}, 数量={skuNum}, 地区={areaId}")
+        self.preparedOrder = None
+        connectCost = self.warmConnections()
+
+        isYushou = 'yushouUrl' in self.itemDetails.get(skuId, {})
+        start = time.perf_counter()
+        if isYushou:
+            prepared = self.getPreSallCheckoutPage(skuId, skuNum) is not None
+            cartCost = time.perf_counter() - start
+            checkoutCost = 0
+        else:
+            prepared = self.prepareCart(skuId, skuNum, areaId)
+            cartCost = time.perf_counter() - start
+            start = time.perf_counter()
+            prepared = self.getCheckoutPage() is not None and prepared
+            checkoutCost = time.perf_counter() - start
+
+        logger.info(f"预热完成，下单关键路径预计减少 {(connectCost + cartCost + checkoutCost) * 1000:.0f} ms"
+                    f"(建立连接 {connectCost * 1000:.0f} ms，购物车 {cartCost * 1000:.0f} ms，"
+                    f"结算页 {checkoutCost * 1000:.0f} ms)")
+        if not prepared:
+            logger.warning("预热未能准备好购物车或结算页，到点后将重新准备")
+            return False
+        self.preparedOrder = dict(skuId=skuId, skuNum=skuNum, areaId=areaId,
+                                  isYushou=isYushou, preparedAt=time.monotonic())
+        return True
+
+    def _takePreparedOrder(self, skuId, skuNum, areaId):
+        """取出预热准备好的下单信息，只能使用一次
+        :return: 下单信息 dict，不匹配或已过期时返回 None
+        """
+        prepared, self.preparedOrder = self.preparedOrder, None
+        if not prepared:
+            return None
+        if (prepared['skuId'], prepared['skuNum'], prepared['areaId']) != (skuId, skuNum, areaId):
+            return None
+        if time.monotonic() - prepared['preparedAt'] > PREPARED_ORDER_TTL:
+            logger.info("预热准备的下单信息已过期")
+            return None
+        return prepared
+
+    def invalidateCheckout(self, reason=None):
+        """使缓存的结算页参数失效，下次提交前重新获取结算页"""
+        if self.checkoutDetail is not None and reason:
+            logger.info(f"结算页参数失效: {reason}")
+        self.checkoutDetail = None
+        self.checkoutFetchedAt = None
+
+    def ensureCheckoutPage(self):
+        """获取结算页参数，缓存仍有效时直接复用
+        缓存在购物车变更、提交订单返回参数失效或超过 CHECKOUT_PARAMS_TTL 时失效。
+        :return: 结算信息 dict
+        """
+        if self.checkoutDetail is not None and \
+                time.monotonic() - self.checkoutFetchedAt <= CHECKOUT_PARAMS_TTL:
+            self.checkoutSavedCount += 1
+            logger.info(f"复用结算页参数，已省去{self.checkoutSavedCount}次结算页请求")
+            return self.checkoutDetail
+        return self.getCheckoutPage()
+
     def submitOrderWitchTry(self, retry=3, interval=4):
         """提交订单，并且带有重试功能
         :param retry: 重试次数
         :param interval: 重试间隔
         :return: 订单提交结果 True/False
         """
-        for i in range(1, retry + 1):
-            self.getCheckoutPage()
-            sumbmitSuccess, msg = self.submitOrder()
-            if sumbmitSuccess:
-                return True
-            else:
-                if i < retry:
-                    time.sleep(interval)
-        return False
+        return self._submitWithRetry(False, retry, interval, refreshFirst=True)
 
+    @traced()
     def getCheckoutPage(self):
         """获取订单结算页面信息
         :return: 结算信息 dict
@@ -1142,172 +1586,135 @@ class Session(object):
             'Connection': 'keep-alive',
         }
         
-        # 增加重试机制
-        max_retries = 1
-        retry_delay = 2  # 秒
-        
-        for retry in range(max_retries):
-            try:
-                current_url = url
-                logger.info(f"开始获取结算页面(第{retry+1}次尝试): {current_url}")
-                
-                # 增加超时时间
-                resp = self.sess.get(url=current_url, params=payload, headers=headers, timeout=15)
-                logger.info(f"结算页面响应状态码: {resp.status_code}")
-                
-                if resp.status_code == 502:
-                    logger.warning(f"获取结算页面遇到502错误，尝试切换URL或重试")
-                    if retry < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                
-                if not self.respStatus(resp):
-                    logger.error(f"获取结算页面失败: HTTP状态码 {resp.status_code}")
-                    if retry < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return
-                
-                # 保存HTML内容用于调试
-                debug_file = self.saveHtml(resp.text, f"checkout_page_attempt_{retry+1}")
-                logger.info(f"已保存结算页面HTML到: {debug_file}")
-
-                # 检查是否被重定向到登录页
-                if "login" in resp.url:
-                    logger.error(f"获取结算页面被重定向到登录页: {resp.url}")
-                    if retry < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return
+        try:
+            logger.info(f"开始获取结算页面: {url}")
+            
+            # 增加超时时间，5xx 等错误由 self.request 统一重试
+            resp = self.request('GET', url, params=payload, headers=headers)
+            logger.info(f"结算页面响应状态码: {resp.status_code}")
+            
+            if not self.respStatus(resp):
+                logger.error(f"获取结算页面失败: HTTP状态码 {resp.status_code}")
+                return
+            
+            # 保存HTML内容用于调试
+            debug_file = self.saveHtml(resp.text, "checkout_page")
+            if debug_file:
+                logger.info(f"结算页面HTML将记录到: {debug_file}")
+
+            # 检查是否被重定向到登录页
+            if "login" in resp.url:
+                logger.error(f"获取结算页面被重定向到登录页: {resp.url}")
+                return
+
+            # 检查是否被重定向到购物车页面
+            if "cart.jd.com" in resp.url and "gotoOrder" not in resp.url:
+                logger.error(f"获取结算页面被重定向到购物车: {resp.url}，可能是商品未勾选或购物车为空")
+                return
+
+            html = etree.HTML(resp.text)
+            # 提取页面重要信息
+            page_eid = html.xpath("//input[@id='eid']/@value")
+            page_fp = html.xpath("//input[@id='fp']/@value")
+            page_risk_control = html.xpath("//input[@id='riskControl']/@value")
+            page_track_id = html.xpath("//input[@id='TrackID']/@value")
+            
+            # 更新类的属性
+            if page_eid:
+                self.eid = page_eid[0]
+            if page_fp:
+                self.fp = page_fp[0]
+            if page_risk_control:
+                self.risk_control = page_risk_control[0]
+            if page_track_id:
+                self.track_id = page_track_id[0]
+            
+            logger.info(f"结算页面信息提取: eid={self.eid}, track_id={self.track_id}, risk_control={self.risk_control}")
+
+            # 检查结算按钮是否存在
+            submit_button = html.xpath("//a[@id='order-submit']")
+            if not submit_button:
+                logger.warning("结算页面中未找到提交订单按钮")
+                # 尝试其他可能的按钮ID
+                alt_buttons = html.xpath("//a[contains(@class, 'submit-btn')]") or html.xpath("//button[contains(@class, 'submit')]")
+                if alt_buttons:
+                    logger.info("找到替代的提交按钮")
+            
+            # 检查勾选状态
+            checked_items = html.xpath("//div[contains(@class, 'item-selected')]") or html.xpath("//div[contains(@class, 'goods-item')]")
+            logger.info(f"结算页面中已勾选商品数量: {len(checked_items) if checked_items else 0}")
+            
+            # 查找地址信息的不同方式
+            address_elements = html.xpath("//span[@id='sendAddr']") or html.xpath("//div[contains(@class, 'addr-detail')]")
+            receiver_elements = html.xpath("//span[@id='sendMobile']") or html.xpath("//div[contains(@class, 'addr-phone')]")
+            price_elements = html.xpath("//span[@id='sumPayPriceId']") or html.xpath("//span[contains(@class, 'sumPrice')]")
+            
+            # 检查是否有商品信息
+            product_list = html.xpath("//div[@id='product-list']/div[@class='goods-list']") or html.xpath("//div[contains(@class, 'goods-list')]")
+            if not product_list and not checked_items:
+                logger.error("结算页面中未找到商品列表")
+                return
+            
+            # 获取商品ID列表
+            product_ids = html.xpath("//div[contains(@class, 'goods-item')]/@goods-id") or html.xpath("//div[contains(@class, 'goods-item')]/@data-sku")
+            if product_ids:
+                logger.info(f"结算页面中商品ID: {product_ids}")
+            else:
+                logger.warning("结算页面中未找到商品ID")
+
+            # 构建订单详情，尽可能获取信息
+            address = ""
+            if address_elements and address_elements[0].text:
+                address_text = address_elements[0].text
+                # 如果地址包含"寄送至："前缀，则去除
+                address = address_text[5:] if address_text.startswith("寄送至：") else address_text
+            
+            receiver = ""
+            if receiver_elements and receiver_elements[0].text:
+                receiver_text = receiver_elements[0].text
+                # 如果收件人包含"收件人:"前缀，则去除
+                receiver = receiver_text[4:] if receiver_text.startswith("收件人:") else receiver_text
+            
+            total_price = "0"
+            if price_elements and price_elements[0].text:
+                price_text = price_elements[0].text
+                # 如果价格包含"￥"前缀，则去除
+                total_price = price_text[1:] if price_text.startswith("￥") else price_text
+            
+            order_detail = {
+                'address': address,
+                'receiver': receiver,
+                'total_price': total_price,
+                'items': product_ids if product_ids else []
+            }
+            
+            logger.info(f"结算信息: 收件人={order_detail['receiver']}, 总价={order_detail['total_price']}, 商品数={len(order_detail['items'])}")
+            
+            self.checkoutDetail = order_detail
+            self.checkoutFetchedAt = time.monotonic()
+            return order_detail
+            
+        except requests.exceptions.Timeout:
+            logger.error("获取结算页面超时")
+            
+        except Exception as e:
+            logger.error(f"获取结算页面出错: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
 
-                # 检查是否被重定向到购物车页面
-                if "cart.jd.com" in resp.url and "gotoOrder" not in resp.url:
-                    logger.error(f"获取结算页面被重定向到购物车: {resp.url}，可能是商品未勾选或购物车为空")
-                    if retry < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return
-
-                html = etree.HTML(resp.text)
-                # 提取页面重要信息
-                page_eid = html.xpath("//input[@id='eid']/@value")
-                page_fp = html.xpath("//input[@id='fp']/@value")
-                page_risk_control = html.xpath("//input[@id='riskControl']/@value")
-                page_track_id = html.xpath("//input[@id='TrackID']/@value")
-                
-                # 更新类的属性
-                if page_eid:
-                    self.eid = page_eid[0]
-                if page_fp:
-                    self.fp = page_fp[0]
-                if page_risk_control:
-                    self.risk_control = page_risk_control[0]
-                if page_track_id:
-                    self.track_id = page_track_id[0]
-                
-                logger.info(f"结算页面信息提取: eid={self.eid}, track_id={self.track_id}, risk_control={self.risk_control}")
-
-                # 检查结算按钮是否存在
-                submit_button = html.xpath("//a[@id='order-submit']")
-                if not submit_button:
-                    logger.warning("结算页面中未找到提交订单按钮")
-                    # 尝试其他可能的按钮ID
-                    alt_buttons = html.xpath("//a[contains(@class, 'submit-btn')]") or html.xpath("//button[contains(@class, 'submit')]")
-                    if alt_buttons:
-                        logger.info("找到替代的提交按钮")
-                
-                # 检查勾选状态
-                checked_items = html.xpath("//div[contains(@class, 'item-selected')]") or html.xpath("//div[contains(@class, 'goods-item')]")
-                logger.info(f"结算页面中已勾选商品数量: {len(checked_items) if checked_items else 0}")
-                
-                # 查找地址信息的不同方式
-                address_elements = html.xpath("//span[@id='sendAddr']") or html.xpath("//div[contains(@class, 'addr-detail')]")
-                receiver_elements = html.xpath("//span[@id='sendMobile']") or html.xpath("//div[contains(@class, 'addr-phone')]")
-                price_elements = html.xpath("//span[@id='sumPayPriceId']") or html.xpath("//span[contains(@class, 'sumPrice')]")
-                
-                # 检查是否有商品信息
-                product_list = html.xpath("//div[@id='product-list']/div[@class='goods-list']") or html.xpath("//div[contains(@class, 'goods-list')]")
-                if not product_list and not checked_items:
-                    logger.error("结算页面中未找到商品列表")
-                    if retry < max_retries - 1:
-                        # 再次勾选商品并重试
-                        logger.info("尝试重新勾选购物车商品并重试获取结算页")
-                        # TODO: 添加手动勾选购物车的逻辑
-                        time.sleep(retry_delay)
-                        continue
-                    return
-                
-                # 获取商品ID列表
-                product_ids = html.xpath("//div[contains(@class, 'goods-item')]/@goods-id") or html.xpath("//div[contains(@class, 'goods-item')]/@data-sku")
-                if product_ids:
-                    logger.info(f"结算页面中商品ID: {product_ids}")
-                else:
-                    logger.warning("结算页面中未找到商品ID")
-
-                # 构建订单详情，尽可能获取信息
-                address = ""
-                if address_elements and address_elements[0].text:
-                    address_text = address_elements[0].text
-                    # 如果地址包含"寄送至："前缀，则去除
-                    address = address_text[5:] if address_text.startswith("寄送至：") else address_text
-                
-                receiver = ""
-                if receiver_elements and receiver_elements[0].text:
-                    receiver_text = receiver_elements[0].text
-                    # 如果收件人包含"收件人:"前缀，则去除
-                    receiver = receiver_text[4:] if receiver_text.startswith("收件人:") else receiver_text
-                
-                total_price = "0"
-                if price_elements and price_elements[0].text:
-                    price_text = price_elements[0].text
-                    # 如果价格包含"￥"前缀，则去除
-                    total_price = price_text[1:] if price_text.startswith("￥") else price_text
-                
-                order_detail = {
-                    'address': address,
-                    'receiver': receiver,
-                    'total_price': total_price,
-                    'items': product_ids if product_ids else []
-                }
-                
-                logger.info(f"结算信息: 收件人={order_detail['receiver']}, 总价={order_detail['total_price']}, 商品数={len(order_detail['items'])}")
-                
-                return order_detail
-                
-            except requests.exceptions.Timeout:
-                logger.error(f"获取结算页面超时(第{retry+1}次尝试)")
-                if retry < max_retries - 1:
-                    time.sleep(retry_delay)
-                
-            except Exception as e:
-                logger.error(f"获取结算页面出错: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
-                if retry < max_retries - 1:
-                    time.sleep(retry_delay)
-        
-        # 所有重试都失败了
-        logger.error(f"经过{max_retries}次尝试后仍无法获取结算页面")
         return
 
+    @traced()
     def getPreSallCheckoutPage(self, skuId, skuNum=1):
         """获取预售商品结算页面信息
         :return: 结算信息 dict
         """
-        url = 'https://item.jd.com/{}.html'.format(skuId)
-        headers = {
-            'User-Agent': self.userAgent,
-            'Referer': 'https://www.jd.com/',
-        }
         try:
-            resp = self.sess.get(url=url, headers=headers)
-            if not self.respStatus(resp):
+            # 刚查询过库存时直接复用同一份商品页面快照
+            page = self.getItemPage(skuId)
+            if page is None:
                 return
-            
-            # 保存HTML内容用于调试
-            self.saveHtml(resp.text, f"presale_checkout_{skuId}")
 
-            html = etree.HTML(resp.text)
             # 提取商品页面信息
             self.eid = self.eid or ''
             self.fp = self.fp or ''
@@ -1318,10 +1725,10 @@ class Session(object):
             order_detail = {}
             
             # 如果商品页面中无法获取收货信息，使用用户账号的默认信息
-            try:
-                order_detail['address'] = html.xpath("//div[@id='J-deliver']//div[@class='ui-area-text']")[0].text.strip()
+            if page.deliveryArea:
+                order_detail['address'] = page.deliveryArea
                 order_detail['receiver'] = self.sess.cookies.get('pin', '')
-            except:
+            else:
                 order_detail['address'] = '默认地址'
                 order_detail['receiver'] = '默认收件人'
                 
@@ -1330,12 +1737,12 @@ class Session(object):
             logger.error(f"获取预售商品结算页面出错: {e}")
             return
 
-    def submitOrder(self, isYushou=False):
-        """提交订单
-        :return: True/False 订单提交结果
+    def _buildSubmitRequest(self, isYushou=False):
+        """获取提交订单请求，结算参数不变时复用上次构建的 PreparedRequest
+        Cookie 在每次发送前按当前 cookie jar 重新生成，不需要因为 cookie 更新而重建。
+        :return: (PreparedRequest, 发送参数 dict)
         """
         url = 'https://trade.jd.com/shopping/order/submitOrder.action'
-        function_id = 'trade_submitOrder'
         # js function of submit order is included in https://trade.jd.com/shopping/misc/js/order.js?r=2018070403091
 
         # 确保必要参数已设置
@@ -1355,6 +1762,10 @@ class Session(object):
             logger.warning("提交订单缺少track_id参数")
             self.track_id = ''
 
+        key = (self.eid, self.fp, self.risk_control, self.track_id, bool(isYushou), self.userAgent)
+        if self._submitRequest is not None and self._submitRequest[0] == key:
+            return self._submitRequest[1].copy(), self._submitRequest[2]
+
         data = {
             'overseaPurchaseCookies': '',
             'vendorRemarks': '[]',
@@ -1385,101 +1796,105 @@ class Session(object):
             'Referer': 'https://trade.jd.com/',
         }
 
-        logger.info(f"开始提交订单请求: {url}")
+        logger.info(f"构建提交订单请求: {url}")
         logger.info(f"订单参数: eid={self.eid}, trackId={self.track_id}, riskControl={self.risk_control}")
         
-        # 添加重试机制
-        max_retries = 1
-        retry_delay = 2  # 秒
-        
         # 记录请求详情
         logger.debug("订单提交请求详情:")
-        logger.debug(f"  URL: {url}")
-        logger.debug(f"  Headers: {json.dumps(headers, indent=2)}")
-        logger.debug(f"  Data: {json.dumps(data, indent=2, ensure_ascii=False)}")
+        logger.debug("  URL: %s", url)
+        logger.debug("  Headers: %s", LazyJson(headers, indent=2))
+        logger.debug("  Data: %s", LazyJson(data, indent=2, ensure_ascii=False))
+
+        prepared = self.sess.prepare_request(requests.Request('POST', url, data=data, headers=headers))
+        prepared.headers.pop('Cookie', None)
+        settings = self.sess.merge_environment_settings(url, {}, None, None, None)
+        self._submitRequest = (key, prepared, settings)
+        return prepared.copy(), settings
+
+    def _sendSubmitRequest(self, isYushou=False):
+        """发送提交订单请求，Cookie 取自当前 cookie jar，按 self.submitPolicy 重试
+        :return: 响应
+        """
+        deadline = self.deadline
+
+        def send():
+            prepared, settings = self._buildSubmitRequest(isYushou)
+            prepared.prepare_cookies(self.sess.cookies)
+            endpoint = endpoint_of(prepared.url)
+            timeout, _ = self._requestTimeout(endpoint, deadline=deadline)
+            with self._measured('POST', endpoint):
+                resp = self.transport.send(prepared, timeout=timeout, **settings)
+            annotate_response(endpoint, resp)
+            return resp
+        return self.submitPolicy.run(send, deadline=deadline, name="提交订单请求")
+
+    @traced()
+    @recorded('submit', outcome=succeeded)
+    def submitOrder(self, isYushou=False):
+        """提交订单
+        :return: True/False 订单提交结果
+        """
+        logger.info("开始提交订单请求")
         
-        for retry in range(max_retries):
+        try:
+            resp = self._sendSubmitRequest(isYushou)
+            logger.info(f"订单提交响应状态码: {resp.status_code}")
+            
+            # 保存响应内容用于调试
+            self.saveHtml(resp.text, "submit_order_response")
+            
+            # 检查响应内容
+            if not resp.text.strip():
+                logger.error(f"订单提交响应为空")
+            
             try:
-                logger.info(f"第{retry+1}次尝试提交订单...")
-                resp = self.sess.post(url=url, data=data, headers=headers, timeout=15)
-                logger.info(f"订单提交响应状态码: {resp.status_code}")
-                
-                # 保存响应内容用于调试
-                self.saveHtml(resp.text, f"submit_order_response_{retry+1}")
-                
-                # 检查响应内容
-                if not resp.text.strip():
-                    logger.error(f"订单提交响应为空")
-                    if retry < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                
-                try:
-                    respJson = json.loads(resp.text)
-                    logger.info(f"订单提交响应: {respJson}")
-
-                    if respJson.get('success'):
-                        orderId = respJson.get('orderId')
-                        logger.info(f"订单提交成功，订单ID: {orderId}")
-                        return True, orderId
-                    else:
-                        message, result_code = respJson.get('message', '未知错误'), respJson.get('resultCode', -1)
-                        logger.warning(f"订单提交失败: 结果码={result_code}, 消息={message}")
-                        
-                        # 处理不同的错误码
-                        if result_code == 0:
-                            # 尝试解决第三方商品发票问题
-                            self._saveInvoice()
-                            message = message + '(下单商品可能为第三方商品，将切换为普通发票进行尝试)'
-                            if retry < max_retries - 1:
-                                logger.info("已切换发票，尝试重新提交订单")
-                                time.sleep(retry_delay)
-                                continue
-                        elif result_code == 60077:
-                            message = message + '(可能是购物车为空 或 未勾选购物车中商品)'
-                            # 尝试重新勾选购物车
-                            if retry < max_retries - 1:
-                                logger.info("尝试重新勾选购物车商品并重试")
-                                # TODO: 添加手动勾选购物车的逻辑
-                                time.sleep(retry_delay)
-                                continue
-                        elif result_code == 60123:
-                            message = message + '(需要在config.ini文件中配置支付密码)'
-                            
-                        return False, message
-                except json.JSONDecodeError:
-                    logger.error(f"解析订单提交响应JSON出错，响应内容: {resp.text[:200]}...")
-                    
-                    # 尝试从HTML响应中提取信息
-                    if "订单提交成功" in resp.text or "下单成功" in resp.text:
-                        # 尝试从HTML中提取订单号
-                        order_id_match = re.search(r'订单号：\s*(\d+)', resp.text)
-                        order_id = order_id_match.group(1) if order_id_match else "未知"
-                        logger.info(f"从HTML响应中检测到订单提交成功，订单号: {order_id}")
-                        return True, order_id
+                respJson = json.loads(resp.text)
+                logger.info(f"订单提交响应: {respJson}")
+
+                if respJson.get('success'):
+                    orderId = respJson.get('orderId')
+                    logger.info(f"订单提交成功，订单ID: {orderId}")
+                    return True, orderId
+                else:
+                    message, result_code = respJson.get('message', '未知错误'), respJson.get('resultCode', -1)
+                    logger.warning(f"订单提交失败: 结果码={result_code}, 消息={message}")
+                    if result_code in STALE_CHECKOUT_CODES or \
+                            any(word in str(message) for word in STALE_CHECKOUT_MESSAGES):
+                        self.invalidateCheckout(f"提交订单返回 {result_code}")
                     
-                    if retry < max_retries - 1:
-                        time.sleep(retry_delay)
-                        continue
-                    return False, "无法解析响应"
-            
-            except requests.exceptions.Timeout:
-                logger.error(f"订单提交请求超时(第{retry+1}次尝试)")
-                if retry < max_retries - 1:
-                    time.sleep(retry_delay)
+                    # 处理不同的错误码
+                    if result_code == 0:
+                        # 尝试解决第三方商品发票问题
+                        self._saveInvoice()
+                        message = message + '(下单商品可能为第三方商品，将切换为普通发票进行尝试)'
+                    elif result_code == 60077:
+                        message = message + '(可能是购物车为空 或 未勾选购物车中商品)'
+                    elif result_code == 60123:
+                        message = message + '(需要在config.ini文件中配置支付密码)'
+                        
+                    return False, message
+            except json.JSONDecodeError:
+                logger.error(f"解析订单提交响应JSON出错，响应内容: {resp.text[:200]}...")
                 
-            except Exception as e:
-                logger.error(f"订单提交过程中出错: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
-                if retry < max_retries - 1:
-                    time.sleep(retry_delay)
-                    continue
-                return False, str(e)
+                # 尝试从HTML响应中提取信息
+                if "订单提交成功" in resp.text or "下单成功" in resp.text:
+                    # 尝试从HTML中提取订单号
+                    order_id_match = re.search(r'订单号：\s*(\d+)', resp.text)
+                    order_id = order_id_match.group(1) if order_id_match else "未知"
+                    logger.info(f"从HTML响应中检测到订单提交成功，订单号: {order_id}")
+                    return True, order_id
+                
+                return False, "无法解析响应"
         
-        # 所有重试都失败
-        logger.error(f"经过{max_retries}次尝试后仍无法成功提交订单")
-        return False, f"经过{max_retries}次尝试后提交失败"
+        except requests.exceptions.Timeout:
+            logger.error("订单提交请求超时")
+            return False, "请求超时"
+            
+        except Exception as e:
+            logger.error(f"订单提交过程中出错: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return False, str(e)
 
     def _saveInvoice(self):
         """下单第三方商品时如果未设置发票，将从电子发票切换为普通发票
@@ -1530,7 +1945,7 @@ class Session(object):
             'User-Agent': self.userAgent,
             'Referer': 'https://trade.jd.com/shopping/dynamic/invoice/saveInvoice.action',
         }
-        self.sess.post(url=url, data=data, headers=headers)
+        self.request('POST', url, data=data, headers=headers, policy=self.mutationPolicy)
 
     def parseJson(self, s):
         """解析包含jQuery回调的JSON字符串
@@ -1635,19 +2050,19 @@ class Session(object):
                     self.t_params[func_id] = value
                     logger.info(f"加载t参数: {func_id}，值={value}")
                 else:
-                    logger.debug(f"跳过不符合命名规范的配置项: {key}")
+                    logger.debug("跳过不符合命名规范的配置项: %s", key)
             
             # 调试信息：打印已加载的所有参数
             logger.info(f"共加载了 {len(self.h5st_params)} 个h5st参数和 {len(self.t_params)} 个t参数")
-            if self.h5st_params:
+            if self.h5st_params and logger.isEnabledFor(logging.DEBUG):
                 logger.debug("已加载的h5st参数:")
                 for func_id, value in self.h5st_params.items():
-                    logger.debug(f"  {func_id}: {value[:30]}...")
+                    logger.debug("  %s: %s...", func_id, value[:30])
             
-            if self.t_params:
+            if self.t_params and logger.isEnabledFor(logging.DEBUG):
                 logger.debug("已加载的t参数:")
                 for func_id, value in self.t_params.items():
-                    logger.debug(f"  {func_id}: {value}")
+                    logger.debug("  %s: %s", func_id, value)
                     
         except Exception as e:
             logger.error(f"加载反爬参数时出错: {e}")
@@ -0,0 +1,216 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from itempage import StockProbe, STOCK_CHUNK_SIZE
+from log import logger
+from events import recorded, annotate, annotate_response
+from metrics import endpoint_of, POLL_ERROR
+from retry import Deadline
+from transport import AsyncHttpxTransport, httpx
+from utils import send_wechat
+
+# 下单流程使用的线程数，同一时间只会有一个下单流程
+ORDER_WORKERS = 1
+
+
+def available():
+    """是否可以使用原生异步请求（需要安装 httpx）"""
+    return httpx is not None
+
+
+class AsyncSession(object):
+    """
+    JdSession.Session 的协程版本
+
+    与同步 Session 共用登录状态、cookie jar、商品页面快照、重新验证记录以及全部解析代码，
+    只把网络读写换成 httpx.AsyncClient，使一个事件循环可以同时运行多个商品的库存查询、
+    连接保活和消息推送，不需要为每个任务开一个线程。
+
+    库存、商品信息、Cookie 校验和保活是原生协程；购物车、结算和提交订单流程每次只执行一次，
+    仍由同步 Session 在单独的线程中完成，避免复制一份长流程。未安装 httpx 时所有操作都
+    退回同步 Session。
+    """
+
+    def __init__(self, session, http2=False):
+        """
+        :param session: JdSession.Session
+        :param http2: 异步请求是否启用 HTTP/2
+        """
+        self.session = session
+        self.events = session.events
+        self.transport = AsyncHttpxTransport(session, http2) if available() else None
+        self._executor = ThreadPoolExecutor(max_workers=ORDER_WORKERS, thread_name_prefix='order')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.transport is not None:
+            await self.transport.aclose()
+        self._executor.shutdown(wait=False)
+
+    async def _blocking(self, func, *args):
+        """在线程中执行同步 Session 的方法"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def request(self, method, url, policy=None, deadline=None, **kwargs):
+        """Session.request 的协程版本，使用同一个重试策略、自适应超时、截止时间、追踪阶段和耗时统计
+        :return: 响应
+        """
+        session = self.session
+        deadline = deadline or session.deadline
+        endpoint = endpoint_of(url)
+        fixedTimeout = kwargs.pop('timeout', None)
+
+        async def send():
+            kwargs['timeout'], clipped = session._requestTimeout(endpoint, fixedTimeout, deadline)
+            try:
+                with session._measured(method, endpoint, kwargs.get('stream', False)):
+                    resp = await self.transport.request(method, url, **kwargs)
+            except requests.exceptions.Timeout:
+                if not clipped:
+                    session.timeouts.recordTimeout(endpoint, kwargs['timeout'])
+                raise
+            annotate_response(endpoint, resp)
+            return resp
+
+        return await (policy or session.retryPolicy).runAsync(send, deadline=deadline, name=f"请求 {url}")
+
+    ############## 商品方法 #############
+    async def getItemPage(self, skuId, deadline=None, fresh=False):
+        """获取商品页面快照
+        :param deadline: Deadline
+        :param fresh: 为 True 时总是重新请求（库存查询）
+        :return: ItemPage，获取失败返回 None
+        """
+        if self.transport is None:
+            return await self._blocking(self.session.getItemPage, skuId, fresh)
+        session = self.session
+        page = None if fresh else session.itemPages.get(skuId)
+        if page is not None:
+            return page
+        key = f"page_{skuId}"
+        url, headers = session._itemPageRequest(skuId, key)
+        resp = await self.request('GET', url, headers=headers, deadline=deadline)
+        return session._itemPageFromResponse(skuId, url, key, resp)
+
+    async def fetchItemDetail(self, skuId):
+        """获取商品信息"""
+        logger.info(f"正在获取商品信息: {skuId}")
+        try:
+            self.session._storeItemDetail(skuId, await self.getItemPage(skuId))
+        except Exception as e:
+            self.session._storeItemDetail(skuId, None, e)
+
+    @recorded('poll', outcome=lambda inStock: {'in_stock': inStock})
+    async def getItemStock(self, skuId, skuNum, areaId):
+        """获取单个商品库存状态，整个查询(含重试)不超过 session.pollDeadline 秒
+        :return: 商品是否有货 True/False
+        """
+        if self.transport is None:
+            return await self._blocking(self.session.getItemStock, skuId, skuNum, areaId)
+        session = self.session
+        deadline = Deadline(session.pollDeadline) if session.pollDeadline else None
+        try:
+            if session.useStockProbe(skuId) and session.hedger is not None:
+                url, _ = session._itemPageRequest(skuId, f"stock_{skuId}")
+                verdict = await session.hedger.runAsync(endpoint_of(url), lambda: self._probeItemStock(skuId, deadline))
+            elif session.useStockProbe(skuId):
+                verdict = await self._probeItemStock(skuId, deadline)
+            else:
+                page = await self.getItemPage(skuId, deadline, fresh=True)
+                verdict = page.stock if page is not None else None
+            return session._stockResult(skuId, verdict)
+        except Exception as e:
+            logger.error(f"获取商品库存状态出错: {e}")
+            annotate(error=type(e).__name__)
+            session.pollStats.record(POLL_ERROR)
+            return False
+
+    async def _probeItemStock(self, skuId, deadline=None):
+        """流式读取商品页面，得出库存结论后立即关闭连接"""
+        session = self.session
+        key = f"stock_{skuId}"
+        url, headers = session._itemPageRequest(skuId, key)
+        resp = await self.request('GET', url, headers=headers, stream=True, deadline=deadline)
+        try:
+            verdict, more = session._startStockProbe(key, resp)
+            if not more:
+                return verdict
+            decode = resp.encoding is not None
+            probe = StockProbe()
+            chunks = []
+            async for chunk in resp.aiter_content(chunk_size=STOCK_CHUNK_SIZE, decode_unicode=decode):
+                chunks.append(chunk)
+                if probe.feed(chunk) is not None:
+                    break
+            return session._finishStockProbe(skuId, key, resp, probe, chunks, decode)
+        finally:
+            await resp.aclose()
+
+    ############## 登录相关 #############
+    async def validateCookies(self):
+        """通过访问用户订单列表页判断 cookies 是否有效
+        :return: True/False
+        """
+        if self.transport is None:
+            return await self._blocking(self.session.validateCookies)
+        url = 'https://order.jd.com/center/list.action'
+        headers = {
+            'User-Agent': self.session.userAgent,
+            'Referer': 'https://www.jd.com/',
+        }
+        try:
+            resp = await self.request('GET', url, params={'rid': str(int(time.time() * 1000))},
+                                      headers=headers, allow_redirects=False)
+            if resp.status_code == 200:
+                return True
+            if resp.status_code == 302:
+                home = await self.request('GET', 'https://www.jd.com/', headers=headers)
+                return 'nickname' in home.text
+        except Exception as e:
+            logger.error(f"验证Cookie时发生错误: {e}")
+        return False
+
+    ############## 下单流程 #############
+    async def prepareCart(self, skuId, skuNum, areaId):
+        return await self._blocking(self.session.prepareCart, skuId, skuNum, areaId)
+
+    async def getCheckoutPage(self):
+        return await self._blocking(self.session.getCheckoutPage)
+
+    async def submitOrder(self, isYushou=False):
+        return await self._blocking(self.session.submitOrder, isYushou)
+
+    async def trySubmitOrder(self, skuId, skuNum, areaId, retry=3, interval=5):
+        return await self._blocking(self.session.trySubmitOrder, skuId, skuNum, areaId, retry, interval)
+
+    ############## 保活与通知 #############
+    async def keepAlive(self, interval):
+        """连接保活：各域名空闲超过 interval 秒时发一次 HEAD 请求，直到被取消
+        :param interval: 心跳间隔(秒)
+        """
+        session = self.session
+        while True:
+            await asyncio.sleep(interval / 2)
+            for host in session.hostPools.idleHosts(interval):
+                try:
+                    if self.transport is None:
+                        await self._blocking(session.warmConnections)
+                        break
+                    await self.transport.request('HEAD', f'https://{host}/', headers={'User-Agent': session.userAgent},
+                                                 timeout=session.timeout, allow_redirects=False)
+                except Exception as e:
+                    logger.debug(f"心跳请求 {host} 失败: {e}")
+
+    async def notify(self, message, desp, sckey):
+        """发送微信通知，不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, send_wechat, message, desp, sckey)
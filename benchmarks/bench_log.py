@@ -0,0 +1,117 @@
+# -*- coding:utf-8 -*-
+"""
+关闭 DEBUG 日志时，购物车和提交订单请求的调试输出开销对比
+
+eager 为在 f-string 中直接 json.dumps 请求头和参数的写法，lazy 为 log.LazyJson 延迟序列化的写法，
+请求参数的大小与真实的购物车、提交订单请求相当。
+
+    python benchmarks/bench_log.py [每轮次数]
+"""
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 各模块导入时读取当前目录下的 config.ini，在临时目录中使用默认配置运行
+WORKDIR = tempfile.mkdtemp(prefix='jdbuyer-bench-')
+shutil.copy(os.path.join(ROOT, 'config.default..ini'), os.path.join(WORKDIR, 'config.ini'))
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+
+from log import LazyJson, logger, stop_logging  # noqa: E402
+
+URL = 'https://api.m.jd.com/api'
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/129.0.0.0 Safari/537.36',
+    'Referer': 'https://cart.jd.com/',
+    'Origin': 'https://cart.jd.com',
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'x-referer-page': 'https://cart.jd.com/cart_index',
+    'x-rp-client': 'h5_1.0.0',
+}
+BODY = {
+    'serInfo': {'area': '1_2901_55554_0', 'user-key': 'abc'},
+    'operations': [{'carttype': '5', 'TheSkus': [
+        {'Id': '100015253059', 'num': 1, 'skuUuid': 'x' * 20, 'useUuid': False}]}],
+}
+PARAMS = {
+    'functionId': 'pcCart_jc_cartUnCheckAll',
+    'appid': 'JDC_mall_cart',
+    'loginType': '3',
+    'body': json.dumps(BODY, separators=(',', ':')),
+    'h5st': 'x' * 400,
+    'x-api-eid-token': 'y' * 200,
+    't': '1729000000000',
+}
+DATA = {
+    'overseaPurchaseCookies': '',
+    'vendorRemarks': '[]',
+    'submitOrderParam.sopNotPutInvoice': 'false',
+    'submitOrderParam.trackID': 'TestTrackId',
+    'submitOrderParam.ignorePriceChange': '0',
+    'submitOrderParam.btSupport': '0',
+    'riskControl': 'r' * 40,
+    'submitOrderParam.isBestCoupon': 1,
+    'submitOrderParam.jxj': 1,
+    'submitOrderParam.trackId': 't' * 60,
+    'submitOrderParam.eid': 'e' * 80,
+    'submitOrderParam.fp': 'f' * 32,
+    'submitOrderParam.needCheck': 1,
+}
+
+
+def eager_cart():
+    logger.debug("发起POST请求详情:")
+    logger.debug(f"  URL: {URL}")
+    logger.debug(f"  Headers: {json.dumps(HEADERS, indent=2)}")
+    logger.debug(f"  Params: {json.dumps(PARAMS, indent=2, ensure_ascii=False)}")
+
+
+def lazy_cart():
+    logger.debug("发起POST请求详情:")
+    logger.debug("  URL: %s", URL)
+    logger.debug("  Headers: %s", LazyJson(HEADERS, indent=2))
+    logger.debug("  Params: %s", LazyJson(PARAMS, indent=2, ensure_ascii=False))
+
+
+def eager_submit():
+    logger.debug("订单提交请求详情:")
+    logger.debug(f"  URL: {URL}")
+    logger.debug(f"  Headers: {json.dumps(HEADERS, indent=2)}")
+    logger.debug(f"  Data: {json.dumps(DATA, indent=2, ensure_ascii=False)}")
+
+
+def lazy_submit():
+    logger.debug("订单提交请求详情:")
+    logger.debug("  URL: %s", URL)
+    logger.debug("  Headers: %s", LazyJson(HEADERS, indent=2))
+    logger.debug("  Data: %s", LazyJson(DATA, indent=2, ensure_ascii=False))
+
+
+def per_call(func, number):
+    """多轮中最快一轮的单次耗时(微秒)"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logger.setLevel(logging.INFO)
+    for name, eager, lazy in (('cart', eager_cart, lazy_cart), ('submit', eager_submit, lazy_submit)):
+        eagerTime, lazyTime = per_call(eager, number), per_call(lazy, number)
+        print('{0:<7} eager {1:.2f} us  lazy {2:.2f} us  每次调用节省 {3:.2f} us'.format(
+            name, eagerTime, lazyTime, eagerTime - lazyTime))
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        stop_logging()
+        os.chdir(ROOT)
+        shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -0,0 +1,158 @@
+# -*- coding:utf-8 -*-
+"""
+各传输层的单次请求耗时和 CPU 对比
+
+在本机启动一个替身服务器（安装了 hypercorn 时为 HTTPS + HTTP/2，否则为 HTTP/1.1），
+用 requests、http2 和 recording 三种传输层各发送 N 次购物车样式的 POST，输出耗时 p50/p99
+和每次请求的 CPU 时间。
+
+    python benchmarks/bench_transport.py [次数]
+"""
+import asyncio
+import os
+import resource
+import shutil
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CERT = os.path.join(ROOT, 'tests', 'fixtures', 'localhost.crt')
+KEY = os.path.join(ROOT, 'tests', 'fixtures', 'localhost.key')
+BODY = b'{"success":true,"resultData":{}}'
+
+# 各模块导入时读取当前目录下的 config.ini，在临时目录中使用默认配置运行
+WORKDIR = tempfile.mkdtemp(prefix='jdbuyer-bench-')
+shutil.copy(os.path.join(ROOT, 'config.default..ini'), os.path.join(WORKDIR, 'config.ini'))
+os.chdir(WORKDIR)
+sys.path.insert(0, ROOT)
+# httpx 与 requests 都信任替身服务器的自签名证书
+os.environ['SSL_CERT_FILE'] = os.environ['REQUESTS_CA_BUNDLE'] = CERT
+
+import logging  # noqa: E402
+
+import requests  # noqa: E402
+
+import transport  # noqa: E402
+
+try:
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config as HypercornConfig
+except ImportError:
+    serve = None
+
+
+async def app(scope, receive, send):
+    if scope['type'] != 'http':
+        return
+    more = True
+    while more:
+        message = await receive()
+        more = message.get('more_body', False)
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(BODY)).encode())]})
+    await send({'type': 'http.response.body', 'body': BODY})
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出，关闭 Nagle 避免与延迟确认叠加
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server():
+    """启动替身服务器
+    :return: 基础地址
+    """
+    if serve is None:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return 'http://localhost:{0}'.format(server.server_address[1])
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    config = HypercornConfig()
+    config.bind = ['127.0.0.1:{0}'.format(port)]
+    config.certfile, config.keyfile = CERT, KEY
+    config.loglevel = 'WARNING'
+    # 在后台线程中运行，不能安装信号处理，用一个永不触发的停止条件代替
+    never = lambda: asyncio.get_running_loop().create_future()
+    threading.Thread(target=lambda: asyncio.run(serve(app, config, shutdown_trigger=never)), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return 'https://localhost:{0}'.format(port)
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench(backend, url, count):
+    def call():
+        resp = backend.request('POST', url, params={'functionId': 'pcCart_jc_cartCheckAll'},
+                               data={'body': '{}'}, timeout=5)
+        resp.text
+        return resp
+
+    call()
+    latencies = []
+    cpu = cpu_time()
+    for _ in range(count):
+        start = time.perf_counter()
+        resp = call()
+        latencies.append(time.perf_counter() - start)
+    cpu = cpu_time() - cpu
+    latencies.sort()
+    print('{0:<10} p50 {1:.3f} ms  p99 {2:.3f} ms  cpu {3:.3f} ms/req  {4}'.format(
+        backend.name, latencies[count // 2] * 1000, latencies[int(count * 0.99)] * 1000, cpu / count * 1000,
+        getattr(resp, 'http_version', 'HTTP/1.1')))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    # httpx 每个请求都会输出一条 INFO 日志
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    base = start_server()
+    url = base + '/api'
+    session = types.SimpleNamespace(sess=requests.session())
+    print('替身服务器 {0}，每种传输层 {1} 次请求'.format(base, count))
+
+    bench(transport.RequestsTransport(session), url, count)
+    try:
+        bench(transport.Http2Transport(session, hosts=('localhost',)), url, count)
+    except ImportError as e:
+        print('http2      跳过: {0}'.format(e))
+    recording = transport.RecordingTransport()
+    recording.stub(base, body=BODY)
+    bench(recording, url, count)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(WORKDIR, ignore_errors=True)
@@ -0,0 +1,407 @@
+# -*- coding:utf-8 -*-
+import atexit
+import gzip
+import hashlib
+import itertools
+import os
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+
+from log import logger
+
+# 采样方式
+CAPTURE_ALL = 'all'              # 每次都保存
+CAPTURE_CHANGES = 'changes'      # 内容或状态变化、以及异常时保存
+CAPTURE_ANOMALIES = 'anomalies'  # 只在异常时保存
+CAPTURE_OFF = 'off'              # 不保存
+CAPTURE_MODES = (CAPTURE_ALL, CAPTURE_CHANGES, CAPTURE_ANOMALIES, CAPTURE_OFF)
+DEFAULT_CAPTURE_MODE = CAPTURE_ALL
+# 存储方式
+STORE_BLOBS = 'blobs'  # 按内容哈希去重保存，另有索引记录每次保存
+STORE_FILES = 'files'  # 每次保存一个 html 文件，每个前缀保留最近 keep 个
+STORE_TYPES = (STORE_BLOBS, STORE_FILES)
+DEFAULT_CAPTURE_STORE = STORE_BLOBS
+# 每个文件名前缀保留的页面数（files 方式）
+DEFAULT_CAPTURE_KEEP = 5
+# 调试目录总大小上限(字节)
+DEFAULT_CAPTURE_MAX_BYTES = 50 * 1024 * 1024
+# 等待写入的页面数上限，队列满时丢弃新页面
+DEFAULT_CAPTURE_QUEUE_SIZE = 64
+CAPTURE_SUFFIXES = ('.html', '.html.gz')
+# 内容寻址存储的索引文件和内容目录
+CAPTURE_INDEX = 'index.tsv'
+CAPTURE_BLOBS = 'blobs'
+INDEX_FIELDS = ('time', 'prefix', 'sku', 'hash', 'size', 'state')
+# 超出上限时清理到上限的多少，留出余量，避免每次保存都重写索引
+CAPTURE_PRUNE_RATIO = 0.9
+
+
+def _scan_files(directory, suffixes):
+    """目录下（含子目录）的调试文件，按修改时间从旧到新
+    :return: [(路径, 大小)]
+    """
+    entries = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith(suffixes):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+    return [(path, size) for _, path, size in sorted(entries)]
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.debug('删除调试页面 {0} 失败: {1}'.format(path, e))
+
+
+class FileStore(object):
+    """
+    每次保存一个 html 文件，每个前缀保留最近 keep 个，总大小超出上限时删除最旧的
+    """
+
+    def __init__(self, directory, keep=DEFAULT_CAPTURE_KEEP, maxBytes=DEFAULT_CAPTURE_MAX_BYTES, compress=False):
+        self.directory = directory
+        self.keep = max(1, int(keep))
+        self.maxBytes = maxBytes
+        self.compress = compress
+        self.totalBytes = 0
+        self._files = dict()   # 前缀 -> 该前缀已保存的文件路径（旧的在前）
+        self._order = deque()  # 全部文件路径，旧的在前
+        self._sizes = dict()   # 文件路径 -> 大小
+        self._seq = itertools.count(1)
+
+    def target(self, prefix):
+        """本次保存将写入的文件路径"""
+        filename = '{0}_{1}_{2}.html{3}'.format(
+            prefix, time.strftime('%Y%m%d-%H%M%S'), next(self._seq), '.gz' if self.compress else '')
+        return os.path.join(self.directory, filename)
+
+    def scan(self):
+        """把目录中已有的调试页面计入总大小"""
+        for path, size in _scan_files(self.directory, CAPTURE_SUFFIXES):
+            if os.path.dirname(path) == self.directory:
+                self._track(None, path, size)
+        self._prune()
+
+    def write(self, entry):
+        data = entry['content'].encode('utf-8', errors='replace')
+        if self.compress:
+            data = gzip.compress(data, compresslevel=6)
+        with open(entry['target'], 'wb') as f:
+            f.write(data)
+        self._track(entry['prefix'], entry['target'], len(data))
+        files = self._files[entry['prefix']]
+        while len(files) > self.keep:
+            self._remove(files.popleft())
+        self._prune()
+        return True
+
+    def _track(self, prefix, path, size):
+        if prefix is not None:
+            self._files.setdefault(prefix, deque()).append(path)
+        self._order.append(path)
+        self._sizes[path] = size
+        self.totalBytes += size
+
+    def _prune(self):
+        """总大小超出上限时从最旧的页面开始删除，至少保留最新的一个"""
+        while self.totalBytes > self.maxBytes and len(self._order) > 1:
+            path = self._order[0]
+            for files in self._files.values():
+                if files and files[0] == path:
+                    files.popleft()
+                    break
+            self._remove(path)
+
+    def _remove(self, path):
+        size = self._sizes.pop(path, None)
+        if size is None:
+            return
+        self.totalBytes -= size
+        try:
+            self._order.remove(path)
+        except ValueError:
+            pass
+        _remove_file(path)
+
+
+class BlobStore(object):
+    """
+    内容寻址的调试页面存储
+
+    页面按 sha1 保存为 blobs/<前两位>/<哈希>.html.gz，内容相同的页面只保存一份；
+    每次保存在 index.tsv 中追加一行（时间、前缀、商品id、哈希、原始大小、状态），
+    重复页面只多一行索引，所有不同版本的页面都会保留，便于事后比对状态变化。
+    索引和内容一起计入总大小，超出上限时从最旧的索引行开始删除，内容不再被任何索引行引用时一并删除，
+    即按最久未出现的顺序删除内容，索引中的每一行都能读到对应的页面。
+    """
+
+    def __init__(self, directory, maxBytes=DEFAULT_CAPTURE_MAX_BYTES):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.indexPath = os.path.join(directory, CAPTURE_INDEX)
+        self.blobDir = os.path.join(directory, CAPTURE_BLOBS)
+        self.totalBytes = 0
+        self.indexBytes = 0
+        self.blobCount = 0
+        self.dedupCount = 0
+        self._blobs = dict()   # 哈希 -> 内容文件大小
+        self._refs = dict()    # 哈希 -> 引用该内容的索引行数
+        self._rows = deque()   # 索引行 (哈希, 行文本, 字节数)，旧的在前
+
+    def target(self, prefix):
+        return self.indexPath
+
+    def blobPath(self, digest):
+        return os.path.join(self.blobDir, digest[:2], digest + '.html.gz')
+
+    def scan(self):
+        """读取已有的索引和内容：丢弃指向已不存在内容的索引行，删除没有索引行引用的内容"""
+        blobs = dict()
+        for path, size in _scan_files(self.blobDir, ('.html.gz',)):
+            blobs[os.path.basename(path)[:-len('.html.gz')]] = (path, size)
+        stale = False
+        if os.path.exists(self.indexPath):
+            with open(self.indexPath, encoding='utf-8') as f:
+                for line in f:
+                    row = dict(zip(INDEX_FIELDS, line.rstrip('\n').split('\t')))
+                    if row.get('hash') in blobs:
+                        self._addRow(row['hash'], line)
+                    else:
+                        stale = True
+        for digest, (path, size) in blobs.items():
+            if digest in self._refs:
+                self._blobs[digest] = size
+                self.totalBytes += size
+            else:
+                _remove_file(path)
+        if stale:
+            self._rewriteIndex()
+        self._prune()
+
+    def write(self, entry):
+        """保存页面内容（已有相同内容时只追加索引）
+        :return: 是否写入了新内容
+        """
+        data = entry['content'].encode('utf-8', errors='replace')
+        digest = hashlib.sha1(data).hexdigest()
+        created = digest not in self._blobs
+        if created:
+            path = self.blobPath(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            blob = gzip.compress(data, compresslevel=6)
+            with open(path, 'wb') as f:
+                f.write(blob)
+            self._blobs[digest] = len(blob)
+            self.totalBytes += len(blob)
+            self.blobCount += 1
+        else:
+            self.dedupCount += 1
+        row = (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time'])) + '.%03d' % (entry['time'] % 1 * 1000),
+               entry['prefix'], entry['skuId'] or '', digest, str(len(data)),
+               '' if entry['state'] is None else str(entry['state']))
+        line = '\t'.join(field.replace('\t', ' ') for field in row) + '\n'
+        with open(self.indexPath, 'a', encoding='utf-8') as f:
+            f.write(line)
+        self._addRow(digest, line)
+        self._prune()
+        return created
+
+    def _addRow(self, digest, line):
+        size = len(line.encode('utf-8'))
+        self._rows.append((digest, line, size))
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+        self.indexBytes += size
+        self.totalBytes += size
+
+    def _prune(self):
+        """总大小超出上限时删除最旧的索引行和不再被引用的内容，至少保留最新的一行"""
+        if self.totalBytes <= self.maxBytes:
+            return
+        limit = self.maxBytes * CAPTURE_PRUNE_RATIO
+        while self.totalBytes > limit and len(self._rows) > 1:
+            digest, _, size = self._rows.popleft()
+            self.indexBytes -= size
+            self.totalBytes -= size
+            self._refs[digest] -= 1
+            if not self._refs[digest]:
+                del self._refs[digest]
+                self.totalBytes -= self._blobs.pop(digest)
+                _remove_file(self.blobPath(digest))
+        self._rewriteIndex()
+
+    def _rewriteIndex(self):
+        """按内存中保留的索引行重写索引文件"""
+        temp = self.indexPath + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.writelines(line for _, line, _ in self._rows)
+        os.replace(temp, self.indexPath)
+
+    def history(self, prefix=None, skuId=None):
+        """读取索引
+        :param prefix: 只返回该前缀的记录
+        :param skuId: 只返回该商品的记录
+        :return: [dict(time, prefix, sku, hash, size, state)]
+        """
+        rows = []
+        if not os.path.exists(self.indexPath):
+            return rows
+        with open(self.indexPath, encoding='utf-8') as f:
+            for line in f:
+                row = dict(zip(INDEX_FIELDS, line.rstrip('\n').split('\t')))
+                if prefix is not None and row.get('prefix') != prefix:
+                    continue
+                if skuId is not None and row.get('sku') != str(skuId):
+                    continue
+                rows.append(row)
+        return rows
+
+    def load(self, digest):
+        """按哈希读取页面内容，内容已被清理时返回 None"""
+        try:
+            with open(self.blobPath(digest), 'rb') as f:
+                return gzip.decompress(f.read()).decode('utf-8')
+        except OSError:
+            return None
+
+
+class DebugWriter(object):
+    """
+    后台写入调试页面
+
+    调用方只做采样判断并放入有界队列，磁盘写入、压缩和清理都在后台线程中完成，
+    队列满时直接丢弃并计数，不会阻塞库存查询。页面按 store 保存：blobs 按内容去重并记录索引，
+    files 每个前缀保留最近 keep 个文件；两者都限制目录总大小。
+    """
+
+    def __init__(self, directory, mode=DEFAULT_CAPTURE_MODE, keep=DEFAULT_CAPTURE_KEEP,
+                 maxBytes=DEFAULT_CAPTURE_MAX_BYTES, compress=False, queueSize=DEFAULT_CAPTURE_QUEUE_SIZE,
+                 store=DEFAULT_CAPTURE_STORE):
+        """
+        :param directory: 调试目录
+        :param mode: 采样方式 all/changes/anomalies/off
+        :param keep: 每个前缀保留的页面数（files 方式）
+        :param maxBytes: 目录总大小上限(字节)
+        :param compress: 是否 gzip 压缩（files 方式，blobs 方式总是压缩）
+        :param queueSize: 等待写入的页面数上限
+        :param store: 存储方式 blobs/files
+        """
+        if mode not in CAPTURE_MODES:
+            logger.warning('未知的调试页面采样方式 {0}，使用 {1}'.format(mode, DEFAULT_CAPTURE_MODE))
+            mode = DEFAULT_CAPTURE_MODE
+        if store not in STORE_TYPES:
+            logger.warning('未知的调试页面存储方式 {0}，使用 {1}'.format(store, DEFAULT_CAPTURE_STORE))
+            store = DEFAULT_CAPTURE_STORE
+        self.directory = directory
+        self.mode = mode
+        if store == STORE_BLOBS:
+            self.store = BlobStore(directory, maxBytes)
+        else:
+            self.store = FileStore(directory, keep, maxBytes, compress)
+        self.savedCount = 0
+        self.skippedCount = 0
+        self.droppedCount = 0
+        self._queue = queue.Queue(maxsize=max(1, int(queueSize)))
+        self._lastState = dict()  # 前缀 -> 上次保存时的状态或内容校验值
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _sample(self, content, prefix, state, anomaly):
+        """按采样方式判断是否保存"""
+        if self.mode == CAPTURE_OFF:
+            return False
+        if self.mode == CAPTURE_ALL or anomaly:
+            return True
+        if self.mode == CAPTURE_ANOMALIES:
+            return False
+        if state is None:
+            state = zlib.crc32(content.encode('utf-8', errors='replace'))
+        if self._lastState.get(prefix) == state:
+            return False
+        self._lastState[prefix] = state
+        return True
+
+    def save(self, content, prefix, state=None, anomaly=False, skuId=None):
+        """提交一个调试页面
+        :param content: 页面内容
+        :param prefix: 文件名前缀
+        :param state: 页面对应的状态（如库存结论），changes 方式下状态变化才保存，None 时比较内容
+        :param anomaly: 是否异常，异常页面在 changes/anomalies 方式下总是保存
+        :param skuId: 页面对应的商品id，记入索引
+        :return: 将要写入的文件（blobs 方式为索引文件）路径，未采样或队列已满返回 None
+        """
+        if not self._sample(content, prefix, state, anomaly):
+            self.skippedCount += 1
+            return None
+        target = self.store.target(prefix)
+        self._start()
+        try:
+            self._queue.put_nowait(dict(time=time.time(), prefix=prefix, skuId=skuId, state=state,
+                                        target=target, content=content))
+        except queue.Full:
+            self.droppedCount += 1
+            # 丢弃后允许下一次重新保存
+            self._lastState.pop(prefix, None)
+            logger.debug('调试页面队列已满，丢弃 %s', prefix)
+            return None
+        return target
+
+    def flush(self, timeout=None):
+        """等待队列中的页面写完
+        :param timeout: 最长等待时间(秒)
+        """
+        if self._thread is None:
+            return
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if end is None else end - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+                self._queue.all_tasks_done.wait(remaining)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='debug-writer', daemon=True)
+            self._thread.start()
+            # 退出前写完已提交的页面
+            atexit.register(self.flush, 5)
+
+    def _run(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.store.scan()
+        except OSError as e:
+            logger.error('调试目录不可用: {0}'.format(e))
+        while True:
+            entry = self._queue.get()
+            try:
+                self.store.write(entry)
+                self.savedCount += 1
+                logger.debug('已保存调试页面: %s', entry['prefix'])
+            except Exception as e:
+                logger.error('保存调试页面 {0} 失败: {1}'.format(entry['prefix'], e))
+            finally:
+                self._queue.task_done()
+
+    def report(self):
+        """调试页面统计的可读文本"""
+        text = '已保存{0}个，未采样{1}个，队列满丢弃{2}个，目录占用{3:.1f}MB'.format(
+            self.savedCount, self.skippedCount, self.droppedCount, self.store.totalBytes / 1024 / 1024)
+        if isinstance(self.store, BlobStore):
+            text += '，其中不同内容{0}份，重复内容{1}次'.format(self.store.blobCount, self.store.dedupCount)
+        return text
@@ -0,0 +1,86 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# 保留 RTT 最小的样本数
+DEFAULT_MAX_SAMPLES = 32
+# HTTP Date 头精确到秒
+DATE_RESOLUTION = 1.0
+
+
+class ClockOffsetEstimator(object):
+    """
+    服务器时钟偏差估计
+
+    从 Session 已有请求的响应中采样 HTTP Date 头和往返时间（RTT）。服务器在请求发出
+    到收到响应头之间的某个时刻生成 Date，且 Date 只精确到秒，所以每个样本给出偏差
+    （服务器时间 - 本机时间）的一个区间：
+
+        [Date - 收到时间, Date + 1 - 发出时间]
+
+    与 NTP 的做法类似，只保留 RTT 最小的若干样本，再对它们的区间求交集。交集中点作为
+    偏差估计，半宽即误差界；样本跨越秒边界越多，区间越窄。
+    """
+
+    def __init__(self, maxSamples=DEFAULT_MAX_SAMPLES):
+        self.maxSamples = maxSamples
+        self._samples = []  # [(rtt, 下界, 上界)]
+        self._lock = threading.Lock()
+        self.sampleCount = 0
+
+    def addSample(self, serverDate, sentAt, receivedAt):
+        """加入一个样本
+        :param serverDate: 响应的 Date 头字符串
+        :param sentAt: 请求发出时的本机时间戳(秒)
+        :param receivedAt: 收到响应头时的本机时间戳(秒)
+        :return: 是否成功加入
+        """
+        try:
+            server = parsedate_to_datetime(serverDate).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return False
+        if receivedAt < sentAt:
+            return False
+        sample = (receivedAt - sentAt, server - receivedAt, server + DATE_RESOLUTION - sentAt)
+        with self._lock:
+            self.sampleCount += 1
+            self._samples.append(sample)
+            self._samples.sort()
+            del self._samples[self.maxSamples:]
+        return True
+
+    def onResponse(self, resp, *args, **kwargs):
+        """requests 的 response hook，从响应中采样
+        resp.elapsed 为请求发出到解析完响应头的时间。
+        """
+        serverDate = resp.headers.get('Date')
+        if serverDate:
+            receivedAt = time.time()
+            self.addSample(serverDate, receivedAt - resp.elapsed.total_seconds(), receivedAt)
+        return resp
+
+    def estimate(self):
+        """估计服务器时钟偏差
+        :return: (偏差, 误差界)，单位秒，偏差为正表示服务器时间快于本机；没有样本时返回 None
+        """
+        with self._lock:
+            samples = list(self._samples)
+        if not samples:
+            return None
+        lower = max(sample[1] for sample in samples)
+        upper = min(sample[2] for sample in samples)
+        if lower > upper:
+            # 区间没有交集（如网络路径变化），退回 RTT 最小的单个样本
+            _, lower, upper = samples[0]
+        return (lower + upper) / 2, (upper - lower) / 2
+
+    def serverTimeToLocal(self, timestamp):
+        """把服务器时间戳换算为本机时间戳
+        :return: (本机时间戳, 误差界)，没有样本时原样返回，误差界为 None
+        """
+        estimate = self.estimate()
+        if estimate is None:
+            return timestamp, None
+        offset, error = estimate
+        return timestamp - offset, error
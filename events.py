@@ -0,0 +1,210 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import os
+import queue
+import threading
+import time
+
+from log import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 事件日志文件，每天一个，每行一条 JSON
+EVENT_FILENAME = 'logs/jd-buyer-events_%Y_%m_%d.jsonl'
+# 等待写入的事件数上限，写入跟不上时丢弃新事件
+EVENT_QUEUE_SIZE = 10000
+# 从调用参数中记录的字段：参数名 -> 事件字段名
+EVENT_ARGS = {'skuId': 'sku', 'areaId': 'area', 'skuNum': 'num'}
+
+# 当前正在记录的事件字段，线程和协程各自独立
+_current = contextvars.ContextVar('event', default=None)
+# 外层流程指定的公共字段，如下单流程中的商品id和地区
+_base = contextvars.ContextVar('eventBase', default=None)
+
+
+def _dumps(record):
+    if orjson is not None:
+        return orjson.dumps(record, default=str) + b'\n'
+    return (json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+
+
+def succeeded(result):
+    """通用的结果字段：True/False、带 success 的响应 dict 或 (结果, 消息) 元组"""
+    if isinstance(result, dict):
+        return {'ok': bool(result.get('success'))}
+    if isinstance(result, tuple):
+        return {'ok': bool(result[0])}
+    return {'ok': bool(result)}
+
+
+@contextlib.contextmanager
+def event_fields(**fields):
+    """在 with 块内记录的事件都带上 fields（调用参数中的同名字段优先）"""
+    token = _base.set(dict(_base.get() or {}, **fields))
+    try:
+        yield
+    finally:
+        _base.reset(token)
+
+
+def annotate(**fields):
+    """给当前正在记录的事件补充字段，没有事件时什么也不做"""
+    event = _current.get()
+    if event is not None:
+        event.update(fields)
+
+
+def annotate_response(endpoint, resp):
+    """把响应的接口、状态码、大小和耗时记入当前事件，同一事件中后面的响应覆盖前面的"""
+    event = _current.get()
+    if event is None:
+        return
+    content = getattr(resp, '_content', None)
+    if isinstance(content, bytes):
+        size = len(content)
+    else:
+        size = resp.headers.get('Content-Length')
+        size = int(size) if size and size.isdigit() else None
+    event.update(endpoint=endpoint, status=resp.status_code, bytes=size,
+                 http_ms=round(resp.elapsed.total_seconds() * 1000, 1))
+
+
+class EventLog(object):
+    """
+    结构化事件日志
+
+    每次库存查询、购物车操作和订单提交写一行紧凑的 JSON（商品、地区、接口、状态码、大小、
+    耗时、结论等），便于直接统计一天运行的耗时和成功率。序列化和写文件都在后台线程完成，
+    安装了 orjson 时使用 orjson 序列化。
+    """
+
+    def __init__(self, enabled=False, filename=EVENT_FILENAME, queueSize=EVENT_QUEUE_SIZE):
+        """
+        :param enabled: 是否记录事件
+        :param filename: 文件名，可包含 strftime 格式
+        :param queueSize: 等待写入的事件数上限
+        """
+        self.enabled = enabled
+        self.filename = filename
+        self.droppedCount = 0
+        self._queue = queue.Queue(maxsize=queueSize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        """记录一个事件，值为 None 的字段不输出"""
+        if not self.enabled:
+            return
+        record = {'ts': round(time.time(), 3), 'event': event}
+        record.update((key, value) for key, value in fields.items() if value is not None)
+        self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.droppedCount += 1
+
+    def flush(self, timeout=None):
+        """等待队列中的事件写完"""
+        if self._thread is None:
+            return
+        with self._queue.all_tasks_done:
+            self._queue.all_tasks_done.wait_for(lambda: not self._queue.unfinished_tasks, timeout)
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='event-log', daemon=True)
+            self._thread.start()
+            atexit.register(self.flush, 5)
+
+    def _run(self):
+        path = f = None
+        while True:
+            record = self._queue.get()
+            try:
+                target = time.strftime(self.filename, time.localtime(record['ts']))
+                if target != path:
+                    if f is not None:
+                        f.close()
+                    os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+                    path, f = target, open(target, 'ab')
+                f.write(_dumps(record))
+                if self._queue.qsize() == 0:
+                    f.flush()
+            except Exception as e:
+                logger.error('写入事件日志失败: %s', e)
+            finally:
+                self._queue.task_done()
+
+
+def recorded(event, outcome=None):
+    """方法装饰器：为一次调用记录一个事件
+
+    事件包含方法名、调用参数中的商品id/地区/数量、总耗时、异常，以及调用过程中 annotate /
+    annotate_response 补充的字段。所在对象的 events（EventLog）未开启时直接调用原方法。
+    :param event: 事件类型，如 'poll'、'cart'、'submit'
+    :param outcome: 把返回值转换为事件字段的函数，返回 dict
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        def begin(obj, args, kwargs):
+            events = getattr(obj, 'events', None)
+            if events is None or not events.enabled:
+                return None, None, None
+            arguments = signature.bind_partial(obj, *args, **kwargs).arguments
+            fields = dict(_base.get() or {}, op=func.__name__)
+            fields.update((name, arguments[arg]) for arg, name in EVENT_ARGS.items() if arg in arguments)
+            return events, fields, _current.set(fields)
+
+        def end(events, fields, token, start, result=None, error=None):
+            _current.reset(token)
+            fields['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            if error is not None:
+                fields['error'] = type(error).__name__
+            elif outcome is not None:
+                fields.update(outcome(result))
+            events.emit(event, **fields)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def wrapper(obj, *args, **kwargs):
+                events, fields, token = begin(obj, args, kwargs)
+                if events is None:
+                    return await func(obj, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = await func(obj, *args, **kwargs)
+                except BaseException as e:
+                    end(events, fields, token, start, error=e)
+                    raise
+                end(events, fields, token, start, result)
+                return result
+        else:
+            @functools.wraps(func)
+            def wrapper(obj, *args, **kwargs):
+                events, fields, token = begin(obj, args, kwargs)
+                if events is None:
+                    return func(obj, *args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    result = func(obj, *args, **kwargs)
+                except BaseException as e:
+                    end(events, fields, token, start, error=e)
+                    raise
+                end(events, fields, token, start, result)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,170 @@
+# -*- coding:utf-8 -*-
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from log import logger
+
+# 指标接口默认只监听本机
+DEFAULT_METRICS_HOST = '127.0.0.1'
+# 指标接口端口，0 为不开启
+DEFAULT_METRICS_PORT = 0
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+PREFIX = 'jdbuyer_'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(key, _escape(value)) for key, value in labels.items()) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Writer(object):
+    """按 OpenMetrics 文本格式拼接指标"""
+
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help):
+        self.lines.append('# TYPE {0}{1} {2}'.format(PREFIX, name, kind))
+        self.lines.append('# HELP {0}{1} {2}'.format(PREFIX, name, help))
+
+    def sample(self, name, value, **labels):
+        self.lines.append('{0}{1}{2} {3}'.format(PREFIX, name, _labels(labels), _number(value)))
+
+    def counter(self, name, help, samples):
+        """
+        :param samples: [(标签 dict, 值)]
+        """
+        self.family(name, 'counter', help)
+        for labels, value in samples:
+            self.sample(name + '_total', value, **labels)
+
+    def gauge(self, name, help, samples):
+        self.family(name, 'gauge', help)
+        for labels, value in samples:
+            self.sample(name, value, **labels)
+
+    def histogram(self, name, help, samples):
+        """
+        :param samples: [(标签 dict, metrics.Histogram)]
+        """
+        self.family(name, 'histogram', help)
+        for labels, histogram in samples:
+            for bound, count in histogram.cumulative():
+                self.sample(name + '_bucket', count, **dict(labels, le=_number(float(bound))))
+            self.sample(name + '_count', histogram.count, **labels)
+            self.sample(name + '_sum', histogram.sum, **labels)
+
+    def text(self):
+        return '\n'.join(self.lines + ['# EOF', ''])
+
+
+def render(session):
+    """把 Session 中的统计转换为 OpenMetrics 文本
+    :param session: JdSession.Session
+    :return: str
+    """
+    w = _Writer()
+    # 查询和请求线程在抓取期间仍会新增接口、结论和错误类别，只遍历各统计的副本
+    verdictCounts, lastSuccessAt = session.pollStats.snapshot()
+    w.counter('polls', '库存查询次数', [({}, sum(verdictCounts.values()))])
+    w.counter('poll_verdicts', '库存查询结论次数', [
+        ({'verdict': verdict}, count) for verdict, count in sorted(verdictCounts.items())])
+    w.gauge('last_successful_poll_timestamp_seconds', '最近一次得出库存结论的时间', [
+        ({}, lastSuccessAt)] if lastSuccessAt is not None else [])
+    w.gauge('cookie_valid', '当前登录状态是否有效', [({}, 1 if session.isLogin else 0)])
+
+    histograms, statusCounts = session.requestStats.snapshot()
+    w.histogram('request_duration_seconds', '各接口响应耗时（到收到响应头）', [
+        ({'endpoint': endpoint}, histogram) for endpoint, histogram in sorted(histograms.items())])
+    w.counter('http_responses', '各接口响应状态码次数', [
+        ({'endpoint': endpoint, 'code': status}, count)
+        for (endpoint, status), count in sorted(statusCounts.items())])
+    timeoutCounts = dict(session.timeouts.timeoutCounts)
+    w.counter('request_timeouts', '各接口请求超时次数', [
+        ({'endpoint': endpoint}, count) for endpoint, count in sorted(timeoutCounts.items())])
+
+    policies = [(name, policy.snapshot()) for name, policy in (
+        ('request', session.retryPolicy), ('submit', session.submitPolicy), ('mutation', session.mutationPolicy))]
+    w.counter('retries', '退避重试次数', [({'policy': name}, retryCount) for name, (retryCount, _) in policies])
+    w.counter('request_failures', '按错误类别统计的失败次数', [
+        ({'policy': name, 'category': category}, count)
+        for name, (_, failureCounts) in policies for category, count in sorted(failureCounts.items())])
+
+    if session.hedger is not None:
+        w.counter('hedged_requests', '库存查询发出的对冲请求次数', [({}, session.hedger.hedgeCount)])
+    timings = session.httpTimings
+    w.histogram('request_phase_seconds', '各接口请求各阶段耗时', [
+        ({'endpoint': endpoint, 'phase': phase}, histogram)
+        for endpoint, histograms in sorted(dict(timings.histograms).items())
+        for phase, histogram in histograms.items() if histogram.count])
+    w.histogram('stage_duration_seconds', '下单流程各阶段耗时', [
+        ({'stage': name}, histogram) for name, histogram in sorted(dict(session.tracer.histograms).items())])
+    return w.text()
+
+
+class MetricsServer(object):
+    """
+    本地指标接口
+
+    在后台线程中提供 GET /metrics，按 OpenMetrics 文本格式输出库存查询次数与结论、各接口耗时直方图、
+    状态码与失败次数、重试次数、登录状态和最近一次成功查询的时间。每次抓取时现场汇总，不影响查询。
+    """
+
+    def __init__(self, session, host=DEFAULT_METRICS_HOST, port=DEFAULT_METRICS_PORT):
+        """
+        :param session: JdSession.Session
+        :param host: 监听地址
+        :param port: 监听端口
+        """
+        self.session = session
+        self.host = host
+        self.port = port
+        self._server = None
+
+    def start(self):
+        if self._server is not None:
+            return
+        session = self.session
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = render(session).encode('utf-8')
+                except Exception as e:
+                    logger.error('生成指标失败: %s', e)
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True).start()
+        logger.info('指标接口已开启: http://%s:%d/metrics', self.host, self.port)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
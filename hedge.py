@@ -0,0 +1,250 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from events import annotate
+from log import logger
+from metrics import LatencyWindow, DEFAULT_MIN_SAMPLES
+
+# 在对冲前等待的耗时分位数：超过最近 p95 仍无响应时发出第二个请求
+DEFAULT_HEDGE_PERCENTILE = 0.95
+# 同时在途的对冲请求上限，避免网络整体变慢时请求量翻倍
+DEFAULT_HEDGE_MAX_INFLIGHT = 2
+# 对冲请求使用的线程数（主请求与对冲请求共用）
+HEDGE_WORKERS = 16
+
+
+class CancelEvent(threading.Event):
+    """
+    对冲请求的放弃事件，被置位时依次调用注册的回调（如中断正在读取的响应）
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._callbacks = []
+        self._callbackLock = threading.Lock()
+
+    def onSet(self, callback):
+        """注册被置位时调用的回调，已被置位时立即调用"""
+        with self._callbackLock:
+            if not self.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def set(self):
+        with self._callbackLock:
+            super().set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug('放弃请求时出错: %s', e)
+
+
+class Hedger(object):
+    """
+    对冲请求
+
+    主请求在 percentile 分位耗时内没有返回时，再发出一个相同的请求（连接池中的另一条连接），
+    先得出结果（不为 None）的请求生效，另一个请求通过 cancel 事件（协程版本直接取消任务）尽快放弃。
+    在途的对冲请求数量受 maxInFlight 限制，超出时只等待主请求；样本不足时不对冲。
+
+    分位耗时按每个接口单次调用的完整耗时（含读取内容）统计，与响应 hook 记录的首包耗时不同。
+    对冲请求先返回时，被放弃的主请求按放弃时已等待的时间（耗时的下界）计入，否则最慢的样本总被丢弃，
+    分位耗时会越来越低、对冲越来越多；对冲请求发出得晚，放弃时的耗时不代表单次请求耗时，不计入。
+    """
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, maxInFlight=DEFAULT_HEDGE_MAX_INFLIGHT,
+                 minSamples=DEFAULT_MIN_SAMPLES):
+        """
+        :param percentile: 发出对冲请求前等待的耗时分位数
+        :param maxInFlight: 同时在途的对冲请求上限
+        :param minSamples: 开始对冲所需的最少样本数
+        """
+        self.percentile = percentile
+        self.maxInFlight = max(1, int(maxInFlight))
+        self.minSamples = minSamples
+        self.windows = dict()  # 接口 -> 单次调用耗时，即不对冲时的查询耗时
+        self.latency = LatencyWindow()  # 对冲后每次查询的实际耗时
+        self.requestCount = 0
+        self.hedgeCount = 0
+        self.hedgeWins = 0
+        self.budgetExhausted = 0
+        self._inFlight = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def delayFor(self, endpoint):
+        """发出对冲请求前的等待时间(秒)，样本不足时返回 None"""
+        window = self.windows.get(endpoint)
+        if window is None or len(window) < self.minSamples:
+            return None
+        return window.percentile(self.percentile)
+
+    def _window(self, endpoint):
+        window = self.windows.get(endpoint)
+        if window is None:
+            with self._lock:
+                window = self.windows.setdefault(endpoint, LatencyWindow())
+        return window
+
+    def _timed(self, window, func, cancel):
+        """执行一次调用，未被放弃时记录完整耗时（被放弃的主请求由 run 记录）"""
+        start = time.perf_counter()
+        result = func(cancel)
+        if not cancel.is_set():
+            window.add(time.perf_counter() - start)
+        return result
+
+    async def _timedAsync(self, window, func):
+        """执行一次调用并记录完整耗时，被取消时不记录（被放弃的主请求由 runAsync 记录）"""
+        start = time.perf_counter()
+        result = await func()
+        window.add(time.perf_counter() - start)
+        return result
+
+    def _acquire(self):
+        with self._lock:
+            if self._inFlight >= self.maxInFlight:
+                self.budgetExhausted += 1
+                return False
+            self._inFlight += 1
+            self.hedgeCount += 1
+            return True
+
+    def _release(self, *args):
+        with self._lock:
+            self._inFlight -= 1
+
+    def _record(self, start, hedgeWon):
+        self.latency.add(time.perf_counter() - start)
+        with self._lock:
+            self.requestCount += 1
+            if hedgeWon:
+                self.hedgeWins += 1
+
+    def run(self, endpoint, func):
+        """执行 func(cancel)，超过对冲等待时间仍未返回时再执行一次，取先得出的结果
+        :param endpoint: 接口名，用于查询耗时分位数
+        :param func: 发送请求的函数，参数为 CancelEvent，被置位时应尽快放弃；返回 None 表示没有得出结果
+        :return: 先得出的结果；两个请求都没有结果时，主请求抛出了异常则重新抛出，否则返回 None
+        """
+        window = self._window(endpoint)
+        delay = self.delayFor(endpoint)
+        start = time.perf_counter()
+        if delay is None:
+            result = self._timed(window, func, CancelEvent())
+            self._record(start, False)
+            return result
+
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge')
+        primaryCancel = CancelEvent()
+        # 在调用方上下文的副本中执行，事件字段和追踪阶段仍记到调用方的事件和追踪上；
+        # 同一个上下文不能同时在两个线程中进入，主请求和对冲请求各用一份副本
+        primary = self._executor.submit(contextvars.copy_context().run, self._timed, window, func, primaryCancel)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._acquire():
+            result = primary.result()
+            self._record(start, False)
+            return result
+
+        logger.debug('%s 超过 %.0fms 未响应，发出对冲请求', endpoint, delay * 1000)
+        annotate(hedged=True)
+        hedgeCancel = CancelEvent()
+        hedge = self._executor.submit(contextvars.copy_context().run, self._timed, window, func, hedgeCancel)
+        hedge.add_done_callback(self._release)
+        pending = {primary: primaryCancel, hedge: hedgeCancel}
+        error = None
+        while pending:
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if future is primary:
+                        error = e
+                    continue
+                # 没有得出结论（请求失败或被放弃）视为落后，继续等待另一个请求
+                if result is None:
+                    continue
+                for cancel in pending.values():
+                    cancel.set()
+                if primary in pending:
+                    window.add(time.perf_counter() - start)
+                self._record(start, future is hedge)
+                return result
+        self._record(start, False)
+        if error is not None:
+            raise error
+        return None
+
+    async def runAsync(self, endpoint, func):
+        """run 的协程版本，落后的请求直接取消
+        :param func: 无参数的协程函数
+        """
+        window = self._window(endpoint)
+        delay = self.delayFor(endpoint)
+        start = time.perf_counter()
+        primary = asyncio.ensure_future(self._timedAsync(window, func))
+        if delay is None:
+            result = await primary
+            self._record(start, False)
+            return result
+
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done or not self._acquire():
+            result = await primary
+            self._record(start, False)
+            return result
+
+        logger.debug('%s 超过 %.0fms 未响应，发出对冲请求', endpoint, delay * 1000)
+        annotate(hedged=True)
+        hedge = asyncio.ensure_future(self._timedAsync(window, func))
+        hedge.add_done_callback(self._release)
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        if task is primary:
+                            error = task.exception()
+                        continue
+                    if task.result() is None:
+                        continue
+                    if primary in pending:
+                        window.add(time.perf_counter() - start)
+                    self._record(start, task is hedge)
+                    return task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+        self._record(start, False)
+        if error is not None:
+            raise error
+        return None
+
+    def report(self):
+        """对冲率与查询耗时的可读文本，并附上单次请求耗时作对比"""
+        if not self.requestCount:
+            return '暂无查询'
+        text = '对冲率{0:.1%}({1}/{2}次，对冲先返回{3}次，预算用尽{4}次)，查询耗时 p50 {5:.0f}ms/p95 {6:.0f}ms/p99 {7:.0f}ms'.format(
+            self.hedgeCount / self.requestCount, self.hedgeCount, self.requestCount, self.hedgeWins,
+            self.budgetExhausted, self.latency.percentile(0.5) * 1000, self.latency.percentile(0.95) * 1000,
+            self.latency.percentile(0.99) * 1000)
+        for endpoint, window in sorted(self.windows.items()):
+            if not len(window):
+                continue
+            text += '，{3} 单次请求 p50 {0:.0f}ms/p95 {1:.0f}ms/p99 {2:.0f}ms'.format(
+                window.percentile(0.5) * 1000, window.percentile(0.95) * 1000, window.percentile(0.99) * 1000, endpoint)
+        return text
@@ -0,0 +1,253 @@
+# -*- coding:utf-8 -*-
+import atexit
+import contextlib
+import contextvars
+import socket
+import threading
+import time
+
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+from events import annotate
+from log import logger
+from metrics import Histogram
+
+# 记录的阶段：DNS 解析、TCP 连接、TLS 握手、首字节（发出请求到收到响应头）、下载响应体
+PHASES = ('dns', 'connect', 'tls', 'ttfb', 'download')
+
+# 正在测量的请求：urllib3 在发起请求的线程上建立连接和读取响应，httpcore 在发起请求的协程中调用 trace 扩展，
+# 用上下文变量使同一线程上并发的协程各自测量
+_timing = contextvars.ContextVar('httptiming', default=None)
+# httpcore 的连接事件对应的阶段，DNS 解析在 connect_tcp 中完成，计入 connect
+HTTPX_PHASES = {'connect_tcp': 'connect', 'start_tls': 'tls'}
+
+
+class Timing(object):
+    """一次请求（含重定向）各阶段的耗时(秒)，没有经过的阶段为 None"""
+
+    __slots__ = PHASES + ('newConnections', '_sendAt', '_headersAt', '_stepAt')
+
+    def __init__(self):
+        for phase in PHASES:
+            setattr(self, phase, None)
+        self.newConnections = 0
+        self._sendAt = None
+        self._headersAt = None
+        self._stepAt = None
+
+    def add(self, phase, seconds):
+        setattr(self, phase, (getattr(self, phase) or 0.0) + seconds)
+
+    def fields(self):
+        """各阶段毫秒数，用于事件日志"""
+        return {phase + '_ms': round(getattr(self, phase) * 1000, 1)
+                for phase in PHASES if getattr(self, phase) is not None}
+
+    def __str__(self):
+        parts = ['{0} {1:.1f}ms'.format(phase, getattr(self, phase) * 1000)
+                 for phase in PHASES if getattr(self, phase) is not None]
+        parts.append('新建连接' if self.newConnections else '复用连接')
+        return '，'.join(parts)
+
+
+class _TimedConnectionMixin(object):
+    """
+    在建立连接、发出请求和收到响应头时记录耗时；当前线程没有在测量时不做额外的事
+    """
+
+    def _new_conn(self):
+        timing = _timing.get()
+        if timing is None:
+            return super()._new_conn()
+        timing.newConnections += 1
+        start = time.perf_counter()
+        try:
+            address = socket.getaddrinfo(self._dns_host, self.port, 0, socket.SOCK_STREAM)[0][4][0]
+        except OSError:
+            # 解析失败时交给 urllib3 按原样解析并抛出它的异常
+            return super()._new_conn()
+        resolved = time.perf_counter()
+        timing.add('dns', resolved - start)
+        # 用解析好的地址连接，证书校验和 SNI 仍使用 self.host；该地址连不上时按域名重新连接
+        host, self._dns_host = self._dns_host, address
+        try:
+            sock = super()._new_conn()
+        except NewConnectionError:
+            self._dns_host = host
+            sock = super()._new_conn()
+        finally:
+            self._dns_host = host
+        timing.add('connect', time.perf_counter() - resolved)
+        return sock
+
+    def connect(self):
+        super().connect()
+        timing = _timing.get()
+        # 普通 HTTP 在 request() 中才建立连接，首字节从连接建立后算起
+        if timing is not None and timing._sendAt is not None:
+            timing._sendAt = time.perf_counter()
+
+    def request(self, *args, **kwargs):
+        timing = _timing.get()
+        if timing is not None:
+            timing._sendAt = time.perf_counter()
+        return super().request(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        response = super().getresponse(*args, **kwargs)
+        timing = _timing.get()
+        if timing is not None and timing._sendAt is not None:
+            timing._headersAt = time.perf_counter()
+            timing.add('ttfb', timing._headersAt - timing._sendAt)
+            timing._sendAt = None
+        return response
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+
+    def connect(self):
+        timing = _timing.get()
+        if timing is None:
+            return super().connect()
+        start = time.perf_counter()
+        before = (timing.dns or 0.0) + (timing.connect or 0.0)
+        super().connect()
+        # connect() 中除 _new_conn 以外的时间即 TLS 握手
+        timing.add('tls', time.perf_counter() - start - ((timing.dns or 0.0) + (timing.connect or 0.0) - before))
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+async def trace_httpx(event, info):
+    """httpx.AsyncClient 的 trace 扩展：把 httpcore 报告的连接、TLS 和首字节事件记到正在测量的请求上
+    :param event: 事件名，如 connection.connect_tcp.started、http11.receive_response_headers.complete
+    :param info: 事件参数
+    """
+    timing = _timing.get()
+    if timing is None:
+        return
+    now = time.perf_counter()
+    name, _, stage = event.rpartition('.')
+    step = name.rpartition('.')[2]
+    if step in HTTPX_PHASES:
+        if stage == 'started':
+            timing._stepAt = now
+        elif stage == 'complete' and timing._stepAt is not None:
+            timing.add(HTTPX_PHASES[step], now - timing._stepAt)
+            if step == 'connect_tcp':
+                timing.newConnections += 1
+            timing._stepAt = None
+    elif step == 'send_request_headers' and stage == 'started':
+        timing._sendAt = now
+    elif step == 'receive_response_headers' and stage == 'complete' and timing._sendAt is not None:
+        timing._headersAt = now
+        timing.add('ttfb', now - timing._sendAt)
+        timing._sendAt = None
+
+
+def instrument(sess):
+    """让 requests 会话的各连接池使用带计时的连接，需在发出请求前调用
+    :param sess: requests.Session
+    :return: sess
+    """
+    for adapter in sess.adapters.values():
+        adapter.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+    return sess
+
+
+class HttpTimings(object):
+    """
+    请求各阶段耗时：DNS 解析、TCP 连接、TLS 握手、首字节和下载
+
+    measure() 包住一次请求（含重定向），期间由带计时的连接（异步请求由 trace_httpx）记录各阶段，结束后按接口累计到各阶段的直方图，
+    写入当前事件并输出 debug 日志。流式读取的请求在返回时响应体还未读完，不统计下载耗时。
+    程序退出时输出一次汇总。
+    """
+
+    def __init__(self, enabled=True):
+        """
+        :param enabled: 是否记录，为 False 时 measure() 不做任何事
+        """
+        self.enabled = enabled
+        self.histograms = dict()  # 接口 -> {阶段: Histogram}
+        self.requestCounts = dict()
+        self.newConnectionCounts = dict()
+        self._lock = threading.Lock()
+        if enabled:
+            atexit.register(self.logReport)
+
+    def _histograms(self, endpoint):
+        histograms = self.histograms.get(endpoint)
+        if histograms is None:
+            with self._lock:
+                histograms = self.histograms.setdefault(endpoint, {phase: Histogram() for phase in PHASES})
+        return histograms
+
+    @contextlib.contextmanager
+    def measure(self, endpoint, stream=False):
+        """测量 with 块内发出的请求
+        :param endpoint: 接口名
+        :param stream: 是否流式读取响应
+        :return: Timing，未开启时为 None
+        """
+        if not self.enabled or _timing.get() is not None:
+            yield None
+            return
+        timing = Timing()
+        token = _timing.set(timing)
+        try:
+            yield timing
+        finally:
+            _timing.reset(token)
+        if timing._headersAt is None:
+            return
+        if not stream:
+            timing.download = time.perf_counter() - timing._headersAt
+        self.record(endpoint, timing)
+
+    def record(self, endpoint, timing):
+        histograms = self._histograms(endpoint)
+        for phase in PHASES:
+            seconds = getattr(timing, phase)
+            if seconds is not None:
+                histograms[phase].observe(seconds)
+        with self._lock:
+            self.requestCounts[endpoint] = self.requestCounts.get(endpoint, 0) + 1
+            if timing.newConnections:
+                self.newConnectionCounts[endpoint] = self.newConnectionCounts.get(endpoint, 0) + 1
+        annotate(**timing.fields())
+        logger.debug('%s 请求耗时: %s', endpoint, timing)
+
+    def report(self):
+        """各接口各阶段平均耗时与 p90 的可读文本，DNS/连接/TLS 只统计新建连接的请求"""
+        lines = []
+        for endpoint, histograms in sorted(self.histograms.items()):
+            count = self.requestCounts.get(endpoint, 0)
+            if not count:
+                continue
+            parts = []
+            for phase in PHASES:
+                histogram = histograms[phase]
+                if histogram.count:
+                    parts.append('{0} 平均{1:.1f}ms/p90≤{2:.1f}ms'.format(
+                        phase, histogram.sum / histogram.count * 1000, histogram.quantile(0.9) * 1000))
+            lines.append('{0}: {1}次，新建连接{2}次，{3}'.format(
+                endpoint, count, self.newConnectionCounts.get(endpoint, 0), '，'.join(parts)))
+        return lines
+
+    def logReport(self):
+        for line in self.report():
+            logger.info('请求阶段耗时 %s', line)
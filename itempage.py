@@ -0,0 +1,311 @@
+# -*- coding:utf-8 -*-
+import hashlib
+import time
+
+from lxml import etree
+
+# 库存结论
+IN_STOCK = 'in_stock'          # 有现货标记或加入购物车按钮
+OUT_OF_STOCK = 'out_of_stock'  # store-prompt 明确提示无货
+NO_MARKER = 'no_marker'        # 页面中没有任何有货标记
+
+# 流式读取的分块大小
+STOCK_CHUNK_SIZE = 8192
+
+# 页面指纹只覆盖判断所需的区域：标记前后的一段内容
+ITEM_PAGE_MARKERS = ('store-prompt', 'activity-message', 'InitCartUrl',
+                     'data-shopid', 'summary-price-wrap', 'J-deliver')
+FINGERPRINT_LOOKBEHIND = 256
+FINGERPRINT_WINDOW = 2048
+
+# 商品页面快照的默认有效期(秒)
+ITEM_PAGE_TTL = 2.0
+
+
+def _first_text(el):
+    """获取元素的第一个直接文本节点，等价于 xpath 的 text()[1]
+    :param el: lxml 元素
+    :return: 文本，不存在时返回 None
+    """
+    if el.text:
+        return el.text
+    for child in el:
+        if child.tail:
+            return child.tail
+    return None
+
+
+def _stock_from_tree(html):
+    # 检查是否有"无货"字样
+    stock_status = html.xpath('//div[@class="store-prompt"]/text()')
+    if stock_status and '无货' in stock_status[0]:
+        return OUT_OF_STOCK
+    # 检查是否有"现货"字样或加入购物车按钮
+    has_stock = html.xpath('//div[@class="activity-message"]/span[contains(text(),"现货")]/text()') or \
+        html.xpath('//a[@id="InitCartUrl"]')
+    return IN_STOCK if has_stock else NO_MARKER
+
+
+def parse_stock(html_text):
+    """整页解析商品库存状态
+    :param html_text: 商品页面 HTML
+    :return: IN_STOCK / OUT_OF_STOCK / NO_MARKER
+    """
+    html = etree.HTML(html_text)
+    if html is None:
+        return NO_MARKER
+    return _stock_from_tree(html)
+
+
+def parse_item_page(html_text, skuId, url):
+    """一次解析商品页面中下单需要的全部信息
+    :param html_text: 商品页面 HTML
+    :param skuId: 商品id
+    :param url: 商品页面地址
+    :return: ItemPage
+    """
+    page = ItemPage(skuId, url)
+    html = etree.HTML(html_text)
+    if html is None:
+        return page
+
+    # 提取店铺ID
+    shop_info = html.xpath('//div[contains(@class, "shopName")]/div[@class="name"]/a/@data-shopid')
+    if shop_info:
+        page.venderId = shop_info[0]
+
+    # 检查是否是预售、秒杀商品
+    page.isYushou = bool(html.xpath(
+        '//div[contains(@class, "summary-price-wrap")]//span[contains(text(), "预售")]/text()'))
+    page.isMiaosha = bool(html.xpath(
+        '//div[contains(@class, "summary-price-wrap")]//span[contains(text(), "秒杀")]/text()'))
+
+    page.stock = _stock_from_tree(html)
+
+    # 配送地区
+    area = html.xpath("//div[@id='J-deliver']//div[@class='ui-area-text']")
+    if area and area[0].text and area[0].text.strip():
+        page.deliveryArea = area[0].text.strip()
+    return page
+
+
+class ItemPage(object):
+    """
+    商品页面快照
+
+    item.jd.com 商品页面解析一次后的结果，商品信息、库存和预售结算共用。
+    """
+
+    def __init__(self, skuId, url):
+        self.skuId = skuId
+        self.url = url
+        self.venderId = '0'       # 店铺ID，未提取到时为 '0'
+        self.isYushou = False     # 是否预售
+        self.isMiaosha = False    # 是否秒杀
+        self.stock = NO_MARKER    # 库存结论
+        self.deliveryArea = None  # 配送地区文本
+
+    def detail(self):
+        """转换为 Session.itemDetails 使用的商品信息 dict"""
+        detail = dict(venderId=self.venderId)
+        if self.isYushou:
+            detail['yushouUrl'] = self.url
+        if self.isMiaosha:
+            # 获取秒杀时间，实际时间需要从页面上解析，这里只是占位
+            detail['startTime'] = int(time.time()) * 1000
+            detail['endTime'] = int(time.time() + 3600) * 1000  # 默认一小时
+        return detail
+
+
+class ItemPageCache(object):
+    """
+    按 SKU 缓存商品页面快照
+
+    有效期很短，只用于让紧挨着的几次调用（如查到库存后立即进入预售结算）共用一次请求。
+    """
+
+    def __init__(self, ttl=ITEM_PAGE_TTL):
+        self.ttl = ttl
+        self._pages = dict()  # skuId -> (ItemPage, 获取时间)
+        self.hitCount = 0
+        self.missCount = 0
+
+    def get(self, skuId):
+        """获取未过期的快照
+        :return: ItemPage，不存在或已过期时返回 None
+        """
+        cached = self._pages.get(skuId)
+        if cached is not None and time.monotonic() - cached[1] <= self.ttl:
+            self.hitCount += 1
+            return cached[0]
+        self.missCount += 1
+        return None
+
+    def put(self, skuId, page):
+        self._pages[skuId] = (page, time.monotonic())
+
+    def invalidate(self, skuId=None):
+        """使快照失效，skuId 为空时清空全部"""
+        if skuId is None:
+            self._pages.clear()
+        else:
+            self._pages.pop(skuId, None)
+
+
+def page_fingerprint(html_text, markers):
+    """计算页面关键区域的指纹
+    :param html_text: 页面 HTML
+    :param markers: 关键标记，指纹覆盖每个标记出现位置附近的内容
+    :return: 指纹字符串
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for marker in markers:
+        digest.update(marker.encode('utf-8'))
+        start = html_text.find(marker)
+        while start >= 0:
+            begin = max(0, start - FINGERPRINT_LOOKBEHIND)
+            digest.update(html_text[begin:start + FINGERPRINT_WINDOW].encode('utf-8'))
+            start = html_text.find(marker, start + len(marker))
+    return digest.hexdigest()
+
+
+class PageRevalidator(object):
+    """
+    商品页面重新验证
+
+    记录服务端返回的 ETag / Last-Modified，下次请求时带上条件请求头，收到 304 直接
+    复用上次的解析结果；服务端不支持条件请求时，比较页面关键区域的指纹，内容没有
+    变化同样跳过 lxml 解析。不同用途（整页快照、流式库存）使用不同的 key 分别记录。
+    """
+
+    def __init__(self):
+        self._entries = dict()
+        self.notModifiedCount = 0  # 收到 304 的次数
+        self.unchangedCount = 0    # 指纹未变化跳过解析的次数
+
+    def saved(self):
+        """省去页面解析的总次数"""
+        return self.notModifiedCount + self.unchangedCount
+
+    def conditionalHeaders(self, key, headers):
+        """为请求头加上条件请求字段
+        :param key: 记录 key
+        :param headers: 原请求头
+        :return: 新的请求头 dict
+        """
+        entry = self._entries.get(key)
+        if not entry or not (entry['etag'] or entry['lastModified']):
+            return headers
+        headers = dict(headers)
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['lastModified']:
+            headers['If-Modified-Since'] = entry['lastModified']
+        return headers
+
+    def notModified(self, key):
+        """处理 304 响应
+        :return: 上次的解析结果，没有记录时返回 None
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self.notModifiedCount += 1
+        return entry['result']
+
+    def resolve(self, key, respHeaders, html_text, parser, markers):
+        """页面关键区域未变化时复用上次结果，否则调用 parser 解析
+        :param key: 记录 key
+        :param respHeaders: 响应头
+        :param html_text: 页面 HTML
+        :param parser: 解析函数，参数为 html_text
+        :param markers: 计算指纹使用的关键标记
+        :return: 解析结果
+        """
+        fingerprint = page_fingerprint(html_text, markers)
+        entry = self._entries.get(key)
+        if entry is not None and entry['fingerprint'] == fingerprint:
+            self.unchangedCount += 1
+            self.remember(key, respHeaders, entry['result'], fingerprint)
+            return entry['result']
+        result = parser(html_text)
+        self.remember(key, respHeaders, result, fingerprint)
+        return result
+
+    def remember(self, key, respHeaders, result, fingerprint=None):
+        """记录本次响应的验证信息和解析结果"""
+        self._entries[key] = {
+            'etag': respHeaders.get('ETag'),
+            'lastModified': respHeaders.get('Last-Modified'),
+            'fingerprint': fingerprint,
+            'result': result,
+        }
+
+
+class StockProbe(object):
+    """
+    流式库存探测器
+
+    把响应内容分块喂给 lxml 的增量解析器，只关注 store-prompt、activity-message
+    和 InitCartUrl 三个标记。一旦能得出与 parse_stock 相同的结论就不再需要后续内容，
+    调用方可以立即关闭连接。
+    """
+
+    def __init__(self, encoding=None):
+        self._parser = etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+        self._promptText = None  # 第一个 store-prompt 的文本，None 表示还没读到
+        self._positive = False   # 是否已经读到有货标记
+        self.verdict = None
+        self.bytesRead = 0
+
+    def feed(self, chunk):
+        """喂入一块响应内容
+        :param chunk: bytes 或 str
+        :return: 已得出的结论，尚无结论时返回 None
+        """
+        if self.verdict is not None:
+            return self.verdict
+        self.bytesRead += len(chunk)
+        self._parser.feed(chunk)
+        self._readEvents()
+        self._decide(final=False)
+        return self.verdict
+
+    def close(self):
+        """内容读取结束（或提前停止）后获取最终结论
+        :return: IN_STOCK / OUT_OF_STOCK / NO_MARKER
+        """
+        if self.verdict is None:
+            try:
+                self._parser.close()
+            except etree.LxmlError:
+                pass
+            self._readEvents()
+            self._decide(final=True)
+        return self.verdict
+
+    def _readEvents(self):
+        for event, el in self._parser.read_events():
+            tag = el.tag
+            if event == 'start':
+                if tag == 'a' and el.get('id') == 'InitCartUrl':
+                    self._positive = True
+            elif tag == 'div':
+                if self._promptText is None and el.get('class') == 'store-prompt':
+                    # 没有直接文本的 store-prompt 不参与判断，与 xpath 行为一致
+                    self._promptText = _first_text(el)
+            elif tag == 'span' and not self._positive:
+                parent = el.getparent()
+                if parent is not None and parent.tag == 'div' and parent.get('class') == 'activity-message':
+                    text = _first_text(el)
+                    if text and '现货' in text:
+                        self._positive = True
+
+    def _decide(self, final):
+        if self._promptText is not None and '无货' in self._promptText:
+            self.verdict = OUT_OF_STOCK
+        elif self._positive and (final or self._promptText is not None):
+            # 未读到 store-prompt 之前，后面仍可能出现无货提示，不能提前下结论
+            self.verdict = IN_STOCK
+        elif final:
+            self.verdict = NO_MARKER
@@ -1,14 +1,113 @@
 #!/usr/bin/env python
 # -*- encoding=utf8 -*-
+import atexit
+import json
 import logging
 import logging.handlers
 import os
+import queue
+import threading
+import time
 from time import strftime
 
 from config import global_config
 
 # 日志文件路径
 LOG_FILENAME = strftime("logs/jd-buyer_%Y_%m_%d_%H.log")
+# 退出时等待日志写完的最长时间(秒)
+LOG_FLUSH_TIMEOUT = 5
+
+# 重复日志的汇总间隔(秒)
+DEFAULT_DEDUP_INTERVAL = 600
+# 汇总中计算耗时中位数保留的样本数
+DEDUP_LATENCY_SAMPLES = 1000
+
+# 异步日志：日志记录放入队列，由监听线程写控制台和文件
+_listener = None
+_repeat_filter = None
+
+
+class _Repeat(object):
+    """同一主题连续相同的日志"""
+
+    __slots__ = ('message', 'since', 'count', 'latencies')
+
+    def __init__(self, message, since):
+        self.message = message
+        self.since = since  # 上次输出的时间
+        self.count = 0      # 上次输出后被省略的次数
+        self.latencies = []
+
+    def summary(self, now):
+        elapsed = now - self.since
+        period = '{0:.0f}秒'.format(elapsed) if elapsed < 60 else '{0:.0f}分钟'.format(elapsed / 60)
+        text = '{0}内重复{1:,}次'.format(period, self.count)
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            text += '，耗时中位数{0:.0f}ms'.format(latencies[len(latencies) // 2] * 1000)
+        return text
+
+
+class RepeatFilter(logging.Filter):
+    """
+    合并重复日志
+
+    只处理带有主题（extra={'topic': ...}）的日志，按主题记录上一条内容：
+    内容相同时只在第一次和之后每隔 interval 秒输出一次，并附上期间的重复次数和耗时中位数
+    （日志带有 extra={'latency': 秒} 时）；内容变化即状态切换，立即输出并附上之前的重复次数。
+    没有主题的日志和 WARNING 及以上级别的日志总是原样输出。
+    """
+
+    def __init__(self, interval=DEFAULT_DEDUP_INTERVAL):
+        """
+        :param interval: 重复日志的汇总间隔(秒)
+        """
+        super().__init__()
+        self.interval = interval
+        self.suppressedCount = 0
+        self._repeats = dict()  # 主题 -> _Repeat
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        topic = getattr(record, 'topic', None)
+        if topic is None or record.levelno >= logging.WARNING:
+            return True
+        message = record.getMessage()
+        latency = getattr(record, 'latency', None)
+        now = record.created
+        with self._lock:
+            repeat = self._repeats.get(topic)
+            if repeat is not None and repeat.message == message:
+                repeat.count += 1
+                if latency is not None and len(repeat.latencies) < DEDUP_LATENCY_SAMPLES:
+                    repeat.latencies.append(latency)
+                if now - repeat.since < self.interval:
+                    self.suppressedCount += 1
+                    return False
+                summary = repeat.summary(now)
+                self._repeats[topic] = _Repeat(message, now)
+                suffix = '（{0}）'.format(summary)
+            else:
+                self._repeats[topic] = _Repeat(message, now)
+                suffix = ''
+                if repeat is not None and repeat.count:
+                    suffix = '（此前“{0}”{1}）'.format(repeat.message, repeat.summary(now))
+        if suffix:
+            record.msg = message + suffix
+            record.args = None
+        return True
+
+    def pending(self):
+        """尚未输出的重复次数汇总，退出时调用
+        :return: [汇总文本]
+        """
+        now = time.time()
+        with self._lock:
+            lines = ['“{0}”{1}'.format(repeat.message, repeat.summary(now))
+                     for repeat in self._repeats.values() if repeat.count]
+            for repeat in self._repeats.values():
+                repeat.count = 0
+        return lines
 
 def set_logger():
     logger = logging.getLogger()
@@ -32,8 +131,7 @@ def set_logger():
         # 默认INFO级别
         logger.setLevel("INFO")
     
-    # 添加handler
-    logger.addHandler(console)
+    handlers = [console]
 
     # 输出到文件
     try:
@@ -46,10 +144,93 @@ def set_logger():
         file_handler = logging.handlers.TimedRotatingFileHandler(
             LOG_FILENAME, when='midnight', interval=1, backupCount=7)
         file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
+
+    # 合并重复日志，默认开启
+    try:
+        log_dedup = global_config.getboolean('config', 'log_dedup')
+    except:
+        log_dedup = True
+    if log_dedup:
+        try:
+            dedup_interval = float(global_config.get('config', 'log_dedup_interval'))
+        except:
+            dedup_interval = DEFAULT_DEDUP_INTERVAL
+        global _repeat_filter
+        _repeat_filter = RepeatFilter(dedup_interval)
+        logger.addFilter(_repeat_filter)
+
+    # 是否异步写日志，默认开启
+    try:
+        async_log = global_config.getboolean('config', 'async_log')
+    except:
+        async_log = True
+
+    # 添加handler
+    if async_log:
+        # 调用线程只把日志记录放入队列，控制台和文件的写入在监听线程中完成
+        global _listener
+        log_queue = queue.Queue()
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+    atexit.register(stop_logging)
     # 返回
     return logger
 
 
+class LazyJson(object):
+    """
+    延迟序列化的日志参数，只有日志真正输出时才转换为 JSON，如
+    logger.debug("请求头: %s", LazyJson(headers, indent=2))
+    """
+
+    __slots__ = ('obj', 'kwargs')
+
+    def __init__(self, obj, **kwargs):
+        """
+        :param obj: 要输出的对象
+        :param kwargs: json.dumps 的参数
+        """
+        self.obj = obj
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return json.dumps(self.obj, **self.kwargs)
+
+
+def flush_logs(timeout=LOG_FLUSH_TIMEOUT):
+    """等待队列中的日志全部写出，并刷新控制台和文件
+    :param timeout: 最长等待时间(秒)
+    """
+    if _listener is None or _listener._thread is None:
+        return
+    log_queue = _listener.queue
+    with log_queue.all_tasks_done:
+        if log_queue.unfinished_tasks:
+            log_queue.all_tasks_done.wait_for(lambda: not log_queue.unfinished_tasks, timeout)
+    for handler in _listener.handlers:
+        handler.flush()
+
+
+def stop_logging():
+    """输出未汇总的重复日志，写完队列中的日志并停止监听线程，退出时自动调用"""
+    global _listener
+    if _repeat_filter is not None:
+        for line in _repeat_filter.pending():
+            logging.getLogger().info(line)
+    if _listener is None:
+        return
+    flush_logs()
+    if _listener._thread is not None:
+        _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
 # 导出
 logger = set_logger()
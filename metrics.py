@@ -0,0 +1,249 @@
+# -*- coding:utf-8 -*-
+import bisect
+import re
+import threading
+import time
+from collections import deque
+from urllib.parse import urlparse
+
+# 每个接口保留的最近耗时样本数
+DEFAULT_WINDOW_SIZE = 200
+# 自适应超时：按最近耗时的 p99 乘以倍数，样本不足时使用默认超时
+DEFAULT_TIMEOUT_PERCENTILE = 0.99
+DEFAULT_TIMEOUT_MULTIPLIER = 2.0
+DEFAULT_MIN_SAMPLES = 20
+DEFAULT_MIN_TIMEOUT = 1.0
+# 耗时直方图的桶上限(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 没有得出库存结论的查询：请求失败 / 抛出异常
+POLL_FAILED = 'failed'
+POLL_ERROR = 'error'
+
+
+def endpoint_of(url):
+    """把请求地址归一化为接口名：域名 + 路径，路径中的数字（如商品id）替换为 {id}
+    :param url: 请求地址
+    :return: 如 'item.jd.com/{id}.html'
+    """
+    parsed = urlparse(url)
+    return '{0}{1}'.format(parsed.hostname or '', re.sub(r'\d+', '{id}', parsed.path or '/'))
+
+
+class LatencyWindow(object):
+    """
+    最近若干次请求的耗时，线程安全
+    """
+
+    def __init__(self, size=DEFAULT_WINDOW_SIZE):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0  # 累计样本数
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def percentile(self, q):
+        """最近样本的分位数（最近秩法）
+        :param q: 0~1
+        :return: 耗时(秒)，没有样本时返回 None
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(q * len(samples) + 0.5) - 1))
+        return samples[index]
+
+
+class Histogram(object):
+    """
+    耗时直方图，按固定的桶累计次数，线程安全；适合长时间运行的汇总，不保留样本
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: 递增的桶上限(秒)，另有一个 +Inf 桶
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """分位数的估计值：所在桶的上限（+Inf 桶返回最大值）
+        :return: 耗时(秒)，没有样本时返回 None
+        """
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+            return self.max
+
+    def cumulative(self):
+        """各桶的累计次数
+        :return: [(桶上限, 累计次数)]，最后一个桶上限为 float('inf')
+        """
+        with self._lock:
+            counts = list(self.counts)
+        result, total = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class AdaptiveTimeouts(object):
+    """
+    按接口自适应的请求超时
+
+    每个接口记录最近的耗时，超时取 p99 的 multiplier 倍，限制在 [minTimeout, maxTimeout] 内；
+    样本不足时使用默认超时。发生超时时把超时值本身记为一个样本，使超时逐步放宽，
+    不会因为网络整体变慢而持续误判。
+    """
+
+    def __init__(self, default, minTimeout=DEFAULT_MIN_TIMEOUT, maxTimeout=None,
+                 percentile=DEFAULT_TIMEOUT_PERCENTILE, multiplier=DEFAULT_TIMEOUT_MULTIPLIER,
+                 minSamples=DEFAULT_MIN_SAMPLES, enabled=True):
+        """
+        :param default: 默认超时(秒)
+        :param minTimeout: 最短超时(秒)
+        :param maxTimeout: 最长超时(秒)，默认与 default 相同
+        :param percentile: 参考的耗时分位数
+        :param multiplier: 超时相对分位数的倍数
+        :param minSamples: 启用自适应所需的最少样本数
+        :param enabled: 为 False 时只记录耗时，始终使用默认超时
+        """
+        self.default = default
+        self.minTimeout = minTimeout
+        self.maxTimeout = maxTimeout or default
+        self.percentile = percentile
+        self.multiplier = multiplier
+        self.minSamples = minSamples
+        self.enabled = enabled
+        self.windows = dict()
+        self.timeoutCounts = dict()
+        self._lock = threading.Lock()
+
+    def window(self, endpoint):
+        """获取接口的耗时窗口，不存在时创建"""
+        window = self.windows.get(endpoint)
+        if window is None:
+            with self._lock:
+                window = self.windows.setdefault(endpoint, LatencyWindow())
+        return window
+
+    def timeoutFor(self, endpoint):
+        """接口当前的超时(秒)"""
+        window = self.windows.get(endpoint)
+        if not self.enabled or window is None or len(window) < self.minSamples:
+            return self.default
+        timeout = window.percentile(self.percentile) * self.multiplier
+        return min(self.maxTimeout, max(self.minTimeout, timeout))
+
+    def record(self, endpoint, seconds):
+        self.window(endpoint).add(seconds)
+
+    def recordTimeout(self, endpoint, timeout):
+        """记录一次超时，超时值作为样本计入"""
+        with self._lock:
+            self.timeoutCounts[endpoint] = self.timeoutCounts.get(endpoint, 0) + 1
+        self.window(endpoint).add(timeout)
+
+    def onResponse(self, resp, *args, **kwargs):
+        """requests 的 response hook，记录接口耗时"""
+        self.record(endpoint_of(resp.url), resp.elapsed.total_seconds())
+        return resp
+
+    def report(self):
+        """各接口耗时与当前超时的可读文本"""
+        lines = []
+        for endpoint, window in sorted(self.windows.items()):
+            p50, p99 = window.percentile(0.5), window.percentile(0.99)
+            if p50 is None:
+                continue
+            lines.append('{0}: p50 {1:.0f}ms，p99 {2:.0f}ms，超时 {3:.1f}s，已超时{4}次'.format(
+                endpoint, p50 * 1000, p99 * 1000, self.timeoutFor(endpoint), self.timeoutCounts.get(endpoint, 0)))
+        return lines
+
+
+class RequestStats(object):
+    """
+    各接口的请求耗时直方图和响应状态码计数，作为 requests 的 response hook 使用；
+    与 AdaptiveTimeouts 的耗时窗口不同，这里的统计从启动起一直累计
+    """
+
+    def __init__(self):
+        self.histograms = dict()  # 接口 -> Histogram
+        self.statusCounts = dict()  # (接口, 状态码) -> 次数
+        self._lock = threading.Lock()
+
+    def onResponse(self, resp, *args, **kwargs):
+        endpoint = endpoint_of(resp.url)
+        histogram = self.histograms.get(endpoint)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(endpoint, Histogram())
+        histogram.observe(resp.elapsed.total_seconds())
+        key = (endpoint, resp.status_code)
+        with self._lock:
+            self.statusCounts[key] = self.statusCounts.get(key, 0) + 1
+        return resp
+
+    def snapshot(self):
+        """当前统计的副本，遍历时不受其他线程新增接口的影响
+        :return: (直方图 dict, 状态码计数 dict)
+        """
+        with self._lock:
+            return dict(self.histograms), dict(self.statusCounts)
+
+
+class PollStats(object):
+    """
+    库存查询结论计数与最近一次成功查询的时间
+    """
+
+    def __init__(self):
+        self.verdictCounts = dict()  # 结论 -> 次数，含 POLL_FAILED / POLL_ERROR
+        self.lastSuccessAt = None  # 最近一次得出结论的时间戳(秒)
+        self._lock = threading.Lock()
+
+    @property
+    def count(self):
+        return sum(self.snapshot()[0].values())
+
+    def record(self, verdict):
+        """
+        :param verdict: 库存结论，或 POLL_FAILED / POLL_ERROR
+        """
+        with self._lock:
+            self.verdictCounts[verdict] = self.verdictCounts.get(verdict, 0) + 1
+        if verdict not in (POLL_FAILED, POLL_ERROR):
+            self.lastSuccessAt = time.time()
+
+    def snapshot(self):
+        """当前统计的副本
+        :return: (结论计数 dict, 最近一次得出结论的时间戳)
+        """
+        with self._lock:
+            return dict(self.verdictCounts), self.lastSuccessAt
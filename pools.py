@@ -0,0 +1,129 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests.adapters import HTTPAdapter
+
+from log import logger
+
+# 下单相关的域名，各自使用独立的连接池
+POOL_HOSTS = ('item.jd.com', 'api.m.jd.com', 'cart.jd.com', 'trade.jd.com')
+# 同一域名可能同时使用的协议，各自一个连接池
+POOL_SCHEMES = ('https', 'http')
+# 每个域名连接池保留的连接数
+DEFAULT_POOL_MAXSIZE = 4
+# 心跳间隔(秒)，0 为不开启
+DEFAULT_HEARTBEAT_INTERVAL = 0
+
+
+class HostPools(object):
+    """
+    按域名划分的连接池
+
+    为每个下单相关域名挂载独立的 HTTPAdapter，连接池大小可配置，互不挤占；
+    通过 urllib3 连接池的计数统计新建连接与复用连接的次数。
+    """
+
+    def __init__(self, hosts=POOL_HOSTS, poolMaxsize=DEFAULT_POOL_MAXSIZE):
+        """
+        :param hosts: 域名列表
+        :param poolMaxsize: 每个域名连接池保留的连接数
+        """
+        self.hosts = tuple(hosts)
+        self.poolMaxsize = max(1, int(poolMaxsize))
+        self.lastUsed = dict()  # 域名 -> 最近一次收到响应的单调时间
+        self._adapters = dict()
+
+    def mount(self, sess):
+        """在 requests 会话上挂载各域名的连接池，并记录各域名的最近使用时间"""
+        self._adapters = dict()
+        for host in self.hosts:
+            # 重试由 Session.request 统一处理；http 和 https 各占一个连接池（如结算页走 http、提交订单走 https），
+            # pool_connections 不足时 urllib3 会在两者切换时关闭另一个连接池
+            adapter = HTTPAdapter(pool_connections=len(POOL_SCHEMES), pool_maxsize=self.poolMaxsize, max_retries=0)
+            self._adapters[host] = adapter
+            for scheme in POOL_SCHEMES:
+                sess.mount('{0}://{1}/'.format(scheme, host), adapter)
+        sess.hooks['response'].append(self.onResponse)
+        return sess
+
+    def onResponse(self, resp, *args, **kwargs):
+        host = urlparse(resp.url).hostname
+        if host in self._adapters:
+            self.lastUsed[host] = time.monotonic()
+        return resp
+
+    def idleHosts(self, idle):
+        """空闲超过 idle 秒（或从未使用）的域名"""
+        now = time.monotonic()
+        return [host for host in self.hosts if now - self.lastUsed.get(host, float('-inf')) >= idle]
+
+    def stats(self):
+        """各域名的连接复用统计
+        :return: {域名: {'requests': 请求数, 'connections': 新建连接数, 'reused': 复用次数}}
+        """
+        result = dict()
+        for host, adapter in self._adapters.items():
+            requests = connections = 0
+            for key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(key)
+                if pool is None:
+                    continue
+                requests += pool.num_requests
+                connections += pool.num_connections
+            result[host] = {'requests': requests, 'connections': connections,
+                            'reused': max(0, requests - connections)}
+        return result
+
+    def report(self):
+        """连接复用统计的可读文本"""
+        parts = []
+        for host, s in self.stats().items():
+            if s['requests']:
+                parts.append('{0} 请求{1}次/新建连接{2}次/复用率{3:.0%}'.format(
+                    host, s['requests'], s['connections'], s['reused'] / s['requests']))
+        return '，'.join(parts) or '暂无请求'
+
+
+class Heartbeat(object):
+    """
+    连接保活心跳
+
+    后台线程定期检查各域名，空闲超过 interval 秒时发一次 HEAD 请求，让连接池里的
+    连接保持可用，避免安静一段时间后的第一次请求重新做 DNS、TCP 和 TLS 握手。
+    """
+
+    def __init__(self, session, interval):
+        """
+        :param session: JdSession.Session
+        :param interval: 心跳间隔(秒)
+        """
+        self.session = session
+        self.interval = interval
+        self.beatCount = 0
+        self._stopEvent = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name='heartbeat', daemon=True)
+        self._thread.start()
+        logger.info('连接保活心跳已开启，间隔{0:g}s'.format(self.interval))
+
+    def stop(self):
+        self._stopEvent.set()
+
+    def _run(self):
+        while not self._stopEvent.wait(self.interval / 2):
+            pools = self.session.hostPools
+            for host in pools.idleHosts(self.interval):
+                try:
+                    # 直接使用底层会话，心跳失败不需要重试
+                    self.session.sess.head('https://{0}/'.format(host), headers={'User-Agent': self.session.userAgent},
+                                           timeout=self.session.timeout, allow_redirects=False)
+                    self.beatCount += 1
+                except Exception as e:
+                    logger.debug('心跳请求 {0} 失败: {1}'.format(host, e))
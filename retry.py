@@ -0,0 +1,230 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import random
+import threading
+import time
+
+import requests
+
+from log import logger
+
+# 错误类别
+OK = 'ok'                          # 成功
+TIMEOUT = 'timeout'                # 请求超时
+CONNECTION = 'connection'          # 连接失败
+SERVER_ERROR = 'server_error'      # 5xx
+FORBIDDEN = 'forbidden'            # 403 且响应内容无效（风控拦截）
+LOGIN_REDIRECT = 'login_redirect'  # 被重定向到登录页，重试无意义
+CLIENT_ERROR = 'client_error'      # 其他 4xx，重试无意义
+FAILED = 'failed'                  # 业务失败（如下单返回失败）
+
+# 登录页地址特征
+LOGIN_MARKERS = ('passport.jd.com', 'plogin.m.jd.com', '/new/login.aspx')
+
+
+class Backoff(object):
+    """
+    退避策略：第 n 次重试等待 base * factor^(n-1) 秒，不超过 cap；
+    再按 jitter 随机缩短，避免多个请求同时重试
+    """
+
+    def __init__(self, base, factor=2.0, cap=None, jitter=0.5):
+        """
+        :param base: 首次重试等待时间(秒)
+        :param factor: 每次重试的放大倍数
+        :param cap: 最长等待时间(秒)
+        :param jitter: 随机缩短的最大比例，0.5 表示在 [delay/2, delay] 之间取值
+        """
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+
+    def delay(self, attempt, rng=random):
+        """
+        :param attempt: 已失败的次数，从 1 开始
+        :return: 等待时间(秒)
+        """
+        delay = self.base * self.factor ** (attempt - 1)
+        if self.cap is not None:
+            delay = min(delay, self.cap)
+        return delay * (1 - self.jitter * rng.random())
+
+
+# 各错误类别的默认退避策略，不在其中的类别不重试
+DEFAULT_BACKOFF = {
+    TIMEOUT: Backoff(0.2, 2.0, 2.0),
+    CONNECTION: Backoff(0.2, 2.0, 2.0),
+    SERVER_ERROR: Backoff(0.5, 2.0, 4.0),
+    FORBIDDEN: Backoff(1.0, 2.0, 8.0),
+}
+
+
+def _is_login_url(url):
+    return bool(url) and any(marker in url for marker in LOGIN_MARKERS)
+
+
+def classify(resp=None, exc=None):
+    """按 Session.respStatus 的判断规则对请求结果分类
+    :param resp: 响应对象
+    :param exc: 请求抛出的异常
+    :return: 错误类别
+    """
+    if exc is not None:
+        if isinstance(exc, requests.exceptions.Timeout):
+            return TIMEOUT
+        if isinstance(exc, requests.exceptions.ConnectionError):
+            return CONNECTION
+        return FAILED
+    if resp is None:
+        return FAILED
+    status = resp.status_code
+    if status in (301, 302, 303, 307, 308):
+        return LOGIN_REDIRECT if _is_login_url(resp.headers.get('Location')) else OK
+    if _is_login_url(resp.url):
+        return LOGIN_REDIRECT
+    if status >= 500:
+        return SERVER_ERROR
+    if status == 403:
+        # 京东有时返回 403 但响应内容仍然有效
+        try:
+            text = resp.text
+        except Exception:
+            text = ''
+        if '{"success":' in text or '"resultData"' in text:
+            return OK
+        return FORBIDDEN
+    if status >= 400:
+        return CLIENT_ERROR
+    return OK
+
+
+class Deadline(object):
+    """
+    整个流程的截止时间，基于单调时钟
+    """
+
+    def __init__(self, seconds=None, clock=time.monotonic):
+        """
+        :param seconds: 从现在起的预算(秒)，None 表示不限制
+        """
+        self._clock = clock
+        self.expiresAt = None if seconds is None else clock() + seconds
+
+    def remaining(self):
+        """剩余时间(秒)，不限制时返回 None"""
+        if self.expiresAt is None:
+            return None
+        return self.expiresAt - self._clock()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def allows(self, delay):
+        """等待 delay 秒后是否仍在截止时间之前"""
+        remaining = self.remaining()
+        return remaining is None or remaining > delay
+
+
+class RetryPolicy(object):
+    """
+    统一的重试策略
+
+    每次调用的结果先分类，可重试的类别按各自的退避策略等待后重试，其他类别立即返回；
+    给定截止时间时，等待后会超过截止时间就不再重试。
+    """
+
+    def __init__(self, attempts=3, backoff=None, rng=random):
+        """
+        :param attempts: 最多尝试次数（含第一次）
+        :param backoff: {错误类别: Backoff}，默认为 DEFAULT_BACKOFF
+        :param rng: 随机数来源
+        """
+        self.attempts = max(1, int(attempts))
+        self.backoff = DEFAULT_BACKOFF if backoff is None else backoff
+        self._rng = rng
+        self.retryCount = 0
+        self.failureCounts = dict()  # 错误类别 -> 失败次数（含最后一次不再重试的失败）
+        self._lock = threading.Lock()
+
+    def run(self, func, deadline=None, classifier=classify, name='', cancel=None):
+        """调用 func，失败时按策略重试
+        :param func: 无参数的调用，返回响应或结果
+        :param deadline: Deadline，None 表示不限制
+        :param classifier: 结果分类函数，参数为 (结果, 异常)
+        :param name: 日志中的调用名称
+        :param cancel: threading.Event，被置位后不再重试，退避等待中被置位时立即返回
+        :return: 最后一次调用的结果；最后一次调用抛出异常时重新抛出
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            result, error = None, None
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+            category = classifier(result, error)
+            if category == OK:
+                return result
+            if cancel is not None and cancel.is_set():
+                break
+            delay = self._retryDelay(category, attempt, deadline, name)
+            if delay is None:
+                break
+            if cancel is None:
+                time.sleep(delay)
+            elif cancel.wait(delay):
+                break
+
+        if error is not None:
+            raise error
+        return result
+
+    async def runAsync(self, func, deadline=None, classifier=classify, name=''):
+        """run 的协程版本，func 返回 awaitable，等待期间不阻塞事件循环"""
+        attempt = 0
+        while True:
+            attempt += 1
+            result, error = None, None
+            try:
+                result = await func()
+            except Exception as e:
+                error = e
+            category = classifier(result, error)
+            if category == OK:
+                return result
+            delay = self._retryDelay(category, attempt, deadline, name)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+        if error is not None:
+            raise error
+        return result
+
+    def _retryDelay(self, category, attempt, deadline, name):
+        """计算第 attempt 次失败后的等待时间
+        :return: 等待时间(秒)，不再重试时返回 None
+        """
+        with self._lock:
+            self.failureCounts[category] = self.failureCounts.get(category, 0) + 1
+        backoff = self.backoff.get(category)
+        if backoff is None or attempt >= self.attempts:
+            return None
+        delay = backoff.delay(attempt, self._rng)
+        if deadline is not None and not deadline.allows(delay):
+            logger.warning('{0} 失败({1})，剩余时间不足，不再重试'.format(name, category))
+            return None
+        logger.warning('{0} 失败({1})，{2:.2f}s后第{3}次重试'.format(name, category, delay, attempt))
+        with self._lock:
+            self.retryCount += 1
+        return delay
+
+    def snapshot(self):
+        """重试统计的副本，遍历时不受其他线程新增错误类别的影响
+        :return: (重试次数, 失败次数 dict)
+        """
+        with self._lock:
+            return self.retryCount, dict(self.failureCounts)
@@ -0,0 +1,188 @@
+# -*- coding:utf-8 -*-
+import time
+from datetime import datetime
+
+# 结果连续不变多少次后放大一次查询间隔
+DEFAULT_BACKOFF_AFTER = 20
+# 每次放大的倍数
+DEFAULT_BACKOFF_FACTOR = 1.5
+# 进入时间窗口前多少秒开始缩短间隔
+DEFAULT_WINDOW_LEAD = 60
+# 一天的秒数
+SECONDS_PER_DAY = 24 * 3600
+
+
+def _seconds_of_day(value):
+    hour, minute = value.strip().split(':')[:2]
+    return int(hour) * 3600 + int(minute) * 60
+
+
+def parse_windows(windows):
+    """解析每日时间窗口字符串
+    :param windows: 如 '09:59-10:05,19:59-20:05'，允许跨零点
+    :return: [(开始秒数, 结束秒数)]
+    :raises ValueError: 格式错误
+    """
+    result = []
+    for item in filter(bool, map(lambda x: x.strip(), (windows or '').split(','))):
+        start, end = item.split('-')
+        result.append((_seconds_of_day(start), _seconds_of_day(end)))
+    return result
+
+
+def _in_range(value, start, end):
+    if start <= end:
+        return start <= value <= end
+    return value >= start or value <= end
+
+
+class PollScheduler(object):
+    """
+    库存查询调度器
+
+    以单调时钟为基准，按开始到开始的固定节拍触发查询，请求耗时不会累加到间隔上；
+    某次查询耗时超过间隔时直接跳过错过的节拍，不会连续补发。
+
+    间隔可以自适应：在配置的每日时间窗口附近缩短到 minInterval，查询结果连续
+    backoffAfter 次不变时按 backoffFactor 逐步放大，最大到 maxInterval，结果一旦
+    变化立即恢复。
+    """
+
+    def __init__(self, interval, minInterval=None, maxInterval=None, windows=None,
+                 windowLead=DEFAULT_WINDOW_LEAD, backoffAfter=DEFAULT_BACKOFF_AFTER,
+                 backoffFactor=DEFAULT_BACKOFF_FACTOR, clock=time.monotonic):
+        """
+        :param interval: 基础查询间隔(秒)
+        :param minInterval: 时间窗口内的查询间隔，默认与 interval 相同
+        :param maxInterval: 放大后的最大间隔，默认与 interval 相同（即不放大）
+        :param windows: 每日时间窗口，格式见 parse_windows
+        :param windowLead: 进入时间窗口前多少秒开始缩短间隔
+        :param backoffAfter: 结果连续不变多少次后放大一次间隔
+        :param backoffFactor: 每次放大的倍数
+        :param clock: 单调时钟
+        """
+        self.interval = float(interval)
+        self.minInterval = float(minInterval) if minInterval else self.interval
+        self.maxInterval = float(maxInterval) if maxInterval else self.interval
+        self.windows = parse_windows(windows) if isinstance(windows, str) else list(windows or [])
+        self.windowLead = windowLead
+        self.backoffAfter = backoffAfter
+        self.backoffFactor = backoffFactor
+        self._clock = clock
+
+        self._next = None          # 下一个节拍的时间点
+        self._target = None        # 下一个节拍对应的目标间隔
+        self._lastFired = None
+        self._lastResult = None
+        self._sameCount = 0
+
+        # 统计
+        self.fired = 0
+        self.skipped = 0
+        self._targetSum = 0.0
+        self._achievedSum = 0.0
+        self._periods = 0
+        self._latenessSum = 0.0
+        self.maxLateness = 0.0
+
+    @classmethod
+    def fromConfig(cls, interval):
+        """按 config.ini [item] 中的自适应配置创建调度器，无效的配置项记录警告并使用默认值
+        :param interval: 基础查询间隔(秒)
+        """
+        from JdSession import _option
+
+        return cls(interval,
+                   minInterval=_option('min_stock_interval', None, float, section='item'),
+                   maxInterval=_option('max_stock_interval', None, float, section='item'),
+                   windows=_option('hot_windows', None, parse_windows, section='item'),
+                   backoffAfter=_option('backoff_after', DEFAULT_BACKOFF_AFTER, int, section='item'))
+
+    def currentInterval(self):
+        """根据时间窗口和结果变化情况计算当前的查询间隔(秒)"""
+        if self.windows and self._nearWindow():
+            return self.minInterval
+        interval = self.interval
+        if self.backoffAfter and self.maxInterval > self.interval:
+            for _ in range(self._sameCount // self.backoffAfter):
+                interval *= self.backoffFactor
+                if interval >= self.maxInterval:
+                    return self.maxInterval
+        return interval
+
+    def _nearWindow(self):
+        now = datetime.now()
+        seconds = now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1e6
+        for start, end in self.windows:
+            if _in_range(seconds, (start - self.windowLead) % SECONDS_PER_DAY, end):
+                return True
+        return False
+
+    def record(self, result):
+        """记录本次查询结果，结果连续不变时间隔逐步放大"""
+        if result == self._lastResult:
+            self._sameCount += 1
+        else:
+            self._lastResult = result
+            self._sameCount = 0
+
+    def nextDelay(self):
+        """把节拍推进到下一次，并返回需要等待的时间(秒)
+        首次调用立即返回 0；错过的节拍直接跳过。
+        """
+        now = self._clock()
+        if self._next is None:
+            self._next = now
+            self._target = None
+            return 0
+        interval = self.currentInterval()
+        self._next += interval
+        self._target = interval
+        if self._next < now:
+            missed = int((now - self._next) // interval) + 1
+            self.skipped += missed
+            self._next += missed * interval
+            self._target += missed * interval
+        return self._next - now
+
+    def markFired(self):
+        """在查询真正开始时调用，用于统计实际节拍"""
+        now = self._clock()
+        lateness = max(0.0, now - self._next)
+        self.fired += 1
+        self._latenessSum += lateness
+        self.maxLateness = max(self.maxLateness, lateness)
+        if self._lastFired is not None and self._target is not None:
+            self._periods += 1
+            self._achievedSum += now - self._lastFired
+            self._targetSum += self._target
+        self._lastFired = now
+
+    def wait(self):
+        """阻塞等待下一个节拍"""
+        delay = self.nextDelay()
+        if delay > 0:
+            time.sleep(delay)
+        self.markFired()
+
+    def stats(self):
+        """实际节拍与目标节拍的统计
+        :return: dict，间隔与延迟单位为秒
+        """
+        periods = self._periods or 1
+        return {
+            'fired': self.fired,
+            'skipped': self.skipped,
+            'targetInterval': self._targetSum / periods if self._periods else self.currentInterval(),
+            'achievedInterval': self._achievedSum / periods if self._periods else 0.0,
+            'meanLateness': self._latenessSum / self.fired if self.fired else 0.0,
+            'maxLateness': self.maxLateness,
+            'currentInterval': self.currentInterval(),
+        }
+
+    def report(self):
+        """统计信息的可读文本"""
+        s = self.stats()
+        return '触发{0}次，跳过{1}个节拍，目标间隔{2:.3f}s，实际间隔{3:.3f}s，平均延迟{4:.1f}ms，最大延迟{5:.1f}ms，当前间隔{6:.3f}s'.format(
+            s['fired'], s['skipped'], s['targetInterval'], s['achievedInterval'],
+            s['meanLateness'] * 1000, s['maxLateness'] * 1000, s['currentInterval'])
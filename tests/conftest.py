@@ -0,0 +1,88 @@
+# -*- coding:utf-8 -*-
+import os
+import shutil
+import ssl
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# 各模块导入时读取当前目录下的 config.ini 并写 logs/，在临时目录中使用默认配置运行
+_workdir = tempfile.mkdtemp(prefix='jdbuyer-tests-')
+shutil.copy(os.path.join(ROOT, 'config.default..ini'), os.path.join(_workdir, 'config.ini'))
+os.chdir(_workdir)
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _workspace():
+    yield
+    # 在 pytest 关闭捕获的输出流之前停止日志监听线程
+    import log
+    log.stop_logging()
+    os.chdir(ROOT)
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        body = b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve(tls=False):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.daemon_threads = True
+    if tls:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(os.path.join(FIXTURES, 'localhost.crt'), os.path.join(FIXTURES, 'localhost.key'))
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def http_server():
+    server = _serve()
+    yield 'http://localhost:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def tls_cert():
+    """https_server 使用的自签名证书，可作为 verify 参数"""
+    return os.path.join(FIXTURES, 'localhost.crt')
+
+
+@pytest.fixture
+def https_server():
+    server = _serve(tls=True)
+    yield 'https://localhost:{0}'.format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def session():
+    """使用录制传输层的 Session，不访问网络"""
+    import JdSession
+    from transport import RecordingTransport
+    # 调试页面、cookies 等写到临时目录
+    JdSession.absPath = _workdir
+    sess = JdSession.Session()
+    sess.transport = RecordingTransport()
+    return sess
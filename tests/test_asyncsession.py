@@ -0,0 +1,52 @@
+# -*- coding:utf-8 -*-
+import asyncio
+
+import pytest
+
+from metrics import endpoint_of
+from retry import OK, classify
+
+httpx = pytest.importorskip('httpx')
+
+
+def test_streamed_403_is_read_before_classifying(session):
+    # 京东的 403 有时仍然有效，异步流式响应也要能读取内容再分类
+    from transport import AsyncHttpxTransport
+
+    class AsyncBody(httpx.AsyncByteStream):
+        """只能异步读取的响应内容，与真实网络响应一样"""
+
+        async def __aiter__(self):
+            yield b'{"success": true}'
+
+    def handler(request):
+        return httpx.Response(403, stream=AsyncBody())
+
+    async def fetch():
+        transport = AsyncHttpxTransport(session)
+        transport._client = httpx.AsyncClient(transport=httpx.MockTransport(handler), cookies=session.sess.cookies)
+        transport._cookies = session.sess.cookies
+        try:
+            resp = await transport.request('GET', 'https://item.jd.com/1.html', stream=True)
+            return classify(resp, None), session.respStatus(resp)
+        finally:
+            await transport.aclose()
+
+    assert asyncio.run(fetch()) == (OK, True)
+
+
+def test_async_requests_are_traced_and_timed(session, http_server):
+    from asyncsession import AsyncSession
+    url = http_server + '/'
+    endpoint = endpoint_of(url)
+
+    async def fetch():
+        async with AsyncSession(session) as asyncSession:
+            # 同一线程上并发的请求各自测量
+            return await asyncio.gather(asyncSession.request('GET', url), asyncSession.request('GET', url))
+
+    with session.tracer.trace('poll') as trace:
+        assert [resp.status_code for resp in asyncio.run(fetch())] == [200, 200]
+    assert [span.name for span in trace.spans].count('GET ' + endpoint) == 2
+    assert session.httpTimings.requestCounts[endpoint] == 2
+    assert session.httpTimings.newConnectionCounts[endpoint] >= 1
@@ -0,0 +1,57 @@
+# -*- coding:utf-8 -*-
+from JdBuyer import Buyer, start_buy
+
+PAST = '2022-08-06 00:00:00'
+
+
+def test_past_buy_time_with_warmup_polls_stock_before_ordering(session, monkeypatch):
+    buyer = Buyer()
+    buyer.session = session
+    buyer.enableWx = False
+    calls = []
+    monkeypatch.setattr(session, 'fetchItemDetail', lambda skuId: None)
+    monkeypatch.setattr(session, 'startHeartbeat', lambda: None)
+    monkeypatch.setattr(session, 'prewarm', lambda *args: calls.append('prewarm') or True)
+    monkeypatch.setattr(session, 'getItemStock', lambda *args: calls.append('stock') or True)
+    monkeypatch.setattr(session, 'trySubmitOrder', lambda *args: calls.append('submit') or True)
+
+    buyer.buyItemInStock('100012043978', '1_2901_55554_0', stockInterval=0.01, buyTime=PAST, warmup=5)
+    assert calls == ['stock', 'submit']
+
+
+def test_bad_warmup_falls_back_with_warning(monkeypatch, caplog):
+    from config import global_config
+    monkeypatch.setitem(global_config._config['item'], 'warmup', 'abc')
+    buyer = Buyer.__new__(Buyer)
+    calls = []
+    monkeypatch.setattr(buyer, 'buyItemInStock', lambda *args: calls.append(args), raising=False)
+
+    start_buy(buyer, '100012043978', '1_2901_55554_0', 1, 1, 3, 5, PAST)
+    assert calls[0][-1] == 0
+    assert any('warmup' in record.getMessage() for record in caplog.records if record.levelname == 'WARNING')
+
+
+def test_bad_watch_concurrency_falls_back_with_warning(monkeypatch, caplog):
+    from config import global_config
+    from watchlist import DEFAULT_WATCH_CONCURRENCY
+    monkeypatch.setitem(global_config._config['item'], 'watch_concurrency', 'four')
+    buyer = Buyer.__new__(Buyer)
+    calls = []
+    monkeypatch.setattr(buyer, 'buyItemsInStock', lambda *args: calls.append(args), raising=False)
+
+    start_buy(buyer, '100012043978,100015253061', '1_2901_55554_0', 1, 1, 3, 5, PAST)
+    assert calls[0][-2] == DEFAULT_WATCH_CONCURRENCY
+    assert any('watch_concurrency' in record.getMessage() for record in caplog.records
+               if record.levelname == 'WARNING')
+
+
+def test_bad_metrics_port_is_ignored_with_warning(monkeypatch, caplog):
+    from config import global_config
+    monkeypatch.setitem(global_config._config['config'], 'metrics_port', '90a0')
+    buyer = Buyer.__new__(Buyer)
+    calls = []
+    monkeypatch.setattr(buyer, 'buyItemInStock', lambda *args: calls.append(args), raising=False)
+
+    start_buy(buyer, '100012043978', '1_2901_55554_0', 1, 1, 3, 5, PAST)
+    assert len(calls) == 1
+    assert any('metrics_port' in record.getMessage() for record in caplog.records if record.levelname == 'WARNING')
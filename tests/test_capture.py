@@ -0,0 +1,148 @@
+# -*- coding:utf-8 -*-
+import os
+import threading
+import time
+
+from capture import BlobStore, DebugWriter, FileStore, CAPTURE_ANOMALIES, CAPTURE_CHANGES, STORE_FILES
+
+
+def _pages(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.html'))
+
+
+def _entry(store, prefix, content):
+    return dict(time=time.time(), prefix=prefix, skuId=None, state=None, target=store.target(prefix), content=content)
+
+
+def test_full_queue_drops_without_blocking(tmp_path):
+    writer = DebugWriter(str(tmp_path), queueSize=1, store=STORE_FILES)
+    started, release = threading.Event(), threading.Event()
+    write = writer.store.write
+
+    def slowWrite(entry):
+        started.set()
+        release.wait(5)
+        return write(entry)
+
+    writer.store.write = slowWrite
+    try:
+        assert writer.save('a', 'item_1') is not None
+        assert started.wait(5)
+        # 后台线程卡在第一个页面上：第二个页面排队，第三个页面队列已满直接丢弃
+        assert writer.save('b', 'item_2') is not None
+        start = time.monotonic()
+        assert writer.save('c', 'item_3') is None
+        assert time.monotonic() - start < 1
+        assert writer.droppedCount == 1
+    finally:
+        release.set()
+    writer.flush(5)
+    assert writer.savedCount == 2
+    assert len(_pages(str(tmp_path))) == 2
+
+
+def test_changes_mode_saves_state_changes_and_anomalies(tmp_path):
+    writer = DebugWriter(str(tmp_path), mode=CAPTURE_CHANGES, store=STORE_FILES)
+    assert writer.save('page', 'stock', state='out_of_stock') is not None
+    assert writer.save('page', 'stock', state='out_of_stock') is None
+    assert writer.save('page', 'stock', state='in_stock') is not None
+    # 没有状态时比较内容
+    assert writer.save('same', 'detail') is not None
+    assert writer.save('same', 'detail') is None
+    assert writer.save('changed', 'detail') is not None
+    assert writer.save('changed', 'detail', anomaly=True) is not None
+    writer.flush(5)
+    assert writer.savedCount == 5
+    assert writer.skippedCount == 2
+
+
+def test_anomalies_mode_saves_only_anomalies(tmp_path):
+    writer = DebugWriter(str(tmp_path), mode=CAPTURE_ANOMALIES, store=STORE_FILES)
+    assert writer.save('page', 'stock', state='out_of_stock') is None
+    assert writer.save('page', 'stock', state='in_stock') is None
+    assert writer.save('error', 'stock', anomaly=True) is not None
+    writer.flush(5)
+    assert writer.savedCount == 1
+
+
+def test_file_store_keeps_latest_per_prefix(tmp_path):
+    store = FileStore(str(tmp_path), keep=2)
+    entries = [_entry(store, 'stock', content) for content in ('1', '2', '3', '4')]
+    for entry in entries:
+        store.write(entry)
+    store.write(_entry(store, 'cart', 'cart'))
+    # 每个前缀只保留最新的两个
+    assert [os.path.exists(entry['target']) for entry in entries] == [False, False, True, True]
+    assert len(_pages(str(tmp_path))) == 3
+
+
+def test_file_store_prunes_oldest_over_size_cap(tmp_path):
+    store = FileStore(str(tmp_path), keep=10, maxBytes=250)
+    entries = [_entry(store, 'prefix{0}'.format(i), 'x' * 100) for i in range(4)]
+    for entry in entries:
+        store.write(entry)
+    # 每个页面 100 字节，上限 250 字节时只保留最新的两个
+    assert store.totalBytes == 200
+    assert [os.path.exists(entry['target']) for entry in entries] == [False, False, True, True]
+
+    # 重新启动时把目录中已有的页面计入总大小，超出上限时同样清理
+    restarted = FileStore(str(tmp_path), maxBytes=150)
+    restarted.scan()
+    assert restarted.totalBytes == 100
+    assert _pages(str(tmp_path)) == [os.path.basename(entries[3]['target'])]
+
+
+def _blob_entry(prefix, content, skuId=None, state=None):
+    return dict(time=time.time(), prefix=prefix, skuId=skuId, state=state, target=None, content=content)
+
+
+def _disk_bytes(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def test_blob_store_dedups_content_and_keeps_history(tmp_path):
+    store = BlobStore(str(tmp_path))
+    assert store.write(_blob_entry('item_stock', 'page', skuId='1', state='out_of_stock')) is True
+    assert store.write(_blob_entry('item_stock', 'page', skuId='1', state='out_of_stock')) is False
+    assert store.write(_blob_entry('item_stock', 'new page', skuId='2', state='in_stock')) is True
+    assert store.write(_blob_entry('cart', 'cart', skuId='1')) is True
+    # 相同内容只保存一份，但每次保存都有一行索引
+    assert (store.blobCount, store.dedupCount) == (3, 1)
+    rows = store.history(prefix='item_stock')
+    assert len(rows) == 3
+    assert rows[0]['hash'] == rows[1]['hash']
+    assert [row['state'] for row in store.history(skuId=1)] == ['out_of_stock', 'out_of_stock', '']
+    assert store.load(rows[2]['hash']) == 'new page'
+    assert store.load('0' * 40) is None
+
+
+def test_blob_store_index_counts_toward_cap(tmp_path):
+    store = BlobStore(str(tmp_path), maxBytes=2000)
+    for i in range(200):
+        # 重复内容只增加索引，索引也受总大小限制
+        store.write(_blob_entry('item_stock', 'page {0}'.format(i % 3), skuId=str(i)))
+    assert store.totalBytes <= 2000
+    assert store.totalBytes == _disk_bytes(str(tmp_path))
+    # 清理后索引中的每一行都能读到内容，保留的是最新的记录
+    rows = store.history()
+    assert rows[-1]['sku'] == '199'
+    assert all(store.load(row['hash']) is not None for row in rows)
+
+
+def test_blob_store_scan_restores_consistent_state(tmp_path):
+    store = BlobStore(str(tmp_path))
+    store.write(_blob_entry('a', 'first'))
+    store.write(_blob_entry('b', 'second'))
+    rows = store.history()
+    # 内容文件丢失的索引行、没有索引行引用的内容都会被清理
+    os.remove(store.blobPath(rows[0]['hash']))
+    orphan = store.blobPath('f' * 40)
+    os.makedirs(os.path.dirname(orphan))
+    with open(orphan, 'wb') as f:
+        f.write(b'orphan')
+
+    restarted = BlobStore(str(tmp_path))
+    restarted.scan()
+    assert [row['prefix'] for row in restarted.history()] == ['b']
+    assert not os.path.exists(orphan)
+    assert restarted.totalBytes == _disk_bytes(str(tmp_path))
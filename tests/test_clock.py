@@ -0,0 +1,58 @@
+# -*- coding:utf-8 -*-
+import random
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from clock import ClockOffsetEstimator
+
+# 服务器时间比本机快 3.37 秒
+SKEW = 3.37
+
+
+def test_estimate_converges_on_skewed_clock():
+    rand = random.Random(7)
+    clock = ClockOffsetEstimator()
+    now = 1700000000.3
+    for _ in range(80):
+        rtt = rand.uniform(0.02, 0.06)
+        # 服务器在往返中的某个时刻生成 Date，只精确到秒
+        served = now + rand.uniform(0, rtt) + SKEW
+        assert clock.addSample(formatdate(int(served), usegmt=True), now, now + rtt)
+        now += rtt + rand.uniform(0.05, 0.3)
+    offset, error = clock.estimate()
+    assert abs(offset - SKEW) <= error
+    assert error < 0.1
+
+
+def test_session_samples_skewed_server_date(session):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def date_time_string(self, timestamp=None):
+            return formatdate(time.time() + SKEW, usegmt=True)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'ok')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        # 请求跨越至少一个秒边界，偏差区间才能收窄到秒以下
+        for _ in range(30):
+            session.sess.get('http://127.0.0.1:{0}/'.format(server.server_address[1]))
+            time.sleep(0.05)
+    finally:
+        server.shutdown()
+        server.server_close()
+    offset, error = session.serverClock.estimate()
+    assert abs(offset - SKEW) <= error
+    assert error < 0.2
@@ -0,0 +1,49 @@
+# -*- coding:utf-8 -*-
+import threading
+import types
+from datetime import timedelta
+
+import exporter
+from metrics import PollStats, RequestStats
+from retry import RetryPolicy
+
+
+def _response(endpoint, status=200):
+    return types.SimpleNamespace(url='https://{0}/'.format(endpoint), status_code=status,
+                                 elapsed=timedelta(milliseconds=20))
+
+
+def test_snapshots_are_copies():
+    polls, stats, policy = PollStats(), RequestStats(), RetryPolicy()
+    polls.record('in_stock')
+    stats.onResponse(_response('item.jd.com'))
+    policy._retryDelay('timeout', 1, None, 'test')
+    verdicts, _ = polls.snapshot()
+    histograms, statusCounts = stats.snapshot()
+    retries, failures = policy.snapshot()
+
+    polls.record('out_of_stock')
+    stats.onResponse(_response('cart.jd.com', 500))
+    policy._retryDelay('connection', 1, None, 'test')
+    assert verdicts == {'in_stock': 1}
+    assert len(histograms) == 1 and list(statusCounts.values()) == [1]
+    assert (retries, failures) == (1, {'timeout': 1})
+
+
+def test_render_while_stats_grow(session):
+    def grow(prefix):
+        # 不断出现新的接口、结论和错误类别，字典在抓取期间持续扩容
+        for i in range(300):
+            key = '{0}{1}'.format(prefix, i)
+            session.pollStats.record('verdict_' + key)
+            session.requestStats.onResponse(_response('host{0}.jd.com'.format(key), 200 + i % 300))
+            session.retryPolicy._retryDelay('category_' + key, session.retryPolicy.attempts, None, 'test')
+
+    threads = [threading.Thread(target=grow, args=(prefix,)) for prefix in 'ab']
+    for thread in threads:
+        thread.start()
+    for _ in range(30):
+        assert exporter.render(session).endswith('# EOF\n')
+    for thread in threads:
+        thread.join()
+    assert session.pollStats.count == 600
@@ -0,0 +1,109 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+
+from events import _current, annotate
+from hedge import Hedger
+from tracing import Tracer
+
+ENDPOINT = 'item.jd.com'
+
+
+def _hedger(delay):
+    """耗时分位数为 delay 秒、已可以对冲的 Hedger"""
+    hedger = Hedger(minSamples=1)
+    hedger._window(ENDPOINT).add(delay)
+    return hedger
+
+
+def test_hedged_calls_keep_event_and_trace_context():
+    hedger = _hedger(0.01)
+    tracer = Tracer()
+    calls = []
+
+    def poll(cancel):
+        first = not calls
+        calls.append(cancel)
+        with tracer.span('probe'):
+            annotate(bytes=100)
+            # 主请求慢于对冲等待时间，触发对冲请求
+            if first:
+                time.sleep(0.2)
+        return 'in_stock'
+
+    event = {}
+    token = _current.set(event)
+    try:
+        with tracer.trace('poll') as trace:
+            assert hedger.run(ENDPOINT, poll) == 'in_stock'
+    finally:
+        _current.reset(token)
+    assert hedger.hedgeCount == 1
+    assert event == {'hedged': True, 'bytes': 100}
+    assert 'probe' in [span.name for span in trace.spans]
+
+
+def test_first_result_wins_over_none():
+    # 对冲请求先返回但没有得出结论，继续等待主请求
+    hedger = _hedger(0.01)
+    calls = []
+
+    def poll(cancel):
+        calls.append(cancel)
+        if len(calls) == 1:
+            time.sleep(0.1)
+            return 'in_stock'
+        return None
+
+    assert hedger.run(ENDPOINT, poll) == 'in_stock'
+    assert hedger.hedgeCount == 1
+    assert hedger.hedgeWins == 0
+
+
+def test_loser_is_cancelled_and_counted_as_lower_bound():
+    hedger = _hedger(0.05)
+    window = hedger.windows[ENDPOINT]
+    aborted = threading.Event()
+    calls = []
+
+    def poll(cancel):
+        calls.append(cancel)
+        if len(calls) == 1:
+            # 主请求卡住，直到被放弃
+            cancel.onSet(aborted.set)
+            cancel.wait(5)
+            return None
+        return 'in_stock'
+
+    start = time.monotonic()
+    assert hedger.run(ENDPOINT, poll) == 'in_stock'
+    assert aborted.wait(1)
+    assert time.monotonic() - start < 1
+    assert hedger.hedgeWins == 1
+    # 被放弃的主请求按已等待的时间计入，不会被丢弃
+    assert len(window) == 3
+    assert window.percentile(1.0) >= 0.05
+
+
+def test_hedges_limited_by_in_flight_budget():
+    hedger = Hedger(maxInFlight=1, minSamples=1)
+    hedger._window(ENDPOINT).add(0.01)
+    barrier = threading.Barrier(2)
+
+    def poll(cancel):
+        time.sleep(0.2)
+        return 'in_stock'
+
+    def query():
+        barrier.wait()
+        return hedger.run(ENDPOINT, poll)
+
+    threads = [threading.Thread(target=query) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 两次查询都超过对冲等待时间，但同时只允许一个对冲请求在途
+    assert hedger.requestCount == 2
+    assert hedger.hedgeCount == 1
+    assert hedger.budgetExhausted == 1
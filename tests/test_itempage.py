@@ -0,0 +1,77 @@
+# -*- coding:utf-8 -*-
+import itertools
+import os
+import re
+
+import pytest
+
+from itempage import IN_STOCK, NO_MARKER, OUT_OF_STOCK, STOCK_CHUNK_SIZE, StockProbe, parse_stock
+
+PAGES = os.path.join(os.path.dirname(__file__), 'fixtures', 'item_pages')
+EXPECTED = {
+    'out_of_stock.html': OUT_OF_STOCK,
+    'out_of_stock_gbk.html': OUT_OF_STOCK,
+    'in_stock_activity.html': IN_STOCK,
+    'cart_then_out_of_stock.html': OUT_OF_STOCK,
+    'cart_only.html': IN_STOCK,
+    'prompt_in_child.html': NO_MARKER,
+    'no_marker.html': NO_MARKER,
+}
+
+
+def _load(name):
+    with open(os.path.join(PAGES, name), 'rb') as f:
+        raw = f.read()
+    charset = re.search(rb'charset="([\w-]+)"', raw).group(1).decode()
+    return raw, raw.decode(charset)
+
+
+def _probe(content, chunkSize):
+    """按 Session._probeItemStock 的方式分块喂入，得出结论后停止读取"""
+    probe = StockProbe()
+    for i in range(0, len(content), chunkSize):
+        if probe.feed(content[i:i + chunkSize]) is not None:
+            break
+    return probe.close(), probe.bytesRead
+
+
+@pytest.mark.parametrize('chunkSize', [7, 100, STOCK_CHUNK_SIZE])
+@pytest.mark.parametrize('name', sorted(EXPECTED))
+def test_probe_matches_full_parse_on_saved_pages(name, chunkSize):
+    raw, text = _load(name)
+    assert parse_stock(text) == EXPECTED[name]
+    # 已知编码时按文本喂入，否则按原始字节喂入
+    assert _probe(text, chunkSize)[0] == EXPECTED[name]
+    assert _probe(raw, chunkSize)[0] == EXPECTED[name]
+
+
+@pytest.mark.parametrize('name', ['out_of_stock.html', 'in_stock_activity.html'])
+def test_probe_stops_before_end_of_page(name):
+    _, text = _load(name)
+    verdict, bytesRead = _probe(text, STOCK_CHUNK_SIZE)
+    assert verdict == EXPECTED[name]
+    assert bytesRead < len(text)
+
+
+SNIPPETS = {
+    'prompt_out': '<div class="store-prompt">  无货，此商品暂时售完</div>',
+    'prompt_in': '<div class="store-prompt">有货</div>',
+    'prompt_child': '<div class="store-prompt"><b>x</b>无货</div>',
+    'prompt_empty': '<div class="store-prompt"><b>无货</b></div>',
+    'activity': '<div class="activity-message"><span>现货速发</span></div>',
+    'activity_other': '<div class="activity-message"><span>预订</span></div>',
+    'activity_nested': '<div class="activity-message"><em><span>现货</span></em></div>',
+    'cart': '<a id="InitCartUrl" href="#">加入购物车</a>',
+    'padding': '<div class="x">' + 'lorem ipsum ' * 2000 + '</div>',
+}
+
+
+def test_probe_matches_full_parse_on_marker_orderings():
+    for size in range(1, 4):
+        for combo in itertools.permutations(SNIPPETS, size):
+            html = '<html><head><meta charset="utf-8"></head><body>{0}</body></html>'.format(
+                ''.join(SNIPPETS[key] for key in combo))
+            expected = parse_stock(html)
+            for chunkSize in (7, STOCK_CHUNK_SIZE):
+                assert _probe(html, chunkSize)[0] == expected, (combo, chunkSize)
+                assert _probe(html.encode('utf-8'), chunkSize)[0] == expected, (combo, chunkSize, 'bytes')
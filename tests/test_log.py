@@ -0,0 +1,32 @@
+# -*- coding:utf-8 -*-
+import logging
+
+from log import RepeatFilter
+
+
+def _record(message, level=logging.INFO, **extra):
+    record = logging.LogRecord('test', level, __file__, 1, message, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_repeats_of_a_topic_are_merged():
+    dedup = RepeatFilter(interval=600)
+    assert dedup.filter(_record('无货', topic='stock_1'))
+    assert not dedup.filter(_record('无货', topic='stock_1'))
+    changed = _record('有货', topic='stock_1')
+    assert dedup.filter(changed)
+    assert '重复1次' in changed.getMessage()
+
+
+def test_records_without_topic_are_never_dropped():
+    dedup = RepeatFilter(interval=600)
+    assert all(dedup.filter(_record('无货')) for _ in range(3))
+    assert dedup.suppressedCount == 0
+
+
+def test_warnings_are_never_dropped():
+    dedup = RepeatFilter(interval=600)
+    for level in (logging.WARNING, logging.ERROR):
+        assert all(dedup.filter(_record('请求失败', level, topic='stock_1')) for _ in range(3))
+    assert dedup.suppressedCount == 0
@@ -0,0 +1,21 @@
+# -*- coding:utf-8 -*-
+import requests
+
+from pools import HostPools
+
+
+def test_connections_survive_scheme_switch(http_server, https_server, tls_cert):
+    # 结算页走 http、提交订单走 https，切换协议不应关闭另一个协议的连接池
+    pools = HostPools(hosts=('localhost',))
+    sess = pools.mount(requests.session())
+    # 测试服务器不在默认端口，把同一个域名的 adapter 挂到两个地址上，与线上 http/https 共用 adapter 相同
+    adapter = sess.get_adapter('https://localhost/')
+    for url in (http_server, https_server):
+        sess.mount(url + '/', adapter)
+    for url in (http_server, https_server, http_server, https_server):
+        assert sess.get(url + '/', verify=tls_cert, timeout=5).status_code == 200
+
+    stats = pools.stats()['localhost']
+    assert stats['requests'] == 4
+    assert stats['connections'] == 2
+    assert stats['reused'] == 2
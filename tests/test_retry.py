@@ -0,0 +1,124 @@
+# -*- coding:utf-8 -*-
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+import requests
+
+import retry
+from retry import (
+    CONNECTION, FORBIDDEN, LOGIN_REDIRECT, OK, SERVER_ERROR, TIMEOUT, Backoff, Deadline, RetryPolicy, classify
+)
+
+
+def _response(status=200, url='https://api.m.jd.com/api', text='', location=None):
+    headers = {'Location': location} if location else {}
+    return types.SimpleNamespace(status_code=status, url=url, text=text, headers=headers)
+
+
+class _Rng(object):
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class _Clock(object):
+    """由 sleep 推进的假时钟"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_classify_login_redirect():
+    assert classify(_response(302, location='https://passport.jd.com/new/login.aspx')) == LOGIN_REDIRECT
+    assert classify(_response(302, location='https://cart.jd.com/cart_index')) == OK
+    # 跟随重定向后停在登录页
+    assert classify(_response(200, url='https://plogin.m.jd.com/login/login')) == LOGIN_REDIRECT
+
+
+def test_classify_403_with_valid_body_is_ok():
+    assert classify(_response(403, text='{"success":true,"resultData":{}}')) == OK
+    assert classify(_response(403, text='<html>访问受限</html>')) == FORBIDDEN
+    assert classify(_response(502)) == SERVER_ERROR
+
+
+def test_classify_exceptions():
+    assert classify(exc=requests.exceptions.ReadTimeout()) == TIMEOUT
+    assert classify(exc=requests.exceptions.ConnectionError()) == CONNECTION
+
+
+def test_backoff_is_capped_before_jitter():
+    backoff = Backoff(0.5, 2.0, cap=2.0, jitter=0.5)
+    assert backoff.delay(1, _Rng(0.0)) == 0.5
+    # 第 10 次重试的指数增长被 cap 截断，抖动只会缩短等待
+    assert backoff.delay(10, _Rng(0.0)) == 2.0
+    assert backoff.delay(10, _Rng(0.999)) == pytest.approx(1.001)
+
+
+def test_run_stops_at_deadline(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(retry.time, 'sleep', clock.sleep)
+    policy = RetryPolicy(10, {TIMEOUT: Backoff(1.0, 2.0, jitter=0)})
+    calls = []
+
+    def send():
+        calls.append(clock.now)
+        raise requests.exceptions.ReadTimeout()
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        policy.run(send, deadline=Deadline(5, clock=clock))
+    # 等待 1s、2s 后仍在截止时间内，再等待 4s 会超过截止时间，不再重试
+    assert calls == [0.0, 1.0, 3.0]
+    assert policy.retryCount == 2
+    assert policy.failureCounts == {TIMEOUT: 3}
+
+
+def test_run_async_retries_until_success(monkeypatch):
+    async def noSleep(seconds):
+        pass
+
+    monkeypatch.setattr(retry.asyncio, 'sleep', noSleep)
+    policy = RetryPolicy(3)
+    results = [requests.exceptions.ConnectionError(), _response(503), _response(200)]
+
+    async def send():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    assert asyncio.run(policy.runAsync(send)).status_code == 200
+    assert policy.failureCounts == {CONNECTION: 1, SERVER_ERROR: 1}
+
+
+def test_run_stops_retrying_once_cancelled():
+    policy = RetryPolicy(3)
+    cancel = threading.Event()
+    calls = []
+
+    def send():
+        calls.append(1)
+        cancel.set()
+        return _response(502)
+
+    assert policy.run(send, cancel=cancel).status_code == 502
+    assert len(calls) == 1
+
+
+def test_run_wakes_from_backoff_when_cancelled():
+    policy = RetryPolicy(3, {SERVER_ERROR: Backoff(10, 1, 10)})
+    cancel = threading.Event()
+    threading.Timer(0.05, cancel.set).start()
+    start = time.monotonic()
+    assert policy.run(lambda: _response(502), cancel=cancel).status_code == 502
+    assert time.monotonic() - start < 5
@@ -0,0 +1,118 @@
+# -*- coding:utf-8 -*-
+from datetime import datetime
+
+import pytest
+
+import scheduler
+from scheduler import PollScheduler, DEFAULT_BACKOFF_AFTER
+
+
+class _Clock(object):
+    """手动推进的单调时钟"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _at(monkeypatch, hour, minute, second=0):
+    """把调度器看到的当前时间固定为当天的 hour:minute:second"""
+
+    class _Datetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2026, 10, 17, hour, minute, second)
+
+    monkeypatch.setattr(scheduler, 'datetime', _Datetime)
+
+
+def test_ticks_are_start_to_start():
+    clock = _Clock()
+    poll = PollScheduler(1.0, clock=clock)
+    assert poll.nextDelay() == 0
+    poll.markFired()
+    # 查询耗时 0.3s，下一次仍在上一次开始后 1s 触发
+    clock.now += 0.3
+    assert poll.nextDelay() == pytest.approx(0.7)
+
+
+def test_missed_ticks_are_skipped():
+    clock = _Clock()
+    poll = PollScheduler(1.0, clock=clock)
+    poll.nextDelay()
+    poll.markFired()
+    # 查询耗时 2.5s，错过 1s 和 2s 两个节拍，对齐到 3s
+    clock.now += 2.5
+    assert poll.nextDelay() == pytest.approx(0.5)
+    assert poll.skipped == 2
+
+
+@pytest.mark.parametrize('hour, minute, shrunk', [
+    (9, 58, False),   # 窗口开始前超过 1 分钟
+    (9, 59, True),    # 窗口开始前 1 分钟内
+    (10, 3, True),
+    (10, 6, False),
+])
+def test_interval_shrinks_near_windows(monkeypatch, hour, minute, shrunk):
+    _at(monkeypatch, hour, minute, 30)
+    poll = PollScheduler(5.0, minInterval=0.5, windows='10:00-10:05')
+    assert poll.currentInterval() == (0.5 if shrunk else 5.0)
+
+
+@pytest.mark.parametrize('hour, minute, shrunk', [
+    (23, 58, True),
+    (0, 2, True),
+    (0, 10, False),
+    (12, 0, False),
+])
+def test_window_crossing_midnight(monkeypatch, hour, minute, shrunk):
+    _at(monkeypatch, hour, minute)
+    poll = PollScheduler(5.0, minInterval=0.5, windows='23:59-00:05')
+    assert poll.currentInterval() == (0.5 if shrunk else 5.0)
+
+
+def test_backoff_grows_and_resets():
+    poll = PollScheduler(1.0, maxInterval=3.0, backoffAfter=2, backoffFactor=2)
+    poll.record('out_of_stock')
+    intervals = []
+    for _ in range(6):
+        poll.record('out_of_stock')
+        intervals.append(poll.currentInterval())
+    assert intervals == [1.0, 2.0, 2.0, 3.0, 3.0, 3.0]
+    # 结果一旦变化立即恢复
+    poll.record('in_stock')
+    assert poll.currentInterval() == 1.0
+
+
+def test_stats_compare_achieved_with_target():
+    clock = _Clock()
+    poll = PollScheduler(1.0, clock=clock)
+    poll.nextDelay()
+    poll.markFired()
+    for lateness in (0.01, 0.03):
+        clock.now += poll.nextDelay() + lateness
+        poll.markFired()
+    stats = poll.stats()
+    assert stats['fired'] == 3
+    assert stats['targetInterval'] == pytest.approx(1.0)
+    # 第一次晚 10ms、第二次晚 30ms：实际间隔 1.01s 与 1.02s
+    assert stats['achievedInterval'] == pytest.approx(1.015)
+    assert stats['maxLateness'] == pytest.approx(0.03)
+    assert stats['meanLateness'] == pytest.approx(0.04 / 3)
+
+
+def test_bad_config_falls_back_with_warning(monkeypatch, caplog):
+    from config import global_config
+    section = global_config._config['item']
+    monkeypatch.setitem(section, 'hot_windows', '10:00')
+    monkeypatch.setitem(section, 'min_stock_interval', 'abc')
+    monkeypatch.setitem(section, 'backoff_after', 'x')
+
+    poll = PollScheduler.fromConfig(2.0)
+    assert poll.windows == []
+    assert poll.minInterval == 2.0
+    assert poll.backoffAfter == DEFAULT_BACKOFF_AFTER
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == 'WARNING']
+    assert len([message for message in warnings if '[item]' in message]) == 3
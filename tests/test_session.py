@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+OUT_OF_STOCK_PAGE = '<html><body><div class="store-prompt">无货</div></body></html>'
+IN_STOCK_PAGE = '<html><body><a id="InitCartUrl" href="//cart.jd.com/gate.action"></a></body></html>'
+SKU = '100012043978'
+
+
+def test_full_page_stock_polls_ignore_page_cache(session):
+    # 整页库存查询间隔短于快照有效期时，每次查询仍然重新请求，不返回缓存中的旧结论
+    session.streamStock = False
+    session.itemPages.ttl = 60
+    url = 'https://item.jd.com/{0}.html'.format(SKU)
+    session.transport.stub(url, body=OUT_OF_STOCK_PAGE)
+    assert session.getItemStock(SKU, 1, '1_2_3_4') is False
+
+    session.transport._stubs.clear()
+    session.transport.stub(url, body=IN_STOCK_PAGE)
+    assert session.getItemStock(SKU, 1, '1_2_3_4') is True
+    assert len(session.transport.calls) == 2
+
+    # 非查询调用（商品信息、预售结算）复用库存查询刚取到的页面
+    assert session.getItemPage(SKU).stock == 'in_stock'
+    assert len(session.transport.calls) == 2
+
+
+def test_bad_config_value_falls_back_with_warning(session, monkeypatch, caplog):
+    import JdSession
+    from config import global_config
+    section = global_config._config['config']
+    monkeypatch.setitem(section, 'poll_deadline', 'abc')
+    monkeypatch.setitem(section, 'stream_stock', 'maybe')
+    monkeypatch.setitem(section, 'pool_maxsize', '8')
+    monkeypatch.setitem(section, 'transport', '')
+
+    sess = JdSession.Session()
+    assert sess.pollDeadline == JdSession.DEFAULT_POLL_DEADLINE
+    assert sess.streamStock is True
+    assert sess.hostPools.poolMaxsize == 8
+    warnings = [record.getMessage() for record in caplog.records if record.levelname == 'WARNING']
+    assert any('poll_deadline' in message for message in warnings)
+    assert any('stream_stock' in message for message in warnings)
+    # 未配置和留空的配置项直接使用默认值，不记录警告
+    assert not any('transport' in message or 'pool_maxsize' in message for message in warnings)
+
+
+def test_submit_is_not_retried_on_server_error(session):
+    # 5xx 时订单可能已经创建，提交请求不能自动重发
+    session.transport.stub('https://trade.jd.com/shopping/order/submitOrder.action', status=502)
+    assert session._sendSubmitRequest().status_code == 502
+    assert len(session.transport.calls) == 1
+
+
+def test_cancelled_stock_probe_is_not_retried(session):
+    # 对冲中另一个请求已先返回时，落后的请求不再重试
+    from hedge import CancelEvent
+    session.transport.stub('https://item.jd.com/{0}.html'.format(SKU), status=502)
+    cancel = CancelEvent()
+    cancel.set()
+    assert session._probeItemStock(SKU, cancel=cancel) is None
+    assert len(session.transport.calls) == 1
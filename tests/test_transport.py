@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+import socket
+import threading
+import time
+
+import pytest
+import requests
+
+import transport
+
+
+def test_http2_falls_back_without_h2(session, monkeypatch):
+    # 安装了 httpx 但没有 h2 时，创建传输层时就退回 requests，而不是在第一次请求时出错
+    monkeypatch.setattr(transport, 'httpx', object())
+    monkeypatch.setattr(transport, 'h2', None)
+    assert isinstance(transport.make_transport(session, transport.TRANSPORT_HTTP2), transport.RequestsTransport)
+
+
+def test_recording_selectable_by_name(session):
+    recording = transport.make_transport(session, transport.TRANSPORT_RECORDING)
+    assert isinstance(recording, transport.RecordingTransport)
+    assert isinstance(recording.inner, transport.RequestsTransport)
+
+
+def test_submit_goes_through_transport(session):
+    session.transport.stub('https://trade.jd.com/shopping/order/submitOrder.action',
+                           body='{"success": true, "orderId": 1}')
+    session._sendSubmitRequest()
+    call = session.transport.calls[-1]
+    assert call['method'] == 'POST'
+    assert call['url'].startswith('https://trade.jd.com/shopping/order/submitOrder.action')
+
+
+def test_abort_response_interrupts_blocked_read():
+    # 服务端发出响应头后不再发送内容，读取方阻塞在 socket 上，abort_response 应立即唤醒它
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    release = threading.Event()
+
+    def serve():
+        conn, _ = server.accept()
+        conn.recv(4096)
+        conn.sendall(b'HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\nabc')
+        release.wait(10)
+        conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    try:
+        resp = requests.get('http://127.0.0.1:{0}/'.format(server.getsockname()[1]), stream=True, timeout=10)
+        threading.Timer(0.05, transport.abort_response, (resp,)).start()
+        start = time.monotonic()
+        with pytest.raises(requests.exceptions.RequestException):
+            for _ in resp.iter_content(10):
+                pass
+        assert time.monotonic() - start < 5
+    finally:
+        release.set()
+        server.close()
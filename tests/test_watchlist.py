@@ -0,0 +1,40 @@
+# -*- coding:utf-8 -*-
+import threading
+import time
+
+from watchlist import Watchlist
+
+
+class SlowSession(object):
+    """第一个商品立即有货，其他商品的查询要很久才返回"""
+
+    heartbeat = None
+
+    def __init__(self, inStockSku, delay):
+        self.inStockSku = inStockSku
+        self.delay = delay
+        self.release = threading.Event()
+
+    def getItemStock(self, skuId, skuNum, areaId):
+        if skuId == self.inStockSku:
+            time.sleep(0.05)
+            return True
+        self.release.wait(self.delay)
+        return False
+
+
+def test_found_sku_does_not_wait_for_other_polls():
+    session = SlowSession('111', delay=5)
+    watchlist = Watchlist(session, '222,111', '1_2_3_4', interval=0.1)
+    start = time.monotonic()
+    try:
+        assert watchlist.run() == ('111', 1)
+        assert time.monotonic() - start < 2
+    finally:
+        session.release.set()
+
+
+def test_stop_before_run():
+    watchlist = Watchlist(SlowSession('111', delay=5), '111', '1_2_3_4', interval=0.1)
+    watchlist.stop()
+    assert watchlist.run() is None
@@ -1,20 +1,123 @@
 # -*- coding:utf-8 -*-
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from log import logger
+
+# 支持的定时时间格式，可精确到微秒，如 '2025-01-01 10:00:00.250'
+BUY_TIME_FORMATS = ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S")
+
+# 精确模式下，距离截止时间多少秒时由粗略休眠转为精细等待
+DEFAULT_SPIN_WINDOW = 0.02
+# 精细等待阶段，剩余时间大于该值时仍使用短休眠让出 CPU
+FINE_SLEEP_THRESHOLD = 0.002
+FINE_SLEEP = 0.0005
+# 粗略休眠每次最长时间(秒)，醒来后重新读取服务器时钟偏差
+COARSE_SLEEP_MAX = 1.0
+# 服务器时钟偏差的误差界超过该值(秒)时不做校正
+DEFAULT_MAX_CLOCK_ERROR = 0.1
 
-class Timer(object):
 
-    def __init__(self, buyTime, sleepInterval=0.5):
+def parse_buy_time(buyTime):
+    """解析定时时间字符串
+    :param buyTime: 如 '2018-09-28 22:45:50' 或 '2018-09-28 22:45:50.250'
+    :return: datetime
+    """
+    for fmt in BUY_TIME_FORMATS:
+        try:
+            return datetime.strptime(buyTime, fmt)
+        except ValueError:
+            continue
+    raise ValueError("定时时间格式错误: {0}".format(buyTime))
+
+
+class Timer(object):
 
-        # '2018-09-28 22:45:50'
-        self.buy_time = datetime.strptime(buyTime, "%Y-%m-%d %H:%M:%S")
+    def __init__(self, buyTime, sleepInterval=0.5, precise=True, spinWindow=DEFAULT_SPIN_WINDOW,
+                 serverClock=None, maxClockError=DEFAULT_MAX_CLOCK_ERROR):
+        """
+        :param buyTime: 定时时间（京东服务器时间），如 '2018-09-28 22:45:50.250'
+        :param sleepInterval: 普通模式下检查时间的间隔(秒)
+        :param precise: 是否使用精确模式
+        :param spinWindow: 精确模式下精细等待的时长(秒)
+        :param serverClock: clock.ClockOffsetEstimator，精确模式下按服务器时钟对齐截止时间
+        :param maxClockError: 偏差误差界超过该值(秒)时不做校正
+        """
+        self.buy_time = parse_buy_time(buyTime)
         self.sleepInterval = sleepInterval
+        self.precise = precise
+        self.spinWindow = spinWindow
+        self.serverClock = serverClock
+        self.maxClockError = maxClockError
+        self.releaseError = None  # 精确模式下实际触发时间与截止时间的偏差(秒)
 
-    def start(self):
+    def start(self, lead=0):
+        """阻塞等待到定时时间
+        :param lead: 提前多少秒返回，用于在定时时间前做预热
+        """
+        if self.precise:
+            self._startPrecise(lead)
+            return
         now_time = datetime.now
+        target = self.buy_time - timedelta(seconds=lead)
         while True:
-            if now_time() >= self.buy_time:
+            if now_time() >= target:
                 break
             else:
                 time.sleep(self.sleepInterval)
+
+    def remaining(self):
+        """距离定时时间还有多少秒，按服务器时钟偏差校正
+        :return: 秒数，已过定时时间时小于等于 0
+        """
+        offset, _ = self._serverOffset()
+        return self.buy_time.timestamp() - time.time() - offset
+
+    def _serverOffset(self):
+        """获取可用的服务器时钟偏差
+        :return: (偏差, 误差界)，无法校正时偏差为 0，误差界为 None
+        """
+        if self.serverClock is None:
+            return 0.0, None
+        estimate = self.serverClock.estimate()
+        if estimate is None or estimate[1] > self.maxClockError:
+            return 0.0, None
+        return estimate
+
+    def _startPrecise(self, lead=0):
+        """精确模式：只读取一次系统时间换算为单调时钟截止时间，不受之后系统时间跳变影响；
+        截止时间按服务器时钟偏差校正，先粗略休眠到截止前 spinWindow 秒，再精细等待到截止时间。
+        """
+        base = time.monotonic() + (self.buy_time.timestamp() - time.time()) - lead
+        offset, error = self._serverOffset()
+        deadline = base - offset
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logger.info('已过定时时间 {0}，立即执行'.format(self.buy_time))
+            self.releaseError = -remaining
+            return
+        if error is not None:
+            logger.info('定时器将在 {0:.3f} 秒后触发，服务器时钟偏差 {1:+.1f} ms(±{2:.1f} ms)'.format(
+                remaining, offset * 1000, error * 1000))
+        else:
+            logger.info('定时器将在 {0:.3f} 秒后触发'.format(remaining))
+
+        # 粗略休眠，每次醒来重新读取服务器时钟偏差
+        while remaining > self.spinWindow:
+            time.sleep(min(remaining - self.spinWindow, COARSE_SLEEP_MAX))
+            offset, error = self._serverOffset()
+            deadline = base - offset
+            remaining = deadline - time.monotonic()
+
+        # 精细等待
+        while remaining > 0:
+            if remaining > FINE_SLEEP_THRESHOLD:
+                time.sleep(FINE_SLEEP)
+            remaining = deadline - time.monotonic()
+
+        self.releaseError = time.monotonic() - deadline
+        if error is not None:
+            logger.info('定时器已触发，触发误差 {0:+.3f} ms，服务器时钟偏差 {1:+.1f} ms(±{2:.1f} ms)'.format(
+                self.releaseError * 1000, offset * 1000, error * 1000))
+        else:
+            logger.info('定时器已触发，触发误差 {0:+.3f} ms'.format(self.releaseError * 1000))
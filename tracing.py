@@ -0,0 +1,221 @@
+# -*- coding:utf-8 -*-
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+
+from log import logger
+from metrics import Histogram
+
+# 下单追踪文件的保存目录
+TRACE_DIR = 'logs/traces'
+
+# 阶段类别：下单流程中的步骤 / 其中的单个 HTTP 请求
+CAT_STAGE = 'stage'
+CAT_HTTP = 'http'
+
+# 当前线程/协程正在记录的追踪
+_trace = contextvars.ContextVar('trace', default=None)
+
+
+class Span(object):
+    """追踪中的一个阶段"""
+
+    __slots__ = ('name', 'cat', 'start', 'end', 'tid', 'args')
+
+    def __init__(self, name, start, args, cat=CAT_STAGE):
+        self.name = name
+        self.cat = cat
+        self.start = start
+        self.end = None
+        self.tid = threading.get_ident()
+        self.args = args
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class Trace(object):
+    """
+    一次下单尝试的追踪，包含从库存查询到提交订单的各个阶段
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.spans = []
+        self.keep = True  # 为 False 时不导出（如查询后无货、没有进入下单）
+        self.wallStart = time.time()
+        self.start = time.perf_counter()
+        self._depth = 0
+
+    def summary(self):
+        """各步骤（不含根阶段和单个请求）按开始时间排列的耗时文本"""
+        stages = sorted((span for span in self.spans if span.cat == CAT_STAGE and span.args.get('depth', 0) > 1),
+                        key=lambda s: s.start)
+        return '，'.join('{0} {1:.0f}ms'.format(span.name, span.duration * 1000) for span in stages)
+
+    def toChrome(self):
+        """转换为 Chrome/Perfetto 可以直接打开的 trace 格式
+        :return: dict
+        """
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'JdBuyer'}}]
+        for span in sorted(self.spans, key=lambda s: s.start):
+            args = {key: value for key, value in span.args.items() if key != 'depth'}
+            events.append({
+                'name': span.name,
+                'cat': span.cat,
+                'ph': 'X',
+                'ts': round((self.wallStart + span.start - self.start) * 1e6),
+                'dur': round(span.duration * 1e6),
+                'pid': pid,
+                'tid': span.tid,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': dict(self.args, trace=self.name)}
+
+
+class _SpanContext(object):
+    __slots__ = ('tracer', 'trace', 'span')
+
+    def __init__(self, tracer, trace, name, args, cat):
+        self.tracer = tracer
+        self.trace = trace
+        self.span = Span(name, 0, args, cat)
+
+    def __enter__(self):
+        self.trace._depth += 1
+        self.span.args['depth'] = self.trace._depth
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, excType, exc, tb):
+        span = self.span
+        span.end = time.perf_counter()
+        self.trace._depth -= 1
+        if excType is not None:
+            span.args['error'] = excType.__name__
+        self.trace.spans.append(span)
+        # 不导出的追踪（如查询后无货）只统计其中的阶段，不统计整体
+        if self.trace.keep or span.args['depth'] > 1:
+            self.tracer.histogram(span.name).observe(span.end - span.start)
+        return False
+
+
+class Tracer(object):
+    """
+    下单流程的阶段追踪
+
+    trace() 开始一次追踪（已在追踪中时沿用外层的），span() 记录其中的一个阶段；
+    各阶段耗时累计到按阶段名区分的直方图。追踪结束且 keep 为 True 时输出各阶段耗时，
+    并可导出为 Chrome/Perfetto trace 文件。没有进行中的追踪时 span() 不做任何事。
+    """
+
+    def __init__(self, enabled=True, exportDir=None):
+        """
+        :param enabled: 是否追踪
+        :param exportDir: trace 文件导出目录，None 为不导出
+        """
+        self.enabled = enabled
+        self.exportDir = exportDir
+        self.histograms = dict()
+        self.lastTrace = None
+        self._lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(name, Histogram())
+        return histogram
+
+    @contextlib.contextmanager
+    def trace(self, name, **args):
+        """开始一次追踪，已在追踪中时作为外层追踪的一个阶段
+        :param name: 追踪名称，同时作为根阶段的名称
+        :return: Trace，未开启追踪时为 None
+        """
+        if not self.enabled:
+            yield None
+            return
+        current = _trace.get()
+        if current is not None:
+            with self.span(name, **args):
+                yield current
+            return
+        trace = Trace(name, args)
+        token = _trace.set(trace)
+        try:
+            with self.span(name, **args):
+                yield trace
+        finally:
+            _trace.reset(token)
+            if trace.keep:
+                self.lastTrace = trace
+                self._finish(trace)
+
+    def span(self, name, cat=CAT_STAGE, **args):
+        """记录一个阶段，用作 with 语句
+        :param cat: 阶段类别，CAT_STAGE 或 CAT_HTTP
+        """
+        trace = _trace.get()
+        if trace is None:
+            return contextlib.nullcontext()
+        return _SpanContext(self, trace, name, args, cat)
+
+    def _finish(self, trace):
+        logger.info('%s 各阶段耗时: %s', trace.name, trace.summary())
+        if self.exportDir:
+            try:
+                path = self.export(trace)
+                logger.info('下单追踪已导出到 %s，可在 chrome://tracing 或 ui.perfetto.dev 中打开', path)
+            except Exception as e:
+                logger.error('导出下单追踪失败: %s', e)
+
+    def export(self, trace, path=None):
+        """导出 Chrome/Perfetto trace 文件
+        :return: 文件路径
+        """
+        if path is None:
+            suffix = '_'.join(str(value) for value in trace.args.values())
+            filename = '{0}_{1}{2}.json'.format(
+                trace.name, time.strftime('%Y%m%d-%H%M%S', time.localtime(trace.wallStart)),
+                '_' + suffix if suffix else '')
+            path = os.path.join(self.exportDir or TRACE_DIR, filename)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace.toChrome(), f, ensure_ascii=False)
+        return path
+
+    def report(self):
+        """各阶段耗时直方图的可读文本"""
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            if not histogram.count:
+                continue
+            lines.append('{0}: {1}次，平均 {2:.0f}ms，p50≤{3:.0f}ms，p90≤{4:.0f}ms，p99≤{5:.0f}ms，最长 {6:.0f}ms'.format(
+                name, histogram.count, histogram.sum / histogram.count * 1000, histogram.quantile(0.5) * 1000,
+                histogram.quantile(0.9) * 1000, histogram.quantile(0.99) * 1000, histogram.max * 1000))
+        return lines
+
+
+def traced(name=None):
+    """方法装饰器：在所在对象的 tracer 进行追踪时把这次调用记录为一个阶段
+    :param name: 阶段名称，默认为方法名
+    """
+    def decorator(func):
+        spanName = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(obj, *args, **kwargs):
+            if _trace.get() is None:
+                return func(obj, *args, **kwargs)
+            with obj.tracer.span(spanName):
+                return func(obj, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,357 @@
+# -*- coding:utf-8 -*-
+import json
+import socket
+import time
+from collections import deque
+from datetime import timedelta
+from urllib.parse import urlparse
+
+import requests
+from requests.hooks import dispatch_hook
+from requests.structures import CaseInsensitiveDict
+
+from httptiming import trace_httpx
+from log import logger
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+# 可选的传输层
+TRANSPORT_REQUESTS = 'requests'
+TRANSPORT_HTTP2 = 'http2'
+TRANSPORT_RECORDING = 'recording'
+# 录制传输层保留的最近请求数
+RECORDING_MAX_CALLS = 1000
+# 默认走 HTTP/2 的域名：购物车接口都在 api.m.jd.com，可以在一条连接上复用
+DEFAULT_HTTP2_HOSTS = ('api.m.jd.com',)
+# HTTP/2 不允许的逐跳请求头
+HOP_BY_HOP_HEADERS = ('connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade')
+
+
+class RequestsTransport(object):
+    """
+    基于 requests 的传输层（默认）
+
+    每次请求都使用 Session 当前的 requests 会话，会话重建后自动生效。
+    """
+
+    name = TRANSPORT_REQUESTS
+
+    def __init__(self, session):
+        """
+        :param session: JdSession.Session
+        """
+        self.session = session
+
+    def request(self, method, url, **kwargs):
+        """发送请求，参数与 requests.Session.request 相同
+        :return: requests.Response 或兼容的响应对象
+        """
+        return self.session.sess.request(method, url, **kwargs)
+
+    def send(self, prepared, **kwargs):
+        """发送已准备好的请求（提交订单），参数与 requests.Session.send 相同"""
+        return self.session.sess.send(prepared, **kwargs)
+
+    def close(self):
+        pass
+
+
+class HttpxResponse(object):
+    """
+    把 httpx.Response 包装成 Session 中用到的 requests.Response 接口
+    """
+
+    def __init__(self, resp, elapsed):
+        self._resp = resp
+        self.status_code = resp.status_code
+        self.headers = resp.headers
+        self.url = str(resp.url)
+        self.request = requests.Request(resp.request.method, str(resp.request.url))
+        self.elapsed = timedelta(seconds=elapsed)
+        self.http_version = resp.http_version
+
+    @property
+    def encoding(self):
+        return self._resp.charset_encoding
+
+    @property
+    def content(self):
+        return self._resp.read()
+
+    @property
+    def text(self):
+        self._resp.read()
+        return self._resp.text
+
+    def json(self, **kwargs):
+        return json.loads(self.text, **kwargs)
+
+    def iter_content(self, chunk_size=1, decode_unicode=False):
+        if decode_unicode:
+            return self._resp.iter_text(chunk_size)
+        return self._resp.iter_bytes(chunk_size)
+
+    def close(self):
+        self._resp.close()
+
+    def aiter_content(self, chunk_size=1, decode_unicode=False):
+        """异步客户端的流式读取"""
+        if decode_unicode:
+            return self._resp.aiter_text(chunk_size)
+        return self._resp.aiter_bytes(chunk_size)
+
+    async def aclose(self):
+        await self._resp.aclose()
+
+
+class Http2Transport(object):
+    """
+    HTTP/2 传输层，需要安装 httpx[http2]
+
+    hosts 中的域名通过一个 httpx.Client 发送，同一域名的请求在一条 HTTP/2 连接上多路复用；
+    其他域名仍交给 requests。两者共用 requests 会话的 cookie jar 和响应 hook，
+    异常转换为对应的 requests 异常，重试分类不受影响。
+    """
+
+    name = TRANSPORT_HTTP2
+
+    def __init__(self, session, hosts=DEFAULT_HTTP2_HOSTS):
+        """
+        :param session: JdSession.Session
+        :param hosts: 使用 HTTP/2 的域名
+        """
+        if httpx is None:
+            raise ImportError('HTTP/2 传输层需要安装 httpx[http2]')
+        if h2 is None:
+            raise ImportError('HTTP/2 传输层需要安装 httpx[http2]（缺少 h2）')
+        self.session = session
+        self.hosts = set(hosts)
+        self.fallback = RequestsTransport(session)
+        self._client = None
+        self._cookies = None
+
+    def _clientFor(self, sess):
+        # cookie jar 被替换（如重新登录、更新 cookies）时重建客户端
+        if self._client is None or self._cookies is not sess.cookies:
+            self.close()
+            self._client = httpx.Client(http2=True, cookies=sess.cookies)
+            self._cookies = sess.cookies
+        return self._client
+
+    def request(self, method, url, **kwargs):
+        if urlparse(url).hostname not in self.hosts:
+            return self.fallback.request(method, url, **kwargs)
+        headers = {key: value for key, value in (kwargs.get('headers') or {}).items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS}
+        return self._send(lambda client: client.build_request(
+            method, url, params=kwargs.get('params'), data=kwargs.get('data'), headers=headers,
+            timeout=kwargs.get('timeout')), kwargs.get('stream', False), kwargs.get('allow_redirects', True))
+
+    def send(self, prepared, **kwargs):
+        """发送已准备好的请求，Cookie 由客户端从共用的 cookie jar 中添加"""
+        if urlparse(prepared.url).hostname not in self.hosts:
+            return self.fallback.send(prepared, **kwargs)
+        headers = {key: value for key, value in prepared.headers.items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS + ('cookie', 'content-length')}
+        return self._send(lambda client: client.build_request(
+            prepared.method, prepared.url, content=prepared.body, headers=headers,
+            timeout=kwargs.get('timeout')), kwargs.get('stream', False), kwargs.get('allow_redirects', True))
+
+    def _send(self, build, stream, allowRedirects):
+        sess = self.session.sess
+        client = self._clientFor(sess)
+        start = time.perf_counter()
+        try:
+            resp = client.send(build(client), stream=stream, follow_redirects=allowRedirects)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+        return dispatch_hook('response', sess.hooks, HttpxResponse(resp, time.perf_counter() - start))
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+
+class AsyncHttpxTransport(object):
+    """
+    异步传输层，需要安装 httpx
+
+    供 asyncsession.AsyncSession 使用，所有域名通过一个 httpx.AsyncClient 发送，
+    与同步 Session 共用 cookie jar 和响应 hook。
+    """
+
+    name = 'async'
+
+    def __init__(self, session, http2=False):
+        """
+        :param session: JdSession.Session
+        :param http2: 是否启用 HTTP/2（需要 httpx[http2]）
+        """
+        if httpx is None:
+            raise ImportError('异步传输层需要安装 httpx')
+        if http2 and h2 is None:
+            logger.warning('异步请求的 HTTP/2 需要安装 httpx[http2]（缺少 h2），使用 HTTP/1.1')
+            http2 = False
+        self.session = session
+        self.http2 = http2
+        self._client = None
+        self._cookies = None
+
+    async def _clientFor(self, sess):
+        if self._client is None or self._cookies is not sess.cookies:
+            await self.aclose()
+            self._client = httpx.AsyncClient(http2=self.http2, cookies=sess.cookies)
+            self._cookies = sess.cookies
+        return self._client
+
+    async def request(self, method, url, **kwargs):
+        """发送请求，参数与 requests.Session.request 相同
+        :return: HttpxResponse，stream=True 时需要调用 aclose
+        """
+        sess = self.session.sess
+        headers = {key: value for key, value in (kwargs.get('headers') or {}).items()
+                   if key.lower() not in HOP_BY_HOP_HEADERS}
+        client = await self._clientFor(sess)
+        start = time.perf_counter()
+        try:
+            req = client.build_request(method, url, params=kwargs.get('params'), data=kwargs.get('data'),
+                                       headers=headers, timeout=kwargs.get('timeout'),
+                                       extensions={'trace': trace_httpx})
+            resp = await client.send(req, stream=kwargs.get('stream', False),
+                                     follow_redirects=kwargs.get('allow_redirects', True))
+            if kwargs.get('stream', False) and resp.status_code >= 400:
+                # 重试分类和状态检查会读取错误响应的内容（京东的 403 有时仍然有效），
+                # 异步流式响应不能同步读取，先在这里读完
+                await resp.aread()
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.Timeout(e)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+        return dispatch_hook('response', sess.hooks, HttpxResponse(resp, time.perf_counter() - start))
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def abort_response(resp):
+    """在另一个线程中放弃正在读取的响应
+
+    只关闭响应时底层 socket 仍被读取方引用，读取会一直阻塞到超时；先 shutdown socket 唤醒读取方，
+    读取方随即抛出异常。非 requests 的响应只关闭。
+    """
+    conn = getattr(getattr(resp, 'raw', None), '_connection', None)
+    sock = getattr(conn, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    resp.close()
+
+
+def stub_response(method, url, status=200, body='', headers=None):
+    """构造一个不经过网络的 requests.Response
+    :return: requests.Response
+    """
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers = CaseInsensitiveDict(headers or {})
+    resp._content = body.encode('utf-8') if isinstance(body, str) else body
+    resp._content_consumed = True
+    resp.encoding = 'utf-8'
+    resp.url = url
+    resp.request = requests.Request(method, url).prepare()
+    resp.elapsed = timedelta(0)
+    return resp
+
+
+class RecordingTransport(object):
+    """
+    录制传输层
+
+    记录每次请求（保留最近 RECORDING_MAX_CALLS 次）的方法、地址、参数和响应状态。给定 inner 时转发给 inner，
+    否则按 stub 预设的地址前缀返回桩响应（没有匹配时返回 404），用于离线调试。
+    """
+
+    name = 'recording'
+
+    def __init__(self, inner=None):
+        """
+        :param inner: 实际发送请求的传输层，为 None 时只返回桩响应
+        """
+        self.inner = inner
+        self.calls = deque(maxlen=RECORDING_MAX_CALLS)
+        self._stubs = []
+
+    def stub(self, urlPrefix, status=200, body='', headers=None):
+        """预设桩响应，按添加顺序匹配地址前缀"""
+        self._stubs.append((urlPrefix, status, body, headers))
+
+    def request(self, method, url, **kwargs):
+        start = time.perf_counter()
+        if self.inner is not None:
+            resp = self.inner.request(method, url, **kwargs)
+        else:
+            resp = self._stubFor(method, url)
+        self._record(method, url, kwargs.get('params'), kwargs.get('data'), resp, start)
+        return resp
+
+    def send(self, prepared, **kwargs):
+        start = time.perf_counter()
+        if self.inner is not None:
+            resp = self.inner.send(prepared, **kwargs)
+        else:
+            resp = self._stubFor(prepared.method, prepared.url)
+        self._record(prepared.method, prepared.url, None, prepared.body, resp, start)
+        return resp
+
+    def _stubFor(self, method, url):
+        for urlPrefix, status, body, headers in self._stubs:
+            if url.startswith(urlPrefix):
+                return stub_response(method, url, status, body, headers)
+        return stub_response(method, url, 404)
+
+    def _record(self, method, url, params, data, resp, start):
+        self.calls.append({
+            'method': method,
+            'url': url,
+            'params': params,
+            'data': data,
+            'status': resp.status_code,
+            'elapsed': time.perf_counter() - start,
+        })
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+
+def make_transport(session, name=TRANSPORT_REQUESTS, http2Hosts=DEFAULT_HTTP2_HOSTS):
+    """按名称创建传输层，HTTP/2 依赖缺失时退回 requests
+    :param session: JdSession.Session
+    :param name: 'requests'、'http2' 或 'recording'（经 requests 发送并记录每次请求）
+    :param http2Hosts: 使用 HTTP/2 的域名
+    """
+    if name == TRANSPORT_HTTP2:
+        try:
+            return Http2Transport(session, http2Hosts)
+        except ImportError as e:
+            logger.warning('{0}，使用 requests 传输层'.format(e))
+    elif name == TRANSPORT_RECORDING:
+        return RecordingTransport(RequestsTransport(session))
+    elif name != TRANSPORT_REQUESTS:
+        logger.warning('未知的传输层 {0}，使用 requests 传输层'.format(name))
+    return RequestsTransport(session)
@@ -0,0 +1,132 @@
+# -*- coding:utf-8 -*-
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import asyncsession
+from log import logger
+from scheduler import PollScheduler
+from utils import parse_sku_id
+
+# 默认同时进行的库存查询数
+DEFAULT_WATCH_CONCURRENCY = 4
+
+# 检查停止标志的间隔(秒)
+STOP_CHECK_INTERVAL = 0.2
+
+
+class Watchlist(object):
+    """
+    多商品库存监听
+
+    在一个事件循环里按各自的间隔并发查询多个商品的库存，所有查询共用同一个 Session，
+    同时进行的查询数不超过 concurrency。任一商品有货即返回，交给下单流程处理。
+
+    asyncIO 为 True 且安装了 httpx 时通过 AsyncSession 直接在事件循环里查询，并在同一个
+    事件循环里做连接保活，否则在线程池中调用同步 Session。
+    """
+
+    def __init__(self, session, skuIds, areaId, interval=3, intervals=None,
+                 concurrency=DEFAULT_WATCH_CONCURRENCY, asyncIO=False):
+        """
+        :param session: JdSession.Session
+        :param skuIds: 商品id字符串或 dict，格式同 utils.parse_sku_id，如 '123:2,456'
+        :param areaId: 地区id
+        :param interval: 默认库存查询间隔(秒)
+        :param intervals: 单个商品的查询间隔，格式同 skuIds，如 '123:1,456:5'
+        :param concurrency: 同时进行的库存查询数上限
+        :param asyncIO: 是否使用 AsyncSession 查询
+        """
+        self.session = session
+        self.skus = {skuId: int(count) for skuId, count in parse_sku_id(skuIds).items()}
+        self.areaId = areaId
+        self.interval = interval
+        self.intervals = {skuId: float(value) for skuId, value in parse_sku_id(intervals or {}).items()}
+        self.concurrency = max(1, int(concurrency))
+        self.asyncIO = asyncIO and asyncsession.available()
+        self.pollCounts = dict.fromkeys(self.skus, 0)
+        self.schedulers = {skuId: PollScheduler.fromConfig(self.intervalOf(skuId)) for skuId in self.skus}
+        self._stopped = False
+
+    def intervalOf(self, skuId):
+        """获取商品的查询间隔(秒)"""
+        return self.intervals.get(skuId, self.interval)
+
+    def report(self):
+        """输出各商品的查询次数和节拍统计"""
+        for skuId, scheduler in self.schedulers.items():
+            logger.info('商品 {0} 已查询{1}次，{2}'.format(skuId, self.pollCounts[skuId], scheduler.report()))
+
+    def stop(self):
+        """停止监听，可在其他线程中调用；在 run() 之前调用同样有效，停止后 run() 立即返回 None"""
+        self._stopped = True
+
+    def run(self):
+        """运行监听，直到有商品有货或被停止
+        :return: (skuId, skuNum)，被停止时返回 None
+        """
+        return asyncio.run(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        found = loop.create_future()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        logger.info('开始监听{0}个商品库存，并发上限{1}{2}'.format(
+            len(self.skus), self.concurrency, '，使用异步请求' if self.asyncIO else ''))
+
+        asess = asyncsession.AsyncSession(self.session) if self.asyncIO else None
+        if asess is not None:
+            query = asess.getItemStock
+        else:
+            executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='watchlist')
+
+            async def query(*args):
+                return await loop.run_in_executor(executor, self.session.getItemStock, *args)
+
+        tasks = [asyncio.ensure_future(self._watch(skuId, index, semaphore, query, found))
+                 for index, skuId in enumerate(self.skus)]
+        tasks.append(asyncio.ensure_future(self._waitStop(found)))
+        if asess is not None and self.session.heartbeat is not None:
+            # 异步查询的连接不在 requests 连接池中，由同一个事件循环保活
+            tasks.append(asyncio.ensure_future(asess.keepAlive(self.session.heartbeat.interval)))
+        try:
+            return await found
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if asess is not None:
+                await asess.close()
+            else:
+                # 不等待其他商品仍在进行的查询，有货的商品立即进入下单流程
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _watch(self, skuId, index, semaphore, query, found):
+        skuNum = self.skus[skuId]
+        scheduler = self.schedulers[skuId]
+
+        # 错开各商品的首次查询，避免同时发出请求
+        await asyncio.sleep(self.intervalOf(skuId) * index / len(self.skus))
+        while not found.done():
+            # 按固定节拍查询，等待并发名额的时间也计入节拍
+            await asyncio.sleep(scheduler.nextDelay())
+            scheduler.markFired()
+            async with semaphore:
+                try:
+                    inStock = await query(skuId, skuNum, self.areaId)
+                except Exception as e:
+                    logger.error('查询商品 {0} 库存出错: {1}'.format(skuId, e))
+                    inStock = False
+            self.pollCounts[skuId] += 1
+            scheduler.record(inStock)
+            if inStock:
+                if not found.done():
+                    logger.info('{0} 满足下单条件'.format(skuId))
+                    found.set_result((skuId, skuNum))
+                return
+
+    async def _waitStop(self, found):
+        while not self._stopped:
+            await asyncio.sleep(STOP_CHECK_INTERVAL)
+        if not found.done():
+            logger.info('已停止监听商品库存')
+            found.set_result(None)